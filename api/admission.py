@@ -0,0 +1,159 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+
+class MemoryBuckets:
+    """Token buckets kept in this worker, bounded to the `max_keys` most recent keys.
+
+    Every gunicorn worker counts on its own, so a client may get up to
+    workers x capacity before it is throttled everywhere.
+    """
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()  # key -> (tokens, monotonic time of last update)
+        self._lock = threading.Lock()
+
+    def take(self, key, capacity, rate, cost=1):
+        # Seconds until `cost` tokens are available, 0 if they were taken
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * rate)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return 0.0 if allowed else (cost - tokens) / rate
+
+
+class PostgresBuckets:
+    """Token buckets shared by every worker, one row per key in an UNLOGGED table.
+
+    Refill and take happen in a single upsert, timed by the database clock, over a
+    connection of its own so the check never waits for the SQLAlchemy pool. When
+    Postgres is unreachable requests are let through: the limiter must not turn a
+    database hiccup into an outage.
+    """
+
+    # EXCLUDED.updated_at is "now"; every SET expression sees the old row
+    REFILL = 'least(%(capacity)s, b.tokens + (EXCLUDED.updated_at - b.updated_at) * %(rate)s)'
+    TAKE_SQL = f"""
+        INSERT INTO {{table}} AS b (key, tokens, updated_at, allowed)
+        VALUES (%(key)s, %(capacity)s - %(cost)s, extract(epoch FROM clock_timestamp()), true)
+        ON CONFLICT (key) DO UPDATE SET
+            tokens = CASE WHEN {REFILL} >= %(cost)s THEN {REFILL} - %(cost)s ELSE {REFILL} END,
+            allowed = {REFILL} >= %(cost)s,
+            updated_at = EXCLUDED.updated_at
+        RETURNING allowed, tokens
+    """
+
+    def __init__(self, dsn, table='rate_limit_bucket', idle_seconds=3600, purge_every=10000):
+        import psycopg2
+
+        self._psycopg2 = psycopg2
+        self.dsn = dsn
+        self.table = table
+        self.idle_seconds = idle_seconds
+        self.purge_every = purge_every
+        self._conn = None
+        self._calls = 0
+        self._lock = threading.Lock()
+
+    def take(self, key, capacity, rate, cost=1):
+        params = {'key': key, 'capacity': capacity, 'rate': rate, 'cost': cost}
+        with self._lock:
+            try:
+                if self._conn is None or self._conn.closed:
+                    self._conn = self._connect()
+                with self._conn.cursor() as cursor:
+                    cursor.execute(self.TAKE_SQL.format(table=self.table), params)
+                    allowed, tokens = cursor.fetchone()
+                    self._calls += 1
+                    if self._calls % self.purge_every == 0:
+                        # Idle buckets are full again, dropping them changes nothing
+                        cursor.execute(f'DELETE FROM {self.table} '
+                                       f'WHERE updated_at < extract(epoch FROM clock_timestamp()) - %s',
+                                       (self.idle_seconds,))
+            except self._psycopg2.Error:
+                logging.exception('Rate limit backend unavailable, letting the request through')
+                self._conn = None
+                return 0.0
+        return 0.0 if allowed else (cost - tokens) / rate
+
+    def _connect(self):
+        conn = self._psycopg2.connect(self.dsn)
+        conn.autocommit = True
+        with conn.cursor() as cursor:
+            # UNLOGGED: no WAL per request; losing the buckets in a crash only refills them
+            cursor.execute(f'CREATE UNLOGGED TABLE IF NOT EXISTS {self.table} ('
+                           'key text PRIMARY KEY, tokens double precision NOT NULL, '
+                           'updated_at double precision NOT NULL, allowed boolean NOT NULL)')
+        return conn
+
+
+class RateLimiter:
+    """Per-client token buckets for each route class.
+
+    `limits` maps a route class to (burst, tokens per second); classes missing
+    from it, or with a rate of 0, are not limited.
+    """
+
+    def __init__(self, backend, limits=None):
+        self.backend = backend
+        self.limits = limits or {}
+        self._rejected = {}  # route class -> int
+        self._lock = threading.Lock()
+
+    def retry_after(self, route_class, client):
+        # Takes a token for the client, returns seconds to wait if there was none
+        burst, rate = self.limits.get(route_class, (0, 0))
+        if rate <= 0:
+            return 0.0
+        wait = self.backend.take(f'{route_class}:{client}', burst, rate)
+        if wait:
+            with self._lock:
+                self._rejected[route_class] = self._rejected.get(route_class, 0) + 1
+        return wait
+
+    def stats(self):
+        with self._lock:
+            return dict(self._rejected)
+
+
+class ConcurrencyLimiter:
+    """Caps the requests a worker serves at once and turns the rest away.
+
+    Low priority requests may only use `limit - reserved` slots, so under overload
+    they are shed first and the reserved slots stay free for high priority ones.
+    A limit of 0 disables the check.
+    """
+
+    def __init__(self, limit=0, reserved=0):
+        self.limit = limit
+        self.reserved = reserved
+        self.in_flight = 0
+        self._rejected = {}  # priority name -> int
+        self._lock = threading.Lock()
+
+    def try_acquire(self, high_priority):
+        with self._lock:
+            cap = self.limit if high_priority else self.limit - self.reserved
+            if self.limit and self.in_flight >= cap:
+                name = 'high' if high_priority else 'low'
+                self._rejected[name] = self._rejected.get(name, 0) + 1
+                return False
+            self.in_flight += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def stats(self):
+        with self._lock:
+            return self.in_flight, dict(self._rejected)
@@ -1,19 +1,166 @@
-from flask import Flask, flash, jsonify, redirect, render_template, request, url_for
+from flask import Blueprint, Flask, Response, current_app, flash, g, json, jsonify, redirect, render_template, request, url_for
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user, UserMixin
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
 from sqlalchemy.dialects.postgresql import JSON
-from werkzeug.security import generate_password_hash, check_password_hash
+from sqlalchemy.exc import DBAPIError, IntegrityError
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.orm.exc import StaleDataError
 from dotenv import load_dotenv
-from functools import wraps
+from functools import partial, wraps
+import calendar
+import click
+import csv
+import hashlib
+import io
+import ipaddress
 import os
+import re
+import socket
+import threading
+import time
+import zlib
 import jwt
+from collections import OrderedDict, deque
 from datetime import datetime, timedelta, timezone
-from flask_cors import CORS
 import logging
+import logging.handlers
 from pythonjsonlogger import jsonlogger
+from admission import ConcurrencyLimiter, MemoryBuckets, PostgresBuckets, RateLimiter
+from intake import OrderJournal
+from events import EventBroker, MemoryBackend, PostgresBackend, format_sse
+from hashing import HashingBusy, PasswordHasher
+from log_pipeline import BatchFileHandler, LogPipeline
+from metrics import Metrics
+from search import MenuSearchIndex, tokenize
+
+load_dotenv()  # Load environment variables from .env file
+
+
+def load_config():
+    # Everything deployment-specific comes from the environment (or api/.env)
+    threads = int(os.getenv('WEB_THREADS', 8))
+    reserved = int(os.getenv('ADMISSION_RESERVED', 2))
+    return {
+        'SECRET_KEY': os.getenv('SECRET_KEY'),
+        'SQLALCHEMY_DATABASE_URI': os.getenv('SQLALCHEMY_DATABASE_URI'),
+        'SQLALCHEMY_ECHO': os.getenv('SQLALCHEMY_ECHO', '0') == '1',
+        'SQLALCHEMY_TRACK_MODIFICATIONS': False,
+        'DB_POOL_SIZE': int(os.getenv('DB_POOL_SIZE', 10)),
+        'DB_MAX_OVERFLOW': int(os.getenv('DB_MAX_OVERFLOW', 20)),
+        'DB_POOL_TIMEOUT': int(os.getenv('DB_POOL_TIMEOUT', 10)),  # seconds to wait for a free connection
+        'DB_POOL_RECYCLE': int(os.getenv('DB_POOL_RECYCLE', 1800)),  # seconds
+        'DB_POOL_PRE_PING': os.getenv('DB_POOL_PRE_PING', '1') == '1',
+        # Worker processes serving this app; gunicorn.conf.py exports its worker count,
+        # anything else (flask CLI, dev server) is a single process
+        'WEB_CONCURRENCY': int(os.getenv('WEB_CONCURRENCY', 1)),
+        'EVENTS_BACKEND': os.getenv('EVENTS_BACKEND', 'memory'),
+        'EVENTS_QUEUE_SIZE': int(os.getenv('EVENTS_QUEUE_SIZE', 32)),
+        'EVENTS_HEARTBEAT': int(os.getenv('EVENTS_HEARTBEAT', 15)),  # seconds
+        'EVENTS_MAX_STREAM_SECONDS': int(os.getenv('EVENTS_MAX_STREAM_SECONDS', 600)),
+        # Each SSE stream holds a gthread thread for its whole life; by default streams may
+        # take half of the threads public reads can use, the rest keep serving requests
+        'EVENTS_MAX_SUBSCRIBERS': int(os.getenv('EVENTS_MAX_SUBSCRIBERS', max(1, (threads - reserved) // 2))),
+        'LOG_MODE': os.getenv('LOG_MODE', 'queue'),  # 'sync' writes from the request thread
+        'LOG_FILE': os.getenv('LOG_FILE', 'api.json'),
+        'LOG_SYSLOG_ADDRESS': os.getenv('LOG_SYSLOG_ADDRESS', 'logstash:5050'),  # empty disables shipping
+        'LOG_SYSLOG_PROTOCOL': os.getenv('LOG_SYSLOG_PROTOCOL', 'udp'),
+        'LOG_QUEUE_SIZE': int(os.getenv('LOG_QUEUE_SIZE', 10000)),
+        'LOG_BATCH_SIZE': int(os.getenv('LOG_BATCH_SIZE', 256)),
+        'LOG_FLUSH_INTERVAL': float(os.getenv('LOG_FLUSH_INTERVAL', 0.5)),  # seconds
+        'LOG_SAMPLE_WATERMARK': float(os.getenv('LOG_SAMPLE_WATERMARK', 0.8)),  # queue fill ratio
+        'LOG_SAMPLE_EVERY': int(os.getenv('LOG_SAMPLE_EVERY', 10)),
+        'METRICS_TOKEN': os.getenv('METRICS_TOKEN'),  # lets a scraper read /api/metrics without an admin login
+        'METRICS_SLOW_REQUEST_MS': int(os.getenv('METRICS_SLOW_REQUEST_MS', 500)),  # 0 disables the slow log
+        'ITEM_SNAPSHOT_TTL': int(os.getenv('ITEM_SNAPSHOT_TTL', 30)),  # seconds
+        'ITEM_SNAPSHOT_MAX_RESTAURANTS': int(os.getenv('ITEM_SNAPSHOT_MAX_RESTAURANTS', 64)),
+        'MENU_CACHE_TTL': int(os.getenv('MENU_CACHE_TTL', 300)),  # seconds, safety net for lost invalidations
+        'MENU_CACHE_MAX_AGE': int(os.getenv('MENU_CACHE_MAX_AGE', 5)),  # Cache-Control max-age for browsers and nginx
+        'MENU_CACHE_MAX_ENTRIES': int(os.getenv('MENU_CACHE_MAX_ENTRIES', 256)),
+        'SEARCH_INDEX_TTL': int(os.getenv('SEARCH_INDEX_TTL', 600)),  # seconds
+        'SEARCH_INDEX_MAX_ITEMS': int(os.getenv('SEARCH_INDEX_MAX_ITEMS', 200000)),
+        'PASSWORD_HASH_METHOD': os.getenv('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:260000'),
+        'HASH_WORKERS': int(os.getenv('HASH_WORKERS', 2)),  # 0 hashes in the request thread
+        'HASH_QUEUE_LIMIT': int(os.getenv('HASH_QUEUE_LIMIT', 16)),
+        'HASH_TIMEOUT': int(os.getenv('HASH_TIMEOUT', 10)),  # seconds
+        'PRINCIPAL_CACHE_TTL': int(os.getenv('PRINCIPAL_CACHE_TTL', 60)),  # seconds
+        'PRINCIPAL_CACHE_SIZE': int(os.getenv('PRINCIPAL_CACHE_SIZE', 1024)),
+        'STREAM_TICKET_TTL': int(os.getenv('STREAM_TICKET_TTL', 60)),  # seconds
+        'LOGIN_WINDOW': int(os.getenv('LOGIN_WINDOW', 300)),  # seconds
+        'LOGIN_MAX_ATTEMPTS_PER_USER': int(os.getenv('LOGIN_MAX_ATTEMPTS_PER_USER', 5)),
+        'LOGIN_MAX_ATTEMPTS_PER_IP': int(os.getenv('LOGIN_MAX_ATTEMPTS_PER_IP', 20)),
+        # Addresses or networks of the proxies whose X-Real-IP header is believed (nginx.conf
+        # sets it); requests from anywhere else are keyed on their own address
+        'TRUSTED_PROXIES': os.getenv('TRUSTED_PROXIES', '127.0.0.1,::1'),
+        'RATE_LIMIT_BACKEND': os.getenv('RATE_LIMIT_BACKEND', 'memory'),  # 'postgres' shares buckets between workers
+        # Per client IP: burst size and tokens per second, a rate of 0 disables the class.
+        # Guests of one restaurant often share its Wi-Fi address, so keep them generous.
+        'RATE_LIMIT_ORDER_BURST': int(os.getenv('RATE_LIMIT_ORDER_BURST', 30)),
+        'RATE_LIMIT_ORDER_RATE': float(os.getenv('RATE_LIMIT_ORDER_RATE', 1)),
+        'RATE_LIMIT_READ_BURST': int(os.getenv('RATE_LIMIT_READ_BURST', 200)),
+        'RATE_LIMIT_READ_RATE': float(os.getenv('RATE_LIMIT_READ_RATE', 50)),
+        # Requests served at once per worker (0 disables); public reads may not take the last
+        # ADMISSION_RESERVED slots, which stay free for order submission and admins
+        'ADMISSION_MAX_IN_FLIGHT': int(os.getenv('ADMISSION_MAX_IN_FLIGHT', threads)),
+        'ADMISSION_RESERVED': reserved,
+        # 'journal' answers order submissions once they are fsynced to a local journal and
+        # inserts them in batches from a background thread, see intake.py
+        'ORDER_INTAKE': os.getenv('ORDER_INTAKE', 'direct'),
+        'ORDER_JOURNAL_DIR': os.getenv('ORDER_JOURNAL_DIR', 'order-journal'),  # must survive restarts
+        'ORDER_JOURNAL_BATCH': int(os.getenv('ORDER_JOURNAL_BATCH', 500)),  # orders per transaction
+        'ORDER_ID_BLOCK': int(os.getenv('ORDER_ID_BLOCK', 50)),  # journaled order ids reserved at once
+        'ORDER_ARCHIVE_AFTER_DAYS': int(os.getenv('ORDER_ARCHIVE_AFTER_DAYS', 90)),
+        'ROLLUP_FLUSH_INTERVAL': float(os.getenv('ROLLUP_FLUSH_INTERVAL', 1)),  # seconds, Postgres only
+        'IDEMPOTENCY_TTL': int(os.getenv('IDEMPOTENCY_TTL', 24 * 3600)),  # seconds
+        'IDEMPOTENCY_CACHE_SIZE': int(os.getenv('IDEMPOTENCY_CACHE_SIZE', 10000)),
+        'EXPORT_MAX_CONCURRENT': int(os.getenv('EXPORT_MAX_CONCURRENT', 2)),  # per worker
+    }
+
+
+def engine_options(config):
+    options = {
+        'pool_pre_ping': config['DB_POOL_PRE_PING'],
+        'pool_recycle': config['DB_POOL_RECYCLE'],
+    }
+    # SQLite uses a pool without size limits
+    if not (config['SQLALCHEMY_DATABASE_URI'] or '').startswith('sqlite'):
+        options.update({
+            'pool_size': config['DB_POOL_SIZE'],
+            'max_overflow': config['DB_MAX_OVERFLOW'],
+            'pool_timeout': config['DB_POOL_TIMEOUT'],
+        })
+    if (config['SQLALCHEMY_DATABASE_URI'] or '').startswith(('postgresql://', 'postgresql+psycopg2://')):
+        # executemany() UPDATEs (bulk menu import) go out in pages instead of one round trip per row
+        options['executemany_mode'] = 'values_plus_batch'
+    return options
+
+
+def make_syslog_handler(address, protocol):
+    # address is "host:port"; an unreachable shipper must not keep the API from starting
+    if not address:
+        return None
+    host, _, port = address.rpartition(':')
+    socktype = socket.SOCK_STREAM if protocol == 'tcp' else socket.SOCK_DGRAM
+    try:
+        return logging.handlers.SysLogHandler(address=(host, int(port)), socktype=socktype)
+    except OSError as e:
+        logging.warning(f"Log shipper {address} unavailable, logging to file only: {e}")
+        return None
+
+
+# Credentials that can ride in a query string (see get_admin()) are masked before logging
+LOGGED_QUERY_CREDENTIALS = re.compile(r'([?&](?:token|ticket)=)[^&\s"]*')
+
+
+def redact_query_credentials(record):
+    message = record.getMessage()
+    redacted = LOGGED_QUERY_CREDENTIALS.sub(r'\1[redacted]', message)
+    if redacted != message:
+        record.msg, record.args = redacted, None
+    return True
+
 
-def setup_logging():
+def setup_logging(app):
     formatter = jsonlogger.JsonFormatter(
         '%(asctime)s %(levelname)s %(message)s %(module)s %(funcName)s %(lineno)s %(pathname)s',
         rename_fields={
@@ -23,46 +170,63 @@ def setup_logging():
         datefmt='%Y-%m-%dT%H:%M:%S%z'
     )
 
-    file_handler = logging.FileHandler('api.json')
-    file_handler.setFormatter(formatter)
-    file_handler.setLevel(logging.INFO)
+    targets = {'file': BatchFileHandler(app.config['LOG_FILE'])}
+    syslog_handler = make_syslog_handler(app.config['LOG_SYSLOG_ADDRESS'], app.config['LOG_SYSLOG_PROTOCOL'])
+    if syslog_handler:
+        targets['syslog'] = syslog_handler
+    for target in targets.values():
+        target.setFormatter(formatter)
+        target.setLevel(logging.INFO)
+
+    previous = app.extensions.pop('log_pipeline', None)
+    if previous:
+        previous.stop()
+
+    if app.config['LOG_MODE'] == 'sync':
+        def handlers(*names):
+            return [targets[name] for name in names if name in targets]
+    else:
+        # Request threads only enqueue, a background thread writes batches (log_pipeline.py)
+        pipeline = LogPipeline(
+            targets,
+            queue_size=app.config['LOG_QUEUE_SIZE'],
+            batch_size=app.config['LOG_BATCH_SIZE'],
+            flush_interval=app.config['LOG_FLUSH_INTERVAL'],
+            sample_watermark=app.config['LOG_SAMPLE_WATERMARK'],
+            sample_every=app.config['LOG_SAMPLE_EVERY']
+        )
+        pipeline.start()
+        app.extensions['log_pipeline'] = pipeline
 
-    syslog_handler = logging.handlers.SysLogHandler(address=('logstash', 5050))
-    syslog_handler.setFormatter(formatter)
-    syslog_handler.setLevel(logging.INFO)
+        def handlers(*names):
+            return [pipeline.handler(*names, level=logging.INFO)]
 
     app.logger.handlers.clear()
-    app.logger.addHandler(file_handler)
-    app.logger.addHandler(syslog_handler)
+    app.logger.handlers.extend(handlers('file', 'syslog'))
     app.logger.setLevel(logging.INFO)
 
     sql_logger = logging.getLogger('sqlalchemy.engine')
-    sql_logger.addHandler(file_handler)
-    sql_logger.addHandler(syslog_handler)
+    sql_logger.handlers.clear()
+    sql_logger.handlers.extend(handlers('file', 'syslog'))
     sql_logger.setLevel(logging.WARNING)
 
     werkzeug_logger = logging.getLogger('werkzeug')
     werkzeug_logger.handlers.clear()
-    werkzeug_logger.addHandler(syslog_handler)
+    werkzeug_logger.handlers.extend(handlers('syslog'))
     werkzeug_logger.setLevel(logging.WARNING)
 
-load_dotenv()  # Load environment variables from .env file
-
-app = Flask(__name__)
-CORS(app)
-app.secret_key = os.getenv('SECRET_KEY')
-
-setup_logging()
+    for handler in app.logger.handlers + sql_logger.handlers + werkzeug_logger.handlers:
+        handler.addFilter(redact_query_credentials)
 
+db = SQLAlchemy()
 login_manager = LoginManager()
-login_manager.init_app(app)
-
-# Enable CORS for the Flask app
-CORS(app, resources={r"/*": {"origins": ["http://localhost:5173", "http://38.244.138.103:22594", "https://38.244.138.103:5173"]}}, supports_credentials=True) #TODO: change to production domain
-app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('SQLALCHEMY_DATABASE_URI')
-db = SQLAlchemy(app)
+metrics = Metrics()
+api = Blueprint('api', __name__, cli_group=None)
 
-app.config['SQLALCHEMY_ECHO'] = True
+# 🔑 Password hashes are computed in a process pool, see hashing.py. Changing
+# PASSWORD_HASH_METHOD re-hashes each password on its owner's next login.
+# Configured by create_app()
+hasher = PasswordHasher('pbkdf2:sha256:260000')
 
 # 👑 Admin users
 class AdminUser(UserMixin, db.Model):
@@ -71,12 +235,28 @@ class AdminUser(UserMixin, db.Model):
     password_hash = db.Column(db.String(256), nullable=False)
     restaurant_id = db.Column(db.Integer, db.ForeignKey('restaurant.id'), nullable=False)
     superuser = db.Column(db.Boolean, default=False)  # 🔥 New field!
+    # Bumped to revoke every token issued so far (role change, password reset...)
+    token_version = db.Column(db.Integer, nullable=False, default=0, server_default=db.text('0'))
 
+    # Both raise HashingBusy when the hashing pool is saturated
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = hasher.hash(password)
 
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return hasher.verify(self.password_hash, password)
+
+    def get_id(self):
+        return str(self.id)
+
+
+# 🪪 Admin as seen by request handlers, built from token claims without a database hit
+class AdminPrincipal(UserMixin):
+    def __init__(self, payload):
+        self.id = payload['user_id']
+        self.username = payload['username']
+        self.restaurant_id = payload['restaurant_id']
+        self.superuser = payload['superuser']
+        self.ver = payload.get('ver', 0)
 
     def get_id(self):
         return str(self.id)
@@ -95,26 +275,209 @@ class Restaurant(db.Model):
     orders = db.relationship('Order', backref='restaurant', lazy=True)
     admins = db.relationship('AdminUser', backref='restaurant', lazy=True)
 
+    FIELDS = ('id', 'name', 'address', 'working_hours', 'contact_info', 'description')
+
+    def to_dict(self, fields=FIELDS, include_items=True):
+        # Load items eagerly (selectinload/joinedload) before calling this on many rows
+        data = {field: getattr(self, field) for field in fields}
+        if include_items:
+            data['items'] = [item.to_dict() for item in self.items]
+        return data
+
+# 📦 Order
+class Order(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    status = db.Column(db.Integer, nullable=False)
+    table_id = db.Column(db.Integer, nullable=False)
+    order_number = db.Column(db.Integer, nullable=False)
+    items = db.Column(JSON(none_as_null=True), nullable=True)  # legacy rows only, new orders use lines
+    total_cost = db.Column(db.Integer, nullable=False)
+    restaurant_id = db.Column(db.Integer, db.ForeignKey('restaurant.id'), nullable=False)
+    # Bumped by every ORM update, which only applies if the version is still the one that
+    # was read (UPDATE ... WHERE version = :read); StaleDataError means someone else won
+    version = db.Column(db.Integer, nullable=False, default=0, server_default=db.text('0'))
+    # Set by every create and status change, see next_change_seq() and order_changes()
+    change_seq = db.Column(db.BigInteger, nullable=False, default=0, server_default=db.text('0'))
+
+    __mapper_args__ = {'version_id_col': version}
+
+    # Keyset pagination of the admin board walks these indexes by id
+    __table_args__ = (
+        db.Index('ix_order_restaurant_status_id', 'restaurant_id', 'status', 'id'),
+        db.Index('ix_order_restaurant_id_id', 'restaurant_id', 'id'),
+        db.Index('ix_order_status_id', 'status', 'id'),
+        db.Index('ix_order_change_seq_id', 'change_seq', 'id'),
+        db.Index('ix_order_restaurant_change_seq_id', 'restaurant_id', 'change_seq', 'id'),
+        # Rollup rebuilds walk the history by time range
+        db.Index('ix_order_order_number', 'order_number'),
+    )
+
+    lines = db.relationship('OrderLine', lazy=True, order_by='OrderLine.line_no')
+
+    def items_list(self):
+        # Load lines eagerly (selectinload) before calling this on many rows. Item ids are
+        # strings, as the cart keys the JSON orders were built from, whichever path it is
+        if self.items is not None:
+            return [{**item, 'id': str(item['id'])} for item in self.items]
+        return [line.to_dict(self.restaurant_id) for line in self.lines]
+
     def to_dict(self):
         return {
             'id': self.id,
+            'status': self.status,
+            'table_id': self.table_id,
+            'order_number': self.order_number,
+            'items': self.items_list(),
+            'total_cost': self.total_cost,
+            'restaurant_id': self.restaurant_id,
+            'version': self.version
+        }
+
+# 🧾 One row per ordered item. Name and price are kept as they were at purchase;
+# no foreign key to item so deleting a menu item keeps order history intact.
+class OrderLine(db.Model):
+    order_id = db.Column(db.Integer, db.ForeignKey('order.id'), primary_key=True)
+    line_no = db.Column(db.SmallInteger, primary_key=True, autoincrement=False)
+    item_id = db.Column(db.Integer, nullable=False)
+    quantity = db.Column(db.Integer, nullable=False)
+    price = db.Column(db.Integer, nullable=False)
+    name = db.Column(db.String(100), nullable=False)
+
+    item = db.relationship('Item', primaryjoin='foreign(OrderLine.item_id) == Item.id', viewonly=True, lazy='joined')
+
+    __table_args__ = (
+        db.Index('ix_order_line_item_id_order_id', 'item_id', 'order_id'),
+    )
+
+    def to_dict(self, restaurant_id):
+        # Same shape as the JSON orders used to carry. Unlike their purchase-time copies,
+        # src, description and available are the item's current ones (None/False once
+        # the item is deleted); name and price are still as ordered
+        return {
+            'id': str(self.item_id),
             'name': self.name,
-            'address': self.address,
-            'working_hours': self.working_hours,
-            'contact_info': self.contact_info,
-            'description': self.description,
-            'items': [item.to_dict() for item in self.items]
+            'price': self.price,
+            'quantity': self.quantity,
+            'src': self.item.src if self.item else None,
+            'description': self.item.description if self.item else None,
+            'available': self.item.available if self.item else False,
+            'restaurant_id': restaurant_id
         }
 
-# 📦 Order
-class Order(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
+# 🗄️ Closed orders moved out of the hot order table by `flask archive-orders`, so the
+# tables and indexes every live request touches only hold recent and open orders. On
+# Postgres both archive tables are partitioned by month of order_number; the partitions
+# are created by archive_orders() as it needs them.
+class OrderArchive(db.Model):
+    __tablename__ = 'order_archive'
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    order_number = db.Column(db.Integer, primary_key=True, autoincrement=False)  # partition key
     status = db.Column(db.Integer, nullable=False)
     table_id = db.Column(db.Integer, nullable=False)
-    order_number = db.Column(db.Integer, nullable=False)
-    items = db.Column(JSON, nullable=True)
     total_cost = db.Column(db.Integer, nullable=False)
     restaurant_id = db.Column(db.Integer, db.ForeignKey('restaurant.id'), nullable=False)
+    version = db.Column(db.Integer, nullable=False)
+    # Set when archived, so boards catching up through order_changes() drop the order
+    change_seq = db.Column(db.BigInteger, nullable=False, default=0, server_default=db.text('0'))
+
+    __table_args__ = (
+        db.Index('ix_order_archive_restaurant_id_id', 'restaurant_id', 'id'),
+        db.Index('ix_order_archive_change_seq_id', 'change_seq', 'id'),
+        db.Index('ix_order_archive_restaurant_change_seq_id', 'restaurant_id', 'change_seq', 'id'),
+        {'postgresql_partition_by': 'RANGE (order_number)'},
+    )
+
+    lines = db.relationship('OrderLineArchive', lazy=True, order_by='OrderLineArchive.line_no',
+                            primaryjoin='and_(OrderArchive.id == foreign(OrderLineArchive.order_id), '
+                                        'OrderArchive.order_number == foreign(OrderLineArchive.order_number))',
+                            viewonly=True)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'status': self.status,
+            'table_id': self.table_id,
+            'order_number': self.order_number,
+            'items': [line.to_dict(self.restaurant_id) for line in self.lines],
+            'total_cost': self.total_cost,
+            'restaurant_id': self.restaurant_id,
+            'version': self.version,
+            'archived': True
+        }
+
+
+class OrderLineArchive(db.Model):
+    __tablename__ = 'order_line_archive'
+    order_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    order_number = db.Column(db.Integer, primary_key=True, autoincrement=False)  # partition key, as its order's
+    line_no = db.Column(db.SmallInteger, primary_key=True, autoincrement=False)
+    item_id = db.Column(db.Integer, nullable=False)
+    quantity = db.Column(db.Integer, nullable=False)
+    price = db.Column(db.Integer, nullable=False)
+    name = db.Column(db.String(100), nullable=False)
+
+    item = db.relationship('Item', primaryjoin='foreign(OrderLineArchive.item_id) == Item.id', viewonly=True,
+                           lazy='joined')
+
+    __table_args__ = (
+        {'postgresql_partition_by': 'RANGE (order_number)'},
+    )
+
+    to_dict = OrderLine.to_dict
+
+# 📈 Sales rollups, kept up to date by orderNew() and order() and recomputable with
+# `flask rebuild-rollups`. Buckets are UTC epoch seconds of the hour (day for items)
+# the order was placed in, so completing an order updates the bucket it was placed in.
+class SalesRollup(db.Model):
+    restaurant_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    bucket = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    orders = db.Column(db.Integer, nullable=False, default=0)
+    completed = db.Column(db.Integer, nullable=False, default=0)
+    canceled = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.BigInteger, nullable=False, default=0)  # completed orders only
+
+
+class ItemSalesRollup(db.Model):
+    restaurant_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    bucket = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    item_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    quantity = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.BigInteger, nullable=False, default=0)
+
+
+# Increments not folded into the rollups yet (Postgres, see rollup_add()). Orders only
+# insert here, so concurrent orders of a restaurant never wait on its rollup row.
+class SalesRollupDelta(db.Model):
+    id = db.Column(db.BigInteger().with_variant(db.Integer, 'sqlite'), primary_key=True)
+    restaurant_id = db.Column(db.Integer, nullable=False)
+    bucket = db.Column(db.Integer, nullable=False)
+    orders = db.Column(db.Integer, nullable=False, default=0)
+    completed = db.Column(db.Integer, nullable=False, default=0)
+    canceled = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.BigInteger, nullable=False, default=0)
+
+
+class ItemSalesRollupDelta(db.Model):
+    id = db.Column(db.BigInteger().with_variant(db.Integer, 'sqlite'), primary_key=True)
+    restaurant_id = db.Column(db.Integer, nullable=False)
+    bucket = db.Column(db.Integer, nullable=False)
+    item_id = db.Column(db.Integer, nullable=False)
+    quantity = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.BigInteger, nullable=False, default=0)
+
+
+ROLLUP_DELTAS = {SalesRollup: SalesRollupDelta, ItemSalesRollup: ItemSalesRollupDelta}
+
+
+# 🔁 Responses of requests sent with an Idempotency-Key, see idempotent_replay()
+class IdempotencyKey(db.Model):
+    scope = db.Column(db.String(20), primary_key=True)
+    key = db.Column(db.String(100), primary_key=True)
+    request_hash = db.Column(db.String(64), nullable=False)
+    status_code = db.Column(db.SmallInteger, nullable=False)
+    response = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.Integer, nullable=False, index=True)
+
 
 # 🛍️ Item
 class Item(db.Model):
@@ -137,20 +500,16 @@ class Item(db.Model):
         }
 
 class LowLevelItem():
-    def __init__(self, item_id, quantity):
-        self.id = item_id
-        item = Item.query.get(item_id)
-        try:
-            self.quantity = quantity
-            self.price = item.price
-            self.name = item.name
-            self.src = item.src
-            self.description = item.description
-            self.available = item.available
-            self.restaurant_id = item.restaurant_id
-        except Exception as e:
-            # print(f"Error initializing LowLevelItem: {e}")
-            pass
+    def __init__(self, item, quantity):
+        # item is a snapshot dict (see get_item_snapshot), not an ORM object
+        self.id = item['id']
+        self.quantity = quantity
+        self.price = item['price']
+        self.name = item['name']
+        self.src = item['src']
+        self.description = item['description']
+        self.available = item['available']
+        self.restaurant_id = item['restaurant_id']
     def to_dict(self):
         return {
             'id': self.id,
@@ -163,8 +522,597 @@ class LowLevelItem():
             'restaurant_id': self.restaurant_id
         }
 
-with app.app_context():
+
+# 🧾 Per-worker snapshot of every restaurant's items, used to price carts without
+# hitting the database. Item writes drop it through invalidate_menu(); the TTL bounds
+# how long another worker's write can stay invisible here if that event is lost.
+_item_snapshots = OrderedDict()  # restaurant_id -> (loaded_at, {item_id: item dict})
+_item_snapshots_lock = threading.Lock()
+
+
+def get_item_snapshot(restaurant_id, refresh=False):
+    broker.start()  # so other workers' menu invalidations reach us
+    now = time.monotonic()
+    with _item_snapshots_lock:
+        cached = _item_snapshots.get(restaurant_id)
+        if cached and not refresh and now - cached[0] < current_app.config['ITEM_SNAPSHOT_TTL']:
+            _item_snapshots.move_to_end(restaurant_id)
+            return cached[1]
+
+    # One set-based query for the whole menu of the restaurant
+    items = Item.query.filter_by(restaurant_id=restaurant_id).all()
+    snapshot = {item.id: item.to_dict() for item in items}
+
+    with _item_snapshots_lock:
+        _item_snapshots[restaurant_id] = (now, snapshot)
+        _item_snapshots.move_to_end(restaurant_id)
+        while len(_item_snapshots) > current_app.config['ITEM_SNAPSHOT_MAX_RESTAURANTS']:
+            _item_snapshots.popitem(last=False)
+    return snapshot
+
+
+def invalidate_item_snapshot(*restaurant_ids):
+    with _item_snapshots_lock:
+        for restaurant_id in restaurant_ids:
+            _item_snapshots.pop(restaurant_id, None)
+
+
+def cart_error(items):
+    """Return an error message for a malformed cart {"item_id": quantity}, or None."""
+    if not isinstance(items, dict):
+        return 'Invalid items format. Expected a dictionary of {"item_id": quantity}'
+    for item_id, quantity in items.items():
+        # bool is an int subclass, JSON true/false must not count as 1/0
+        if isinstance(quantity, bool) or not isinstance(quantity, int) or quantity < 1:
+            return f'Invalid quantity for item {item_id}. Expected a whole number of at least 1'
+    return None
+
+
+def resolve_cart(restaurant_id, items):
+    """Price a cart {"item_id": quantity} against one restaurant's menu.
+
+    Returns (lines, rejected) where lines is a list of LowLevelItem and rejected maps
+    'not_found' / 'unavailable' to the offending item ids. Items of other restaurants
+    count as not found. Raises ValueError on non-numeric item ids.
+    """
+    wanted = {int(item_id): quantity for item_id, quantity in items.items()}
+
+    snapshot = get_item_snapshot(restaurant_id)
+    if not wanted.keys() <= snapshot.keys():
+        # Maybe the item was added after our snapshot was taken (possibly by another worker)
+        snapshot = get_item_snapshot(restaurant_id, refresh=True)
+
+    lines = []
+    rejected = {'not_found': [], 'unavailable': []}
+    for item_id, quantity in wanted.items():
+        item = snapshot.get(item_id)
+        if item is None:
+            rejected['not_found'].append(item_id)
+        elif not item['available']:
+            rejected['unavailable'].append(item_id)
+        else:
+            lines.append(LowLevelItem(item, quantity))
+    return lines, rejected
+
+# 📣 Order events for the SSE streams. EVENTS_BACKEND=postgres fans events out to
+# every worker through LISTEN/NOTIFY; the default memory backend stays in-process.
+# A stream occupies a worker thread and an admission slot until it closes, so
+# production serves them from the separate events service (docker-compose.yml).
+
+
+def make_event_backend(config):
+    if config['EVENTS_BACKEND'] == 'postgres':
+        return PostgresBackend(config['SQLALCHEMY_DATABASE_URI'].replace('+psycopg2', ''))
+    return MemoryBackend()
+
+
+def make_rate_limit_backend(config):
+    if config['RATE_LIMIT_BACKEND'] == 'postgres':
+        return PostgresBuckets(config['SQLALCHEMY_DATABASE_URI'].replace('+psycopg2', ''))
+    return MemoryBuckets()
+
+
+# Configured by create_app()
+broker = EventBroker(MemoryBackend())
+
+
+def order_event(order, event_type):
+    # Items are left out to keep NOTIFY payloads small; clients fetch them if needed
+    event = {
+        'type': event_type,
+        'order': {
+            'id': order.id,
+            'status': order.status,
+            'table_id': order.table_id,
+            'order_number': order.order_number,
+            'total_cost': order.total_cost,
+            'restaurant_id': order.restaurant_id,
+            'version': order.version
+        }
+    }
+    return [f'order:{order.id}', f'restaurant:{order.restaurant_id}', 'orders'], event
+
+
+def publish_order(order, event_type):
+    broker.publish(*order_event(order, event_type))
+
+
+def event_stream(subscription, initial=()):
+    # Read now, the stream runs after the request context is gone
+    heartbeat = current_app.config['EVENTS_HEARTBEAT']
+    max_seconds = current_app.config['EVENTS_MAX_STREAM_SECONDS']
+
+    def generate():
+        deadline = time.monotonic() + max_seconds
+        yield 'retry: 3000\n\n'
+        for event in initial:
+            yield format_sse(event, event['type'])
+        # Streams are recycled after EVENTS_MAX_STREAM_SECONDS, EventSource reconnects
+        while time.monotonic() < deadline:
+            event = subscription.get(heartbeat)
+            if subscription.overflowed:
+                subscription.overflowed = False
+                yield format_sse({'type': 'resync'}, 'resync')
+            if event is None:
+                yield ': keepalive\n\n'
+            else:
+                yield format_sse(event, event['type'])
+
+    response = Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'  # Tell nginx not to buffer the stream
+    })
+    # The thread is busy until the stream closes, not just until the view returns, so the
+    # admission slot is handed back then (runs even if the client leaves before the first byte)
+    response.call_on_close(partial(broker.unsubscribe, subscription))
+    if g.pop('_admitted', False):
+        response.call_on_close(in_flight.release)
+    return response
+
+
+# 📋 Serialized menu responses, cached per worker. Menu writes call invalidate_menu(),
+# which goes through the event broker so every worker bumps its versions. ETags are
+# content hashes, so all workers agree on them.
+_menu_version = 0  # bumped by every menu change
+_menu_versions = {}  # restaurant_id -> _menu_version of its last change
+_menu_cache = OrderedDict()  # key -> (version, built_at, body, etag)
+_menu_lock = threading.Lock()
+
+
+def menu_version(restaurant_id=None):
+    if restaurant_id is None:
+        return _menu_version
+    return _menu_versions.get(restaurant_id, 0)
+
+
+def invalidate_menu(*restaurant_ids):
+    broker.publish(['menu'], {'type': 'menu', 'restaurant_ids': list(restaurant_ids)})
+
+
+def _on_menu_changed(event):
+    global _menu_version
+    with _menu_lock:
+        _menu_version += 1
+        for restaurant_id in event['restaurant_ids']:
+            _menu_versions[restaurant_id] = _menu_version
+    invalidate_item_snapshot(*event['restaurant_ids'])
+
+
+broker.add_listener('menu', _on_menu_changed)
+
+
+def cached_menu_response(key, build, restaurant_id=None):
+    """Serve build() as JSON from the menu cache, honoring If-None-Match.
+
+    restaurant_id=None ties the entry to the whole catalog, otherwise only changes to
+    that restaurant invalidate it. build() may return None for a 404.
+    """
+    broker.start()
+    config = current_app.config
+    version = menu_version(restaurant_id)
+    now = time.monotonic()
+    with _menu_lock:
+        entry = _menu_cache.get(key)
+    if entry is None or entry[0] != version or now - entry[1] >= config['MENU_CACHE_TTL']:
+        data = build()
+        if data is None:
+            return None
+        body = json.dumps(data).encode()
+        entry = (version, now, body, hashlib.sha1(body).hexdigest())
+        with _menu_lock:
+            _menu_cache[key] = entry
+            _menu_cache.move_to_end(key)
+            while len(_menu_cache) > config['MENU_CACHE_MAX_ENTRIES']:
+                _menu_cache.popitem(last=False)
+
+    response = Response(entry[2], mimetype='application/json')
+    response.set_etag(entry[3])
+    response.cache_control.public = True
+    response.cache_control.max_age = config['MENU_CACHE_MAX_AGE']
+    return response.make_conditional(request)
+
+
+def parse_restaurant_shape():
+    """Read ?fields=name,address and ?include=items for restaurant responses.
+
+    Without either parameter the full restaurant with its items is returned. Items are
+    included when listed in either parameter. Raises ValueError on unknown fields.
+    """
+    fields = request.args.get('fields')
+    include = request.args.get('include')
+    if fields is None and include is None:
+        return Restaurant.FIELDS, True
+
+    requested = {f for f in (fields or '').split(',') if f}
+    included = {i for i in (include or '').split(',') if i}
+    include_items = 'items' in requested or 'items' in included
+    requested.discard('items')
+    if not requested <= set(Restaurant.FIELDS) or not included <= {'items'}:
+        raise ValueError('Unknown field')
+    if fields is None:
+        return Restaurant.FIELDS, include_items
+    # id is always returned, clients key on it
+    return tuple(f for f in Restaurant.FIELDS if f == 'id' or f in requested), include_items
+
+
+def upgrade_schema():
+    # create_all() only creates missing tables, so columns and indexes added to
+    # existing tables have to be created separately
     db.create_all()
+    inspector = db.inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            ddl = f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column.type.compile(dialect=db.engine.dialect)}'
+            if column.server_default is not None:
+                default = column.server_default.arg
+                ddl += f' DEFAULT {getattr(default, "text", default)}'
+                if not column.nullable:
+                    ddl += ' NOT NULL'
+            with db.engine.begin() as conn:
+                conn.execute(db.text(ddl))
+        for index in table.indexes:
+            index.create(bind=db.engine, checkfirst=True)
+    if db.engine.dialect.name == 'postgresql':
+        create_search_indexes()
+
+
+def backfill_order_lines(batch_size=1000, progress=None):
+    """Move items JSON of old orders into order_line rows, one committed batch at a time.
+
+    Safe to interrupt and re-run: an order's lines are inserted and its JSON cleared
+    in the same transaction. Returns the number of orders migrated.
+    """
+    migrated = 0
+    last_id = 0
+    while True:
+        rows = db.session.query(Order.id, Order.items).filter(Order.id > last_id, Order.items.isnot(None)) \
+            .order_by(Order.id).limit(batch_size).all()
+        if not rows:
+            return migrated
+        lines = []
+        for order_id, items in rows:
+            for line_no, item in enumerate(items or []):
+                lines.append({
+                    'order_id': order_id,
+                    'line_no': line_no,
+                    'item_id': int(item['id']),
+                    'quantity': int(item.get('quantity', 1)),
+                    'price': int(item.get('price', 0)),
+                    'name': (item.get('name') or '')[:100],
+                })
+        ids = [order_id for order_id, _ in rows]
+        if lines:
+            db.session.execute(OrderLine.__table__.insert(), lines)
+        db.session.execute(Order.__table__.update().where(Order.id.in_(ids)).values(items=db.null()))
+        db.session.commit()
+        migrated += len(rows)
+        last_id = ids[-1]
+        if progress:
+            progress(migrated)
+
+
+
+def month_start(timestamp):
+    year, month = time.gmtime(timestamp)[:2]
+    return calendar.timegm((year, month, 1, 0, 0, 0))
+
+
+def create_archive_partitions(first, last):
+    # Monthly partitions of both archive tables covering order_number first..last (Postgres)
+    start = month_start(first)
+    while start <= last:
+        year, month = time.gmtime(start)[:2]
+        end = calendar.timegm((year + month // 12, month % 12 + 1, 1, 0, 0, 0))
+        for table in ('order_archive', 'order_line_archive'):
+            db.session.execute(db.text(
+                f'CREATE TABLE IF NOT EXISTS {table}_{year}_{month:02d} PARTITION OF {table} '
+                f'FOR VALUES FROM ({start}) TO ({end})'))
+        start = end
+
+
+def archive_orders(older_than_days=None, batch_size=1000, progress=None):
+    """Move completed and canceled orders placed more than `older_than_days` ago
+    (default ORDER_ARCHIVE_AFTER_DAYS), and their lines, into the archive tables,
+    one committed batch at a time.
+
+    Safe to interrupt and re-run: a batch is copied and deleted in one transaction.
+    Returns the number of orders moved.
+    """
+    if older_than_days is None:
+        older_than_days = current_app.config['ORDER_ARCHIVE_AFTER_DAYS']
+    # Archived orders only have lines, never the legacy items JSON
+    backfill_order_lines()
+    cutoff = int(time.time()) - older_than_days * 86400
+    order_table, line_table = Order.__table__, OrderLine.__table__
+    moved = 0
+    while True:
+        rows = db.session.query(Order.id, Order.order_number) \
+            .filter(Order.status.in_((2, 3)), Order.order_number < cutoff) \
+            .order_by(Order.id).limit(batch_size).with_for_update(skip_locked=True).all()
+        if not rows:
+            return moved
+        ids = [order_id for order_id, _ in rows]
+        if db.engine.dialect.name == 'postgresql':
+            create_archive_partitions(min(n for _, n in rows), max(n for _, n in rows))
+        db.session.execute(OrderArchive.__table__.insert().from_select(
+            ['id', 'order_number', 'status', 'table_id', 'total_cost', 'restaurant_id', 'version', 'change_seq'],
+            db.select(order_table.c.id, order_table.c.order_number, order_table.c.status, order_table.c.table_id,
+                      order_table.c.total_cost, order_table.c.restaurant_id, order_table.c.version,
+                      next_change_seq())
+            .where(order_table.c.id.in_(ids))))
+        db.session.execute(OrderLineArchive.__table__.insert().from_select(
+            ['order_id', 'order_number', 'line_no', 'item_id', 'quantity', 'price', 'name'],
+            db.select(line_table.c.order_id, order_table.c.order_number, line_table.c.line_no, line_table.c.item_id,
+                      line_table.c.quantity, line_table.c.price, line_table.c.name)
+            .select_from(line_table.join(order_table, order_table.c.id == line_table.c.order_id))
+            .where(line_table.c.order_id.in_(ids))))
+        db.session.execute(line_table.delete().where(line_table.c.order_id.in_(ids)))
+        db.session.execute(order_table.delete().where(order_table.c.id.in_(ids)))
+        db.session.commit()
+        moved += len(rows)
+        if progress:
+            progress(moved)
+
+
+SALES_BUCKET = 3600
+ITEM_SALES_BUCKET = 86400
+
+
+def rollup_add(model, rows, increments):
+    """Add `increments` columns of each row onto the rollup, inserting missing rows.
+
+    Runs in the caller's transaction, so the increments commit together with the order.
+    On Postgres they go to the model's delta table, folded in by flush_rollup_deltas():
+    upserting the rollup row here would keep it locked until commit, and every other
+    order of the restaurant in that hour would wait for it.
+    """
+    if db.engine.dialect.name == 'postgresql':
+        db.session.execute(ROLLUP_DELTAS[model].__table__.insert(), rows)
+        start_rollup_flusher(current_app._get_current_object())
+        return
+    # SQLite runs one writer at a time, there is nothing to wait for
+    from sqlalchemy.dialects.sqlite import insert
+    table = model.__table__
+    keys = [column.name for column in table.primary_key]
+    # Sorted, so concurrent transactions lock rollup rows in the same order
+    rows = sorted(rows, key=lambda row: [row[k] for k in keys])
+    stmt = insert(table).values(rows)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=keys,
+        set_={name: table.c[name] + stmt.excluded[name] for name in increments}
+    )
+    db.session.execute(stmt)
+
+
+def record_orders_placed(orders):
+    placed = {}
+    for order in orders:
+        key = (order.restaurant_id, order.order_number - order.order_number % SALES_BUCKET)
+        placed[key] = placed.get(key, 0) + 1
+    rollup_add(SalesRollup, [
+        {'restaurant_id': restaurant_id, 'bucket': bucket, 'orders': count,
+         'completed': 0, 'canceled': 0, 'revenue': 0}
+        for (restaurant_id, bucket), count in placed.items()
+    ], ['orders'])
+
+
+def record_orders_closed(orders):
+    # Call once per order, when it moves to completed (2) or canceled (3)
+    sales, items = {}, {}
+    for order in orders:
+        completed = order.status == 2
+        key = (order.restaurant_id, order.order_number - order.order_number % SALES_BUCKET)
+        done, canceled, revenue = sales.get(key, (0, 0, 0))
+        sales[key] = (done + completed, canceled + (not completed), revenue + (order.total_cost if completed else 0))
+        if not completed:
+            continue
+        day = order.order_number - order.order_number % ITEM_SALES_BUCKET
+        for line in order.items_list():
+            key = (order.restaurant_id, day, int(line['id']))
+            quantity, revenue = items.get(key, (0, 0))
+            items[key] = (quantity + line['quantity'], revenue + line['price'] * line['quantity'])
+    if sales:
+        rollup_add(SalesRollup, [
+            {'restaurant_id': restaurant_id, 'bucket': bucket, 'orders': 0,
+             'completed': done, 'canceled': canceled, 'revenue': revenue}
+            for (restaurant_id, bucket), (done, canceled, revenue) in sales.items()
+        ], ['completed', 'canceled', 'revenue'])
+    if items:
+        rollup_add(ItemSalesRollup, [
+            {'restaurant_id': restaurant_id, 'bucket': day, 'item_id': item_id,
+             'quantity': quantity, 'revenue': revenue}
+            for (restaurant_id, day, item_id), (quantity, revenue) in items.items()
+        ], ['quantity', 'revenue'])
+
+
+ROLLUP_FLUSH_LOCK = 0x526f6c6c  # pg advisory lock key: one flusher at a time
+_rollup_flusher = None
+_rollup_flusher_lock = threading.Lock()
+
+
+def flush_rollup_deltas():
+    """Fold the queued rollup increments into the rollups (Postgres). Returns rollup rows written."""
+    from sqlalchemy.dialects.postgresql import insert
+    if not db.session.execute(db.select(db.func.pg_try_advisory_xact_lock(ROLLUP_FLUSH_LOCK))).scalar():
+        db.session.rollback()  # another worker is flushing them
+        return 0
+    written = 0
+    for model, delta_model in ROLLUP_DELTAS.items():
+        table, delta = model.__table__, delta_model.__table__
+        keys = [column.name for column in table.primary_key]
+        increments = [column.name for column in table.columns if column.name not in keys]
+        # Deleted and summed by one statement: a delta committed meanwhile is either
+        # folded in and deleted, or left for the next flush
+        moved = delta.delete().returning(*[delta.c[name] for name in keys + increments]).cte('moved')
+        sums = db.select(*[moved.c[name] for name in keys], *[db.func.sum(moved.c[name]) for name in increments]) \
+            .group_by(*[moved.c[name] for name in keys]).order_by(*[moved.c[name] for name in keys])
+        stmt = insert(table).from_select(keys + increments, sums)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=keys,
+            set_={name: table.c[name] + stmt.excluded[name] for name in increments}
+        )
+        written += db.session.execute(stmt).rowcount
+    db.session.commit()
+    return written
+
+
+def start_rollup_flusher(app):
+    global _rollup_flusher
+    if _rollup_flusher is not None:
+        return
+    with _rollup_flusher_lock:
+        if _rollup_flusher is not None:
+            return
+        _rollup_flusher = threading.Thread(target=_flush_rollups_forever, args=(app,), name='rollup-flusher',
+                                           daemon=True)
+        _rollup_flusher.start()
+
+
+def _flush_rollups_forever(app):
+    interval = app.config['ROLLUP_FLUSH_INTERVAL']
+    while True:
+        time.sleep(interval)
+        with app.app_context():
+            try:
+                flush_rollup_deltas()
+            except Exception:
+                app.logger.exception('Flushing rollup deltas failed')
+            finally:
+                db.session.remove()
+
+
+def rollup_rows(model):
+    # The rollup plus the increments not folded in yet, with the rollup's columns
+    names = [column.name for column in model.__table__.columns]
+    delta = ROLLUP_DELTAS[model].__table__
+    return db.union_all(db.select(*[model.__table__.c[name] for name in names]),
+                        db.select(*[delta.c[name] for name in names])).subquery()
+
+
+ROLLUP_REBUILD_RANGE = 7 * ITEM_SALES_BUCKET  # seconds of order history per rebuild transaction
+
+
+def rebuild_rollups(restaurant_id=None):
+    """Recompute the rollups from order history, one committed time range at a time.
+
+    Each range holds the rollup tables only while its own orders are aggregated, so
+    orders placed or closed meanwhile wait for one range instead of the whole history.
+    """
+    # Item rollups are computed from order lines
+    backfill_order_lines()
+    previous_end = None
+    start = first_order_number(restaurant_id, None)
+    while start is not None:
+        start -= start % ITEM_SALES_BUCKET  # whole days, so no bucket spans two ranges
+        end = start + ROLLUP_REBUILD_RANGE
+        # Rollup rows between the previous range and this one have no orders left
+        rebuild_rollup_range(restaurant_id, previous_end, end)
+        previous_end = end
+        start = first_order_number(restaurant_id, end)
+    rebuild_rollup_range(restaurant_id, previous_end, None)
+
+
+def first_order_number(restaurant_id, at_least):
+    # Earliest order_number from at_least on, hot or archived, None when there is none
+    found = []
+    for model in (Order, OrderArchive):
+        query = db.session.query(db.func.min(model.order_number))
+        if at_least is not None:
+            query = query.filter(model.order_number >= at_least)
+        if restaurant_id is not None:
+            query = query.filter(model.restaurant_id == restaurant_id)
+        found.append(query.scalar())
+    found = [n for n in found if n is not None]
+    return min(found) if found else None
+
+
+def rebuild_rollup_range(restaurant_id, start, end):
+    """Replace the rollup rows of buckets in [start, end) (None: unbounded) in one transaction."""
+    if db.engine.dialect.name == 'postgresql':
+        # Orders placed or closed meanwhile wait for this range instead of being lost. Deltas
+        # first, in the order flush_rollup_deltas() takes them
+        db.session.execute(db.text('LOCK TABLE sales_rollup_delta, item_sales_rollup_delta, '
+                                   'sales_rollup, item_sales_rollup IN EXCLUSIVE MODE'))
+
+    def in_range(column):
+        conditions = []
+        if start is not None:
+            conditions.append(column >= start)
+        if end is not None:
+            conditions.append(column < end)
+        return conditions
+
+    # Archived orders count like any other
+    orders = db.union_all(*[
+        db.select(o.restaurant_id, o.order_number, o.status, o.total_cost).where(*in_range(o.order_number))
+        for o in (Order, OrderArchive)
+    ]).subquery()
+    lines = db.union_all(
+        db.select(Order.restaurant_id, Order.order_number, OrderLine.item_id, OrderLine.quantity, OrderLine.price)
+        .join(OrderLine, OrderLine.order_id == Order.id).where(Order.status == 2, *in_range(Order.order_number)),
+        db.select(OrderArchive.restaurant_id, OrderArchive.order_number, OrderLineArchive.item_id,
+                  OrderLineArchive.quantity, OrderLineArchive.price)
+        .join(OrderLineArchive, db.and_(OrderLineArchive.order_id == OrderArchive.id,
+                                        OrderLineArchive.order_number == OrderArchive.order_number))
+        .where(OrderArchive.status == 2, *in_range(OrderArchive.order_number)),
+    ).subquery()
+
+    hour = orders.c.order_number - orders.c.order_number % SALES_BUCKET
+    sales = db.session.query(
+        orders.c.restaurant_id,
+        hour,
+        db.func.count(),
+        db.func.sum(db.case((orders.c.status == 2, 1), else_=0)),
+        db.func.sum(db.case((orders.c.status == 3, 1), else_=0)),
+        db.func.sum(db.case((orders.c.status == 2, orders.c.total_cost), else_=0)),
+    ).group_by(orders.c.restaurant_id, hour)
+    day = lines.c.order_number - lines.c.order_number % ITEM_SALES_BUCKET
+    item_sales = db.session.query(
+        lines.c.restaurant_id,
+        day,
+        lines.c.item_id,
+        db.func.sum(lines.c.quantity),
+        db.func.sum(lines.c.quantity * lines.c.price),
+    ).group_by(lines.c.restaurant_id, day, lines.c.item_id)
+
+    # Queued increments of the range are already counted from the orders
+    deletes = [table.delete().where(*in_range(table.c.bucket))
+               for model in (SalesRollup, ItemSalesRollup)
+               for table in (model.__table__, ROLLUP_DELTAS[model].__table__)]
+    if restaurant_id is not None:
+        deletes = [d.where(d.table.c.restaurant_id == restaurant_id) for d in deletes]
+        sales = sales.filter(orders.c.restaurant_id == restaurant_id)
+        item_sales = item_sales.filter(lines.c.restaurant_id == restaurant_id)
+    for delete in deletes:
+        db.session.execute(delete)
+    db.session.execute(SalesRollup.__table__.insert().from_select(
+        ['restaurant_id', 'bucket', 'orders', 'completed', 'canceled', 'revenue'], sales.subquery().select()))
+    db.session.execute(ItemSalesRollup.__table__.insert().from_select(
+        ['restaurant_id', 'bucket', 'item_id', 'quantity', 'revenue'], item_sales.subquery().select()))
+    db.session.commit()
 
 
 @login_manager.user_loader
@@ -172,25 +1120,97 @@ def load_user(user_id):
     return AdminUser.query.get(int(user_id))
 
 
-def generate_token(user_id):
+STREAM_TICKET_AUDIENCE = 'events'
+
+
+def generate_token(user):
+    # Claims carry everything authorization needs, see validate_token()
     payload = {
-        'user_id': user_id,
+        'user_id': user.id,
+        'username': user.username,
+        'restaurant_id': user.restaurant_id,
+        'superuser': bool(user.superuser),
+        'ver': user.token_version or 0,
         'exp': datetime.now(timezone.utc) + timedelta(hours=1),
         'iat': datetime.now(timezone.utc)
 
     }
-    token = jwt.encode(payload, app.secret_key, algorithm='HS256')# app.secret_key, algorithm='HS256')
+    token = jwt.encode(payload, current_app.secret_key, algorithm='HS256')
     return token
 
+
+def generate_stream_ticket(user):
+    # EventSource cannot send headers, so streams take this in the URL instead of the
+    # token. Short-lived and only good for opening a stream (aud), see validate_token()
+    now = datetime.now(timezone.utc)
+    payload = {
+        'user_id': user.id,
+        'username': user.username,
+        'restaurant_id': user.restaurant_id,
+        'superuser': user.superuser,
+        'ver': user.ver,
+        'aud': STREAM_TICKET_AUDIENCE,
+        'exp': now + timedelta(seconds=current_app.config['STREAM_TICKET_TTL']),
+        'iat': now
+    }
+    return jwt.encode(payload, current_app.secret_key, algorithm='HS256')
+
+
+# 🪪 user_id -> (checked_at, token_version or None for deleted users). Bounds how
+# long a deleted user or a revoked token keeps working in this worker.
+_token_versions = OrderedDict()
+_token_versions_lock = threading.Lock()
+
+
+def current_token_version(user_id):
+    now = time.monotonic()
+    with _token_versions_lock:
+        cached = _token_versions.get(user_id)
+        if cached and now - cached[0] < current_app.config['PRINCIPAL_CACHE_TTL']:
+            _token_versions.move_to_end(user_id)
+            return cached[1]
+
+    version = db.session.query(AdminUser.token_version).filter(AdminUser.id == user_id).scalar()
+
+    with _token_versions_lock:
+        _token_versions[user_id] = (now, version)
+        _token_versions.move_to_end(user_id)
+        while len(_token_versions) > current_app.config['PRINCIPAL_CACHE_SIZE']:
+            _token_versions.popitem(last=False)
+    return version
+
+
+def _on_principal_changed(event):
+    with _token_versions_lock:
+        _token_versions.pop(event['user_id'], None)
+
+
+broker.add_listener('principals', _on_principal_changed)
+
+
+def revoke_tokens(user):
+    # Invalidates every token of the user, in all workers that hear the event
+    user.token_version = (user.token_version or 0) + 1
+    db.session.commit()
+    broker.publish(['principals'], {'type': 'principal', 'user_id': user.id})
+
+
 # Utility function to validate the token and retrieve the user
-def validate_token(token: str):
+def validate_token(token: str, audience=None):
+    # Tokens with an aud claim (stream tickets) only pass when that audience is asked for
     try:
-        payload = jwt.decode(token, app.secret_key, algorithms=['HS256'])
-        user = AdminUser.query.get(payload['user_id'])
-        if not user:
-            logging.warning(f"Invalid token: user not found (token: {token})")
+        payload = jwt.decode(token, current_app.secret_key, algorithms=['HS256'], audience=audience)
+        if 'superuser' not in payload:
+            logging.warning("Invalid token: issued without claims, login again")
+            return None
+        version = current_token_version(payload['user_id'])
+        if version is None:
+            logging.warning("Invalid token: user not found")
             return None
-        return user
+        if version != payload.get('ver', 0):
+            logging.warning("Invalid token: revoked")
+            return None
+        return AdminPrincipal(payload)
     except jwt.ExpiredSignatureError:
         logging.warning("Token expired")
         return None
@@ -199,51 +1219,189 @@ def validate_token(token: str):
         return None
 
 
+def get_admin(allow_stream_ticket=False):
+    # AdminPrincipal for the request's Bearer token, or None. Only EventSource streams,
+    # which cannot send headers, may pass a stream ticket as ?ticket= instead
+    auth_header = request.headers.get('Authorization', '')
+    if auth_header.startswith('Bearer '):
+        return validate_token(auth_header.replace('Bearer ', ''))
+    ticket = request.args.get('ticket') if allow_stream_ticket else None
+    return validate_token(ticket, audience=STREAM_TICKET_AUDIENCE) if ticket else None
+
+
 # Utility function to check if the current user is an admin
 def admin_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        auth_header = request.headers.get('Authorization')
-        if not auth_header or not auth_header.startswith('Bearer '):
-            return jsonify({'error': 'Admin access required'}), 403
-
-        token = auth_header.replace('Bearer ', '')
-
-        user = validate_token(token)
-        if not user or not isinstance(user, AdminUser):
+        user = get_admin()
+        if not user:
             return jsonify({'error': 'Admin access required'}), 403
 
-        login_user(user)
+        # Sets current_user for this request only, no session round trip
+        g._login_user = user
         return f(*args, **kwargs)
     return decorated_function
 
 
 
-@app.route('/api/', methods=['GET'])
+@api.route('/api/', methods=['GET'])
 def index():
-    add_sample_user() #TODO: remove in production!
     return "It's API page. No content here :("
 
 
-@app.route('/api/login', methods=['POST'])
+def parse_networks(value):
+    # "10.0.0.5, 172.28.0.0/16" -> list of ip_network
+    return [ipaddress.ip_network(part.strip(), strict=False) for part in value.split(',') if part.strip()]
+
+
+def client_ip():
+    # Rate limits and login throttling key on this, so a client that reaches the API
+    # directly must not be able to pick its own address through the header
+    remote = request.remote_addr
+    real_ip = request.headers.get('X-Real-IP')
+    if not real_ip or not remote:
+        return remote
+    try:
+        address = ipaddress.ip_address(remote)
+    except ValueError:
+        return remote
+    if any(address in network for network in current_app.extensions['trusted_proxies']):
+        return real_ip
+    return remote
+
+
+class AttemptLimiter:
+    """Sliding-window counter of failed attempts per key (username, IP...)."""
+
+    def __init__(self, max_attempts, window, max_keys=10000):
+        self.max_attempts = max_attempts
+        self.window = window
+        self.max_keys = max_keys
+        self._attempts = OrderedDict()  # key -> deque of monotonic timestamps
+        self._lock = threading.Lock()
+
+    def retry_after(self, key):
+        # Seconds until the key may try again, 0 if it is not throttled
+        now = time.monotonic()
+        with self._lock:
+            attempts = self._attempts.get(key)
+            if not attempts:
+                return 0
+            while attempts and now - attempts[0] >= self.window:
+                attempts.popleft()
+            if len(attempts) < self.max_attempts:
+                return 0
+            return int(self.window - (now - attempts[0])) + 1
+
+    def record(self, key):
+        with self._lock:
+            attempts = self._attempts.setdefault(key, deque())
+            attempts.append(time.monotonic())
+            while len(attempts) > self.max_attempts:
+                attempts.popleft()
+            self._attempts.move_to_end(key)
+            while len(self._attempts) > self.max_keys:
+                self._attempts.popitem(last=False)
+
+    def reset(self, key):
+        with self._lock:
+            self._attempts.pop(key, None)
+
+
+# Configured by create_app()
+login_attempts_by_user = AttemptLimiter(5, 300)
+login_attempts_by_ip = AttemptLimiter(20, 300)
+
+# 🚦 Admission control. Public endpoints get a token bucket per client IP and route
+# class, and every worker caps the requests it serves at once. Excess work is turned
+# away up front with 429/503 and Retry-After rather than queued behind the database;
+# menu reads are shed before order submission (see ConcurrencyLimiter.reserved).
+PUBLIC_ROUTE_CLASSES = {
+    ('api.orderNew', 'POST'): 'order',
+    ('api.index', 'GET'): 'read',
+    ('api.handle_items', 'GET'): 'read',
+    ('api.lookup_cart_items', 'POST'): 'read',
+    ('api.search_items', 'GET'): 'read',
+    ('api.handle_item', 'GET'): 'read',
+    ('api.handle_restaurants', 'GET'): 'read',
+    ('api.update_restaurant', 'GET'): 'read',
+    ('api.order', 'GET'): 'read',
+    ('api.order_events', 'GET'): 'read',
+}
+
+# Configured by create_app()
+rate_limiter = RateLimiter(MemoryBuckets())
+in_flight = ConcurrencyLimiter()
+
+
+@api.before_request
+def admit_request():
+    route_class = PUBLIC_ROUTE_CLASSES.get((request.endpoint, request.method))
+    if route_class:
+        retry_after = rate_limiter.retry_after(route_class, client_ip())
+        if retry_after:
+            return jsonify({'error': 'Too many requests'}), 429, {'Retry-After': str(int(retry_after) + 1)}
+    if not in_flight.try_acquire(high_priority=route_class != 'read'):
+        return jsonify({'error': 'Server busy, try again'}), 503, {'Retry-After': '1'}
+    g._admitted = True
+
+
+@api.teardown_request
+def release_admission(exc):
+    if g.pop('_admitted', False):
+        in_flight.release()
+
+
+@api.route('/api/metrics', methods=['GET'])
+def metrics_endpoint():
+    # Prometheus text format; superusers or a scraper holding METRICS_TOKEN
+    token = current_app.config['METRICS_TOKEN']
+    if not (token and request.headers.get('Authorization') == f'Bearer {token}'):
+        user = get_admin()
+        if not user or not user.superuser:
+            return jsonify({'error': 'Admin super access required'}), 403
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+@api.route('/api/login', methods=['POST'])
 def login():
     data = request.get_json()
-    app.logger.info('Login attempt', extra={
+    current_app.logger.info('Login attempt', extra={
         'username': data.get('username'),
-        'ip': request.remote_addr
+        'ip': client_ip()
     })
 
     if not data or 'username' not in data or 'password' not in data:
-        app.logger.warning('Invalid login input')
+        current_app.logger.warning('Invalid login input')
         return jsonify({'error': 'Invalid input'}), 400
 
+    ip = client_ip()
+    retry_after = max(login_attempts_by_user.retry_after(data['username']), login_attempts_by_ip.retry_after(ip))
+    if retry_after:
+        current_app.logger.warning('Login throttled', extra={'username': data['username'], 'ip': ip})
+        return jsonify({'error': 'Too many login attempts'}), 429, {'Retry-After': str(retry_after)}
+
     user = AdminUser.query.filter_by(username=data['username']).first()
-    if user and user.check_password(data['password']):
+    try:
+        valid = user is not None and user.check_password(data['password'])
+    except HashingBusy:
+        current_app.logger.warning('Login rejected: password hashing saturated')
+        return jsonify({'error': 'Server busy, try again'}), 503, {'Retry-After': '1'}
+
+    if valid:
+        login_attempts_by_user.reset(data['username'])
+        if hasher.needs_rehash(user.password_hash):
+            try:
+                user.set_password(data['password'])
+                db.session.commit()
+            except HashingBusy:
+                pass  # Next login will try again
+
         # Generate a token (e.g., JWT)
-        token = generate_token(user.id)  # Replace with your token generation logic
+        token = generate_token(user)
         login_user(user)  # sets current_user
 
-        app.logger.info('Login successful', extra={
+        current_app.logger.info('Login successful', extra={
             'user_id': user.id,
             'username': user.username
         })
@@ -252,27 +1410,22 @@ def login():
         response = jsonify({'message': 'Logged in', 'token': token})
         return response, 200
 
+    login_attempts_by_user.record(data['username'])
+    login_attempts_by_ip.record(ip)
     return jsonify({'error': 'Invalid credentials'}), 401
 
 
-@app.route('/api/logout', methods=['GET'])
+@api.route('/api/logout', methods=['GET'])
 @admin_required
 def logout():
     logout_user()
     return jsonify({'message': 'Logged out'}), 200
 
 
-@app.route('/api/signup', methods=['POST'])
+@api.route('/api/signup', methods=['POST'])
 @admin_required
 def signup():
-    auth_header = request.headers.get('Authorization')
-    if not auth_header or not auth_header.startswith('Bearer '):
-        return jsonify({'error': 'Admin access required'}), 403
-    token = auth_header.replace('Bearer ', '')
-    user = validate_token(token)
-    if not user or not isinstance(user, AdminUser):
-        return jsonify({'error': 'Admin access required'}), 403
-    if not user.superuser:
+    if not current_user.superuser:
         return jsonify({'error': 'Admin super access required'}), 403
 
     data = request.get_json()
@@ -294,88 +1447,829 @@ def signup():
         restaurant_id=data['restaurant_id'],
         superuser=data.get('superuser', False)  # Default to False if not passed
     )
-    new_admin.set_password(data['password'])
+    try:
+        new_admin.set_password(data['password'])
+    except HashingBusy:
+        return jsonify({'error': 'Server busy, try again'}), 503, {'Retry-After': '1'}
     db.session.add(new_admin)
     db.session.commit()
 
     return jsonify({'message': 'User created successfully'}), 201
 
 
-@app.route('/api/orders', methods=['GET'])
+ORDERS_PAGE_DEFAULT = 50
+ORDERS_PAGE_MAX = 200
+
+
+@api.route('/api/orders', methods=['GET'])
 @admin_required
 def list_orders():
-    orders = Order.query.all()
-    return jsonify({'orders': [
-        {
-            'id': o.id,
-            'status': o.status,
-            'table_id': o.table_id,
-            'order_number': o.order_number,
-            'items': o.items,
-            'total_cost': o.total_cost,
-            'restaurant_id': o.restaurant_id
-        } for o in orders
-    ]}), 200
-
-
-@app.route('/api/order/<int:order_id>', methods=['GET', 'PUT'])
+    # Newest first, keyset-paginated on id: ?cursor=<next_cursor of the previous page>.
+    # ?archived=1 pages through archived orders instead (see archive_orders)
+    try:
+        limit = min(int(request.args.get('limit', ORDERS_PAGE_DEFAULT)), ORDERS_PAGE_MAX)
+        cursor = request.args.get('cursor', type=int)
+        restaurant_id = request.args.get('restaurant_id')
+        restaurant_id = int(restaurant_id) if restaurant_id not in (None, '') else None
+        statuses = [int(s) for s in request.args.get('status', '').split(',') if s != '']
+    except ValueError:
+        return jsonify({'error': 'Invalid input'}), 400
+    if limit < 1:
+        return jsonify({'error': 'Invalid input'}), 400
+
+    if not current_user.superuser:
+        if restaurant_id is not None and restaurant_id != current_user.restaurant_id:
+            return jsonify({'error': 'Admin super access required or view only your restaurant orders'}), 403
+        restaurant_id = current_user.restaurant_id
+
+    model = OrderArchive if request.args.get('archived') in ('1', 'true') else Order
+    # Taken before the page is read: a change this page misses is at or above it
+    changes_cursor = f'{change_horizon()}.0' if model is Order else None
+    query = model.query
+    if restaurant_id is not None:
+        query = query.filter(model.restaurant_id == restaurant_id)
+    if len(statuses) == 1:
+        query = query.filter(model.status == statuses[0])
+    elif statuses:
+        query = query.filter(model.status.in_(statuses))
+    if cursor is not None:
+        query = query.filter(model.id < cursor)
+
+    orders = query.options(db.selectinload(model.lines)).order_by(model.id.desc()).limit(limit + 1).all()
+    has_more = len(orders) > limit
+    orders = orders[:limit]
+    return jsonify({
+        'orders': [o.to_dict() for o in orders],
+        'next_cursor': orders[-1].id if has_more else None,
+        'changes_cursor': changes_cursor
+    }), 200
+
+
+# 🔄 Delta sync for the admin board. Writes stamp change_seq with the id of their
+# transaction (Postgres) and order_changes() only returns rows below the oldest
+# transaction still running, so a write that commits late is never skipped: the cursor
+# does not move past it until it has committed.
+ORDER_CHANGES_MAX = 500
+
+
+def next_change_seq():
+    # SQL expression for the change_seq of rows written by the current transaction
+    if db.engine.dialect.name == 'postgresql':
+        return db.func.txid_current()
+    # SQLite runs one writer at a time, so the next number after the highest will do
+    return highest_change_seq() + 1
+
+
+def highest_change_seq():
+    # SQLite: archived orders keep the change_seq they were archived with
+    return db.func.max(*(
+        db.select(db.func.coalesce(db.func.max(model.change_seq), 0)).correlate(None).scalar_subquery()
+        for model in (Order, OrderArchive)))
+
+
+def change_horizon():
+    # Every change below this is committed and visible, none can still appear
+    if db.engine.dialect.name == 'postgresql':
+        return db.session.execute(db.select(db.func.txid_snapshot_xmin(db.func.txid_current_snapshot()))).scalar()
+    return db.session.execute(db.select(highest_change_seq())).scalar() + 1
+
+
+def parse_change_cursor(value):
+    # "<change_seq>.<order id>" of the last change seen; raises ValueError
+    seq, _, order_id = value.partition('.')
+    return int(seq), int(order_id or 0)
+
+
+@api.route('/api/orders/changes', methods=['GET'])
+@admin_required
+def order_changes():
+    # ?since=<changes_cursor of /api/orders or next_cursor of the previous call>; returns the
+    # orders created or changed since, oldest change first, and the ids of the ones archived
+    # since. Polling clients use it when the event stream is unavailable.
+    try:
+        since = parse_change_cursor(request.args['since']) if request.args.get('since') else None
+        limit = min(int(request.args.get('limit', ORDER_CHANGES_MAX)), ORDER_CHANGES_MAX)
+        restaurant_id = request.args.get('restaurant_id')
+        restaurant_id = int(restaurant_id) if restaurant_id not in (None, '') else None
+    except ValueError:
+        return jsonify({'error': 'Invalid input'}), 400
+    if limit < 1:
+        return jsonify({'error': 'Invalid input'}), 400
+
+    if not current_user.superuser:
+        if restaurant_id is not None and restaurant_id != current_user.restaurant_id:
+            return jsonify({'error': 'Admin super access required or view only your restaurant orders'}), 403
+        restaurant_id = current_user.restaurant_id
+
+    horizon = change_horizon()
+    if since is None:
+        # Nothing to compare with yet: just hand out a starting point
+        return jsonify({'orders': [], 'archived': [], 'next_cursor': f'{horizon}.0', 'has_more': False}), 200
+
+    query = Order.query.filter(db.tuple_(Order.change_seq, Order.id) > since, Order.change_seq < horizon)
+    archived = db.session.query(OrderArchive.change_seq, OrderArchive.id).filter(
+        db.tuple_(OrderArchive.change_seq, OrderArchive.id) > since, OrderArchive.change_seq < horizon)
+    if restaurant_id is not None:
+        query = query.filter(Order.restaurant_id == restaurant_id)
+        archived = archived.filter(OrderArchive.restaurant_id == restaurant_id)
+    orders = query.options(db.selectinload(Order.lines)) \
+        .order_by(Order.change_seq, Order.id).limit(limit + 1).all()
+    archived = archived.order_by(OrderArchive.change_seq, OrderArchive.id).limit(limit + 1).all()
+    # (change_seq, id, order or None when archived), merged in cursor order
+    changes = sorted([(o.change_seq, o.id, o) for o in orders] +
+                     [(seq, order_id, None) for seq, order_id in archived], key=lambda change: change[:2])
+    has_more = len(changes) > limit
+    changes = changes[:limit]
+    last = changes[-1][:2] if changes else since
+    return jsonify({
+        'orders': [o.to_dict() for _, _, o in changes if o is not None],
+        'archived': [order_id for _, order_id, o in changes if o is None],
+        'next_cursor': f'{last[0]}.{last[1]}',
+        'has_more': has_more
+    }), 200
+
+
+def status_transition_error(current, new):
+    # Status is 0 (placed), 1 (in progress), 2 (completed) or 3 (canceled);
+    # 0 -> 1/2/3 and 1 -> 2/3 are allowed. Returns None when allowed.
+    if new not in (0, 1, 2, 3):
+        return 'Invalid status value'
+    if current == 3:
+        return 'Order already canceled'
+    if current == 2:
+        return 'Order already completed'
+    if (current == 0 and new in (1, 2, 3)) or (current == 1 and new in (2, 3)):
+        return None
+    return 'Invalid status transition'
+
+
+ORDER_BATCH_MAX = 200
+
+
+@api.route('/api/orders/status', methods=['POST'])
+def batch_order_status():
+    # {"orders": {"<order id>": status}} or {"ids": [...], "status": status}; each order
+    # gets its own result, the ones that pass are committed together
+    user = get_admin()
+    if not user:
+        return jsonify({'error': 'Admin access required'}), 403
+
+    data = request.get_json(silent=True) or {}
+    try:
+        if 'orders' in data:
+            changes = {int(order_id): int(status) for order_id, status in data['orders'].items()}
+            raw_statuses = data['orders'].values()
+        else:
+            changes = {int(order_id): int(data['status']) for order_id in data['ids']}
+            raw_statuses = [data['status']]
+        if any(isinstance(status, bool) for status in raw_statuses):
+            raise TypeError
+    except (AttributeError, KeyError, TypeError, ValueError):
+        return jsonify({'error': 'Invalid input. Expected {"orders": {"order_id": status}}'}), 400
+    if not changes or len(changes) > ORDER_BATCH_MAX:
+        return jsonify({'error': f'Invalid input. Expected 1 to {ORDER_BATCH_MAX} orders'}), 400
+
+    # One query loads and locks every order; ids are sorted so batches lock in the same order
+    orders = {o.id: o for o in Order.query.options(db.selectinload(Order.lines))
+              .filter(Order.id.in_(sorted(changes))).order_by(Order.id).with_for_update(of=Order)}
+    results, changed = [], []
+    for order_id, status in changes.items():
+        order = orders.get(order_id)
+        if order is None:
+            results.append({'id': order_id, 'error': 'Order not found'})
+            continue
+        if not user.superuser and order.restaurant_id != user.restaurant_id:
+            results.append({'id': order_id, 'error': 'Admin super access required or edit only your restaurant orders'})
+            continue
+        error = status_transition_error(order.status, status)
+        if error:
+            results.append({'id': order_id, 'status': order.status, 'error': error})
+            continue
+        changed.append((order, status))
+        results.append({'id': order_id, 'status': status, 'version': order.version + 1})
+
+    # One UPDATE per (from, to) pair, each only applying where the status is still the
+    # one read above; transitions only move forward, so that also pins the version
+    groups = {}
+    for order, status in changed:
+        groups.setdefault((order.status, status), []).append(order.id)
+    table = Order.__table__
+    updated = 0
+    for (current, status), ids in groups.items():
+        updated += db.session.execute(table.update().where(table.c.id.in_(ids), table.c.status == current)
+                                      .values(status=status, version=table.c.version + 1,
+                                              change_seq=next_change_seq())).rowcount
+    if updated != len(changed):
+        # Only without row locks (SQLite): another device got to one of the orders first
+        db.session.rollback()
+        return jsonify({'error': 'Orders were changed on another device, try again'}), 409
+    for order, status in changed:
+        # Match the loaded orders to what was written, without another flush
+        set_committed_value(order, 'status', status)
+        set_committed_value(order, 'version', order.version + 1)
+
+    record_orders_closed([order for order, status in changed if status in (2, 3)])
+    # Built before the commit expires the orders, which would reload each one
+    events = [order_event(order, 'status') for order, _ in changed]
+    db.session.commit()
+    for channels, event in events:
+        broker.publish(channels, event)
+    current_app.logger.info('Order statuses updated', extra={
+        'user_id': user.id, 'requested': len(changes), 'updated': updated
+    })
+    return jsonify({'updated': updated, 'failed': len(changes) - updated, 'results': results}), 200
+
+
+@api.route('/api/order/<int:order_id>', methods=['GET', 'PUT'])
 def order(order_id):
     if request.method == 'GET':
+        # Looked up first: they are dropped only after the insert committed
+        record = order_journal.pending(order_id)
+        pending = record is not None or order_pending(order_id)
         order = Order.query.get(order_id)
         if not order:
+            if record is not None:
+                # Accepted by this worker's journal but not inserted yet
+                return jsonify(journaled_order_dict(record))
+            if pending:
+                # Accepted by another worker, the client asks again shortly
+                return jsonify({'id': order_id, 'status': 'pending'}), 202
+            if request.args.get('archived') in ('1', 'true'):
+                archived = OrderArchive.query.filter_by(id=order_id).first()
+                if archived:
+                    return jsonify(archived.to_dict())
             return jsonify({'error': 'Order not found'}), 404
         return jsonify({
             'id': order.id,
             'table_id': order.table_id,
             'status': order.status,
             'order_number': order.order_number,
-            'items': order.items,
-            'restaurant_id': order.restaurant_id
+            'items': order.items_list(),
+            'restaurant_id': order.restaurant_id,
+            'version': order.version
         })
 
     elif request.method == 'PUT':
-        auth_header = request.headers.get('Authorization')
-        if not auth_header or not auth_header.startswith('Bearer '):
-            return jsonify({'error': 'Admin access required'}), 403
-        token = auth_header.replace('Bearer ', '')
-        user = validate_token(token)
-        if not user or not isinstance(user, AdminUser):
+        user = get_admin()
+        if not user:
             return jsonify({'error': 'Admin access required'}), 403
 
         order = Order.query.get(order_id)
         if not order:
             return jsonify({'error': 'Order not found'}), 404
 
-        data = request.get_json()
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return jsonify({'error': 'Invalid input. Expected {"status": status, "version": version}'}), 400
+        previous_status = order.status
         try:
             if (not user.superuser and order.restaurant_id != user.restaurant_id):
                 return jsonify({'error': 'Admin super access required or edit only your restaurant orders'}), 403
+            # Devices send the version they displayed; an older one means they acted on stale state
+            if data.get('version') is not None and int(data['version']) != order.version:
+                return order_conflict(order)
             if 'status' in data:
-                if int(data['status']) not in [0, 1, 2, 3]:  # Assuming status can be 0 (placed), 1 (in progress), 2 (completed) or 3 (canceled)
-                    return jsonify({'error': 'Invalid status value'}), 400
-                elif order.status == 3:
-                    return jsonify({'error': 'Order already canceled'}), 400
-                elif order.status == 2:
-                    return jsonify({'error': 'Order already completed'}), 400
-                elif order.status == 0 and int(data['status']) in [1,2,3]:
-                    order.status = int(data['status'])
-                elif order.status == 1 and int(data['status']) == 2:
-                    order.status = int(data['status'])
-                elif order.status in [0,1] and int(data['status']) == 3:
-                    order.status = 3
-                else:
-                    return jsonify({'error': 'Invalid status transition'}), 400
+                error = status_transition_error(order.status, int(data['status']))
+                if error:
+                    return jsonify({'error': error}), 400
+                order.status = int(data['status'])
+                order.change_seq = next_change_seq()
+                if order.status in (2, 3):
+                    record_orders_closed([order])
 
             db.session.commit()
-            return jsonify({'message': 'Order updated'}), 200
+            if order.status != previous_status:
+                publish_order(order, 'status')
+            return jsonify({'message': 'Order updated', 'status': order.status, 'version': order.version}), 200
         except (TypeError, ValueError):
             return jsonify({'error': 'Invalid input'}), 400
+        except StaleDataError:
+            # Another device updated the order between our read and our write
+            db.session.rollback()
+            return order_conflict(order)
+
+
+def order_conflict(order):
+    # Expired orders reload here, so the client gets the current state
+    return jsonify({
+        'error': 'Order was changed on another device',
+        'status': order.status,
+        'version': order.version
+    }), 409
+
+@api.route('/api/order/<int:order_id>/events', methods=['GET'])
+def order_events(order_id):
+    journaled = order_journal.pending(order_id) is not None or order_pending(order_id)
+    order = Order.query.get(order_id)
+    if not order and not journaled:
+        return jsonify({'error': 'Order not found'}), 404
+
+    # Subscribe before taking the snapshot so no transition falls in between
+    subscription = broker.subscribe(f'order:{order_id}')
+    if subscription is None:
+        return jsonify({'error': 'Too many open streams'}), 503
+    if order is not None:
+        db.session.refresh(order)
+    snapshot = {'type': 'status', 'order': {'id': order_id, 'status': order.status if order else 0}}
+    return event_stream(subscription, initial=[snapshot])
+
+
+@api.route('/api/orders/events/ticket', methods=['POST'])
+@admin_required
+def orders_events_ticket():
+    # Opens one stream: the token itself never goes into a URL, where proxies and logs keep it
+    return jsonify({
+        'ticket': generate_stream_ticket(current_user),
+        'expires_in': current_app.config['STREAM_TICKET_TTL']
+    })
+
+
+@api.route('/api/orders/events', methods=['GET'])
+def orders_events():
+    user = get_admin(allow_stream_ticket=True)
+    if not user:
+        return jsonify({'error': 'Admin access required'}), 403
+
+    restaurant_id = request.args.get('restaurant_id', type=int)
+    if not user.superuser:
+        if restaurant_id is not None and restaurant_id != user.restaurant_id:
+            return jsonify({'error': 'Admin super access required or view only your restaurant orders'}), 403
+        restaurant_id = user.restaurant_id
+
+    subscription = broker.subscribe('orders' if restaurant_id is None else f'restaurant:{restaurant_id}')
+    if subscription is None:
+        return jsonify({'error': 'Too many open streams'}), 503
+    return event_stream(subscription)
+
+
+# 📤 Order history export. Rows are read through a server-side cursor and written out
+# in chunks as they arrive, so memory stays flat however long the history is. Each
+# running export holds a database connection, hence the per-worker cap.
+EXPORT_FETCH_SIZE = 2000
+EXPORT_CHUNK_BYTES = 64 * 1024
+EXPORT_CSV_COLUMNS = ['order_id', 'order_number', 'placed_at', 'restaurant_id', 'table_id', 'status', 'total_cost',
+                      'item_id', 'item_name', 'quantity', 'price']
+
+
+def iter_export_orders(engine, order_table, line_table, filters):
+    """Yield order dicts with their lines, oldest first, from one streamed query."""
+    legacy_items = order_table.c['items'] if 'items' in order_table.c else db.null()
+    query = db.select(
+        order_table.c.id, order_table.c.status, order_table.c.table_id, order_table.c.order_number,
+        order_table.c.total_cost, order_table.c.restaurant_id, legacy_items.label('legacy_items'),
+        line_table.c.item_id, line_table.c.name, line_table.c.quantity, line_table.c.price
+    ).select_from(order_table.outerjoin(line_table, export_line_join(order_table, line_table))) \
+        .where(*filters).order_by(order_table.c.id, line_table.c.line_no)
+
+    with engine.connect() as conn:
+        result = conn.execution_options(stream_results=True).execute(query).yield_per(EXPORT_FETCH_SIZE)
+        current = None
+        for row in result:
+            if current is None or current['id'] != row.id:
+                if current is not None:
+                    yield current
+                current = {
+                    'id': row.id,
+                    'status': row.status,
+                    'table_id': row.table_id,
+                    'order_number': row.order_number,
+                    'placed_at': datetime.fromtimestamp(row.order_number, timezone.utc).isoformat(),
+                    'total_cost': row.total_cost,
+                    'restaurant_id': row.restaurant_id,
+                    'items': [
+                        {'id': str(i['id']), 'name': i.get('name'), 'price': i.get('price'),
+                         'quantity': i.get('quantity')}
+                        for i in row.legacy_items or []
+                    ]
+                }
+            if row.item_id is not None:
+                current['items'].append(
+                    {'id': str(row.item_id), 'name': row.name, 'price': row.price, 'quantity': row.quantity})
+        if current is not None:
+            yield current
+
+
+def export_line_join(order_table, line_table):
+    condition = line_table.c.order_id == order_table.c.id
+    if 'order_number' in line_table.c:
+        # Archive lines carry their order's partition key
+        condition = db.and_(condition, line_table.c.order_number == order_table.c.order_number)
+    return condition
+
+
+def iter_export_history(engine, filters_for, archived):
+    # Archived orders first, they are the older ones, then the order table
+    sources = [(OrderArchive, OrderLineArchive)] if archived else []
+    for order_model, line_model in sources + [(Order, OrderLine)]:
+        order_table = order_model.__table__
+        yield from iter_export_orders(engine, order_table, line_model.__table__, filters_for(order_table))
+
+
+def format_export_ndjson(orders):
+    for order in orders:
+        yield json.dumps(order) + '\n'
+
+
+def format_export_csv(orders):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_CSV_COLUMNS)
+    for order in orders:
+        head = [order['id'], order['order_number'], order['placed_at'], order['restaurant_id'], order['table_id'],
+                order['status'], order['total_cost']]
+        for item in order['items'] or [{}]:
+            writer.writerow(head + [item.get('id'), item.get('name'), item.get('quantity'), item.get('price')])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+def export_chunks(pieces, compress):
+    # Joins small pieces into EXPORT_CHUNK_BYTES writes and gzips them on the fly
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None  # 31: gzip container
+    try:
+        chunk, size = [], 0
+        for piece in pieces:
+            chunk.append(piece)
+            size += len(piece)
+            if size >= EXPORT_CHUNK_BYTES:
+                data = ''.join(chunk).encode('utf-8')
+                chunk, size = [], 0
+                data = compressor.compress(data) if compressor else data
+                if data:
+                    yield data
+        data = ''.join(chunk).encode('utf-8')
+        if compressor:
+            data = compressor.compress(data) + compressor.flush()
+        if data:
+            yield data
+    finally:
+        # Stops the query and returns its connection when the client goes away
+        pieces.close()
+
+
+@api.route('/api/orders/export', methods=['GET'])
+def export_orders():
+    # ?format=ndjson|csv, ?restaurant_id=, ?from=&to= (unix seconds or YYYY-MM-DD), ?gzip=1,
+    # ?archived=1 to include archived orders
+    # Bearer header only: a ?token= would leave the admin token in access logs and history
+    user = get_admin()
+    if not user:
+        return jsonify({'error': 'Admin access required'}), 403
+
+    try:
+        export_format = request.args.get('format', 'ndjson')
+        if export_format not in ('ndjson', 'csv'):
+            raise ValueError(export_format)
+        restaurant_id = request.args.get('restaurant_id')
+        restaurant_id = int(restaurant_id) if restaurant_id not in (None, '') else None
+        start = parse_time_param(request.args.get('from'), None)
+        end = parse_time_param(request.args.get('to'), None)
+    except ValueError:
+        return jsonify({'error': 'Invalid input'}), 400
+    compress = request.args.get('gzip') in ('1', 'true')
+    archived = request.args.get('archived') in ('1', 'true')
+
+    if not user.superuser:
+        if restaurant_id is not None and restaurant_id != user.restaurant_id:
+            return jsonify({'error': 'Admin super access required or view only your restaurant orders'}), 403
+        restaurant_id = user.restaurant_id
+
+    def filters_for(table):
+        filters = []
+        if restaurant_id is not None:
+            filters.append(table.c.restaurant_id == restaurant_id)
+        if start is not None:
+            filters.append(table.c.order_number >= start)
+        if end is not None:
+            filters.append(table.c.order_number < end)
+        return filters
+
+    slots = current_app.extensions['export_slots']
+    if not slots.acquire(blocking=False):
+        return jsonify({'error': 'Too many exports running, try again later'}), 503, {'Retry-After': '30'}
+    current_app.logger.info('Order export started', extra={
+        'user_id': user.id, 'restaurant_id': restaurant_id, 'format': export_format, 'from': start, 'to': end
+    })
+
+    orders = iter_export_history(db.engine, filters_for, archived)
+    pieces = format_export_csv(orders) if export_format == 'csv' else format_export_ndjson(orders)
+    filename = f'orders-{restaurant_id if restaurant_id is not None else "all"}.{export_format}'
+    if compress:
+        filename += '.gz'
+    if compress:
+        mimetype = 'application/gzip'
+    else:
+        mimetype = 'text/csv' if export_format == 'csv' else 'application/x-ndjson'
+    response = Response(export_chunks(pieces, compress), mimetype=mimetype, headers={
+        'Content-Disposition': f'attachment; filename="{filename}"',
+        'Cache-Control': 'no-store',
+        'X-Accel-Buffering': 'no'
+    })
+    # Runs even if the client disconnects before the first byte
+    response.call_on_close(slots.release)
+    return response
+
+
+# 🔁 Idempotency-Key support: a retried request gets the stored response of the first
+# one instead of being applied again. Responses are kept in a per-worker LRU in front
+# of the idempotency_key table, which is shared by all workers; the row is committed
+# in the same transaction as the order, so there is never one without the other.
+IDEMPOTENCY_PURGE_EVERY = 1000  # stored keys per worker between purges of expired rows
+
+_idempotency_cache = OrderedDict()  # (scope, key) -> (expires_at, request_hash, status_code, response)
+_idempotency_lock = threading.Lock()
+_idempotency_stored = 0
+
+
+def idempotency_key():
+    # Returns the header value, '' when absent; raises ValueError when malformed
+    key = request.headers.get('Idempotency-Key', '')
+    if len(key) > 100:
+        raise ValueError('Idempotency-Key must be at most 100 characters')
+    return key
+
+
+def request_fingerprint(data):
+    return hashlib.sha256(json.dumps(data, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def replay_response(request_hash, stored_hash, status_code, response):
+    if stored_hash != request_hash:
+        return jsonify({'error': 'Idempotency-Key was already used for a different request'}), 422
+    return Response(response, status=status_code, mimetype='application/json',
+                    headers={'Idempotent-Replayed': 'true'})
+
+
+def idempotent_replay(scope, key, request_hash):
+    """Return the stored response for this key, or None if the request is new."""
+    now = int(time.time())
+    with _idempotency_lock:
+        cached = _idempotency_cache.get((scope, key))
+        if cached and cached[0] > now:
+            _idempotency_cache.move_to_end((scope, key))
+            return replay_response(request_hash, *cached[1:])
 
-@app.route('/api/order/', methods=['POST'])
+    row = IdempotencyKey.query.get((scope, key))
+    if row is None:
+        return None
+    if row.created_at + current_app.config['IDEMPOTENCY_TTL'] <= now:
+        # Expired, the key may be used again; goes out with the caller's commit
+        db.session.delete(row)
+        return None
+    remember_response(scope, key, row.created_at, row.request_hash, row.status_code, row.response)
+    return replay_response(request_hash, row.request_hash, row.status_code, row.response)
+
+
+def store_response(scope, key, request_hash, status_code, body):
+    """Add the response to the session; the caller commits it with its own changes."""
+    created_at = int(time.time())
+    response = json.dumps(body)
+    db.session.add(IdempotencyKey(scope=scope, key=key, request_hash=request_hash, status_code=status_code,
+                                  response=response, created_at=created_at))
+    return created_at, response
+
+
+def remember_response(scope, key, created_at, request_hash, status_code, response):
+    config = current_app.config
+    with _idempotency_lock:
+        _idempotency_cache[(scope, key)] = (created_at + config['IDEMPOTENCY_TTL'], request_hash, status_code, response)
+        _idempotency_cache.move_to_end((scope, key))
+        while len(_idempotency_cache) > config['IDEMPOTENCY_CACHE_SIZE']:
+            _idempotency_cache.popitem(last=False)
+
+
+def purge_idempotency_keys():
+    cutoff = int(time.time()) - current_app.config['IDEMPOTENCY_TTL']
+    deleted = IdempotencyKey.query.filter(IdempotencyKey.created_at <= cutoff).delete(synchronize_session=False)
+    db.session.commit()
+    return deleted
+
+
+def maybe_purge_idempotency_keys():
+    # Keeps the table bounded without a cron job, one cheap indexed delete now and then
+    global _idempotency_stored
+    with _idempotency_lock:
+        _idempotency_stored += 1
+        due = _idempotency_stored % IDEMPOTENCY_PURGE_EVERY == 0
+    if due:
+        purge_idempotency_keys()
+
+
+# 📥 Write-behind order intake (ORDER_INTAKE=journal). orderNew() reserves an id, fsyncs
+# the order to this worker's journal and answers 202; the journal's writer thread inserts
+# orders in batches through apply_journaled_orders(), so a lunch rush costs one database
+# commit per batch instead of one per order. An Idempotency-Key is still committed before
+# the 202, so retries that reach another worker get the same id.
+# Configured by create_app()
+order_journal = OrderJournal()
+
+# Orders accepted by any worker's journal and not inserted yet. The journal announces
+# every fsynced group on the 'pending' channel before answering 202, and the order's
+# 'created' event retires it, so every process (the events service too) can tell an
+# accepted order from a missing one.
+PENDING_ORDER_TTL = 600  # seconds; entries whose 'created' event was lost
+_pending_orders = OrderedDict()  # order id -> monotonic time it was announced
+_pending_lock = threading.Lock()
+
+
+def announce_pending_orders(records):
+    broker.publish(['pending'], {'type': 'pending', 'order_ids': [record['id'] for record in records]})
+
+
+def _on_orders_pending(event):
+    now = time.monotonic()
+    with _pending_lock:
+        for order_id in event['order_ids']:
+            _pending_orders[order_id] = now
+        while _pending_orders and next(iter(_pending_orders.values())) < now - PENDING_ORDER_TTL:
+            _pending_orders.popitem(last=False)
+
+
+def _on_order_created(event):
+    if event['type'] == 'created':
+        with _pending_lock:
+            _pending_orders.pop(event['order']['id'], None)
+
+
+broker.add_listener('pending', _on_orders_pending)
+broker.add_listener('orders', _on_order_created)
+
+
+def order_pending(order_id):
+    with _pending_lock:
+        return order_id in _pending_orders
+
+
+class OrderIdBlock:
+    """Order ids handed out before the order reaches the database, reserved in blocks.
+
+    Postgres reserves them from the order id sequence, so every worker gets its own.
+    Elsewhere they continue from the highest id, which is only safe in one process.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self._ids = deque()
+        self._highest = 0
+        self._lock = threading.Lock()
+
+    def take(self):
+        with self._lock:
+            if not self._ids:
+                self._ids.extend(self._reserve())
+            return self._ids.popleft()
+
+    def _reserve(self):
+        if db.engine.dialect.name == 'postgresql':
+            sequence = db.func.pg_get_serial_sequence('"order"', 'id')
+            return db.session.execute(
+                db.select(db.func.nextval(sequence)).select_from(db.func.generate_series(1, self.size))
+            ).scalars().all()
+        start = max(db.session.query(db.func.max(Order.id)).scalar() or 0, self._highest) + 1
+        self._highest = start + self.size - 1
+        return range(start, start + self.size)
+
+
+# Configured by create_app()
+order_ids = OrderIdBlock(50)
+
+
+def journaled_order(record):
+    # Transient Order for rollups and events, never added to the session
+    return Order(id=record['id'], status=0, table_id=record['table_id'], order_number=record['order_number'],
+                 total_cost=record['total_cost'], restaurant_id=record['restaurant_id'], version=0)
+
+
+def journaled_order_dict(record):
+    # Same shape as GET /api/order/<id>, pictures and descriptions from the item snapshot
+    snapshot = get_item_snapshot(record['restaurant_id'])
+    items = []
+    for item_id, quantity, price, name in record['lines']:
+        item = snapshot.get(item_id, {})
+        items.append({'id': str(item_id), 'name': name, 'price': price, 'quantity': quantity,
+                      'src': item.get('src'), 'description': item.get('description'),
+                      'available': item.get('available', False), 'restaurant_id': record['restaurant_id']})
+    return {'id': record['id'], 'table_id': record['table_id'], 'status': 0,
+            'order_number': record['order_number'], 'items': items,
+            'restaurant_id': record['restaurant_id'], 'version': 0}
+
+
+def apply_journaled_orders(app, records):
+    """Insert journaled orders in one transaction. Returns how many were new.
+
+    Replays are safe: orders already in the database are skipped. accept_order()
+    reserves Idempotency-Keys before journaling; a key reserved for another order id
+    (only journals written before reservations existed) means the same request was
+    accepted twice, and the order the key points to wins.
+    """
+    with app.app_context():
+        ids = [record['id'] for record in records]
+        existing = {order_id for order_id, in db.session.query(Order.id).filter(Order.id.in_(ids))}
+        keys = [record['idempotency'][0] for record in records if record.get('idempotency')]
+        reserved = {key: json.loads(response).get('id') for key, response in db.session.query(
+            IdempotencyKey.key, IdempotencyKey.response).filter(
+            IdempotencyKey.scope == 'order', IdempotencyKey.key.in_(keys))} if keys else {}
+
+        new, stored = [], []
+        for record in records:
+            if record['id'] in existing:
+                continue
+            if record.get('idempotency'):
+                key, request_hash, created_at = record['idempotency']
+                if key in reserved and reserved[key] != record['id']:
+                    app.logger.warning('Journaled order dropped as a duplicate', extra={
+                        'order_id': record['id'], 'idempotency_key': key})
+                    continue
+                if key not in reserved:
+                    reserved[key] = record['id']
+                    stored.append({'scope': 'order', 'key': key, 'request_hash': request_hash,
+                                   'status_code': 202, 'created_at': created_at,
+                                   'response': json.dumps({'message': 'Order accepted', 'id': record['id']})})
+            new.append(record)
+        if not new:
+            db.session.rollback()
+            return 0
+
+        orders = [journaled_order(record) for record in new]
+        db.session.execute(Order.__table__.insert().values(change_seq=next_change_seq()), [
+            {'id': o.id, 'status': o.status, 'table_id': o.table_id, 'order_number': o.order_number,
+             'total_cost': o.total_cost, 'restaurant_id': o.restaurant_id, 'version': o.version}
+            for o in orders
+        ])
+        db.session.execute(OrderLine.__table__.insert(), [
+            {'order_id': record['id'], 'line_no': line_no, 'item_id': item_id, 'quantity': quantity,
+             'price': price, 'name': name}
+            for record in new
+            for line_no, (item_id, quantity, price, name) in enumerate(record['lines'])
+        ])
+        record_orders_placed(orders)
+        if stored:
+            db.session.execute(IdempotencyKey.__table__.insert(), stored)
+        db.session.commit()
+        for order in orders:
+            publish_order(order, 'created')
+        return len(new)
+
+
+def accept_order(restaurant_id, table_id, new_items, key, request_hash):
+    # ORDER_INTAKE=journal: durable on local disk now, in the database shortly
+    order_id = order_ids.take()
+    body = {'message': 'Order accepted', 'id': order_id}
+    record = {
+        'id': order_id,
+        'restaurant_id': restaurant_id,
+        'table_id': table_id,
+        'order_number': int(datetime.now().timestamp()),
+        'total_cost': sum(item.price * item.quantity for item in new_items),
+        'lines': [[item.id, item.quantity, item.price, item.name] for item in new_items],
+    }
+    if key:
+        # Reserved in the database before answering, so a retry that reaches another
+        # worker gets this id back instead of having a second order accepted
+        created_at, response = store_response('order', key, request_hash, 202, body)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            replay = idempotent_replay('order', key, request_hash)
+            if replay is None:
+                raise
+            return replay
+        record['idempotency'] = [key, request_hash, created_at]
+    try:
+        order_journal.append(record)
+    except Exception:
+        if key:
+            # Nothing was accepted, let a retry use the key
+            IdempotencyKey.query.filter_by(scope='order', key=key).delete()
+            db.session.commit()
+        raise
+    if key:
+        remember_response('order', key, created_at, request_hash, 202, response)
+        maybe_purge_idempotency_keys()
+    current_app.logger.info('Order accepted into the journal', extra={
+        'order_id': order_id,
+        'restaurant_id': restaurant_id,
+        'total_cost': record['total_cost'],
+        'items_count': len(new_items)
+    })
+    return jsonify(body), 202
+
+
+@api.route('/api/order/', methods=['POST'])
 def orderNew():
     try:
         data = request.get_json()
-        app.logger.info('New order request', extra={
+        # Retries of an order that already went through are answered from the stored response
+        key = idempotency_key()
+        request_hash = request_fingerprint(data) if key else None
+        if key:
+            replay = idempotent_replay('order', key, request_hash)
+            if replay is not None:
+                current_app.logger.info('Order request replayed', extra={'idempotency_key': key})
+                return replay
+        current_app.logger.info('New order request', extra={
             'restaurant_id': data.get('restaurant_id'),
             'table_id': data.get('table_id'),
             'items_count': len(data.get('items', {})),
@@ -388,13 +2282,22 @@ def orderNew():
         table_id = int(data.get('table_id'))
         items = data.get('items', {})  # {"item_id": quantity}
 
-        if not isinstance(items, dict) or not all(isinstance(v, int) for v in items.values()):
-            app.logger.error('Invalid items format in order')
-            return jsonify({'error': 'Invalid items format. Expected a dictionary of {"item_id": quantity}'}), 410
+        error = cart_error(items)
+        if error:
+            current_app.logger.error('Invalid items format in order')
+            return jsonify({'error': error}), 410 if not isinstance(items, dict) else 400
+
+        new_items, rejected = resolve_cart(restaurant_id, items)
+        if rejected['not_found'] or rejected['unavailable']:
+            current_app.logger.warning('Order rejected: items cannot be ordered', extra={
+                'restaurant_id': restaurant_id,
+                'not_found': rejected['not_found'],
+                'unavailable': rejected['unavailable']
+            })
+            return jsonify({'error': 'Some items cannot be ordered', **rejected}), 400
 
-        new_items = []
-        for item_id, quantity in items.items():
-            new_items.append(LowLevelItem(item_id, quantity))
+        if current_app.config['ORDER_INTAKE'] == 'journal':
+            return accept_order(restaurant_id, table_id, new_items, key, request_hash)
 
         order_number = int(datetime.now().timestamp())
         status = 0  # Order placed
@@ -405,14 +2308,34 @@ def orderNew():
             table_id=table_id,
             order_number=order_number,
             status=status,
-            items=[item.to_dict() for item in new_items],
-            restaurant_id=restaurant_id
+            lines=[
+                OrderLine(line_no=line_no, item_id=item.id, quantity=item.quantity, price=item.price, name=item.name)
+                for line_no, item in enumerate(new_items)
+            ],
+            restaurant_id=restaurant_id,
+            change_seq=next_change_seq()
         )
 
         db.session.add(new_order)
-        db.session.commit()
-
-        app.logger.info('Order created successfully', extra={
+        record_orders_placed([new_order])
+        if key:
+            db.session.flush()  # assigns the id for the stored response
+            stored = store_response('order', key, request_hash, 201, {'message': 'Order created', 'id': new_order.id})
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            # A concurrent retry with the same key committed first
+            replay = idempotent_replay('order', key, request_hash) if key else None
+            if replay is None:
+                raise
+            return replay
+        if key:
+            remember_response('order', key, stored[0], request_hash, 201, stored[1])
+            maybe_purge_idempotency_keys()
+        publish_order(new_order, 'created')
+
+        current_app.logger.info('Order created successfully', extra={
             'order_id': new_order.id,
             'restaurant_id': restaurant_id,
             'total_cost': total_cost,
@@ -422,38 +2345,41 @@ def orderNew():
         return jsonify({'message': 'Order created', 'id': new_order.id}), 201
 
     except (TypeError, ValueError) as e:
-        app.logger.error('Order creation failed', extra={
+        current_app.logger.error('Order creation failed', extra={
             'error': str(e),
             'data': str(data)
         })
         return jsonify({'error': 'Invalid input'}), 400
 
 
-@app.route('/api/items', methods=['GET', 'POST'])
+@api.route('/api/items', methods=['GET', 'POST'])
 def handle_items():
     if request.method == 'GET':
-        # Publicly accessible, return all items
-        items = Item.query.all()
-        return jsonify([
-            {
-                'id': item.id,
-                'name': item.name,
-                'description': item.description,
-                'src': item.src,
-                'price': item.price,
-                'available': item.available,
-                'restaurant_id': item.restaurant_id
-            } for item in items
-        ]), 200
+        # Publicly accessible, return all items, the menu of ?restaurant_id= or ?ids=1,5,9
+        if 'ids' in request.args:
+            try:
+                ids = parse_item_ids(request.args['ids'].split(','))
+            except ValueError:
+                return jsonify({'error': f'Invalid input. Expected up to {ITEM_LOOKUP_MAX} comma-separated ids'}), 400
+            found = lookup_items(ids)
+            return jsonify({
+                'items': [found[item_id].to_dict() for item_id in ids if item_id in found],
+                'not_found': [item_id for item_id in ids if item_id not in found]
+            }), 200
+
+        restaurant_id = request.args.get('restaurant_id', type=int)
+        if restaurant_id is None:
+            return cached_menu_response('items', lambda: [item.to_dict() for item in Item.query.all()])
+        return cached_menu_response(
+            ('items', restaurant_id),
+            lambda: [item.to_dict() for item in Item.query.filter_by(restaurant_id=restaurant_id)],
+            restaurant_id
+        )
 
     elif request.method == 'POST':
         # Admin-only access
-        auth_header = request.headers.get('Authorization')
-        if not auth_header or not auth_header.startswith('Bearer '):
-            return jsonify({'error': 'Admin access required'}), 403
-        token = auth_header.replace('Bearer ', '')
-        user = validate_token(token)
-        if not user or not isinstance(user, AdminUser):
+        user = get_admin()
+        if not user:
             return jsonify({'error': 'Admin access required'}), 403
         data = request.get_json()
         try:
@@ -469,12 +2395,216 @@ def handle_items():
                 return jsonify({'error': 'Admin super access required or edit only your restaurant'}), 403
             db.session.add(new_item)
             db.session.commit()
-            return jsonify({'status': 'Created', 'id': new_item.id}), 201
+            invalidate_menu(new_item.restaurant_id)
+            return jsonify({'status': 'Created', 'id': new_item.id, 'item': new_item.to_dict()}), 201
         except (KeyError, ValueError):
             return jsonify({'error': 'Invalid input'}), 400
 
 
-@app.route('/api/items/<int:item_id>', methods=['GET', 'PUT', 'DELETE'])
+ITEM_LOOKUP_MAX = 200
+
+
+def parse_item_ids(raw_ids):
+    ids = list(dict.fromkeys(int(item_id) for item_id in raw_ids if str(item_id).strip()))
+    if not ids or len(ids) > ITEM_LOOKUP_MAX:
+        raise ValueError('Too many or no ids')
+    return ids
+
+
+def lookup_items(ids):
+    # One query for the whole batch: {item_id: Item}
+    return {item.id: item for item in Item.query.filter(Item.id.in_(ids))}
+
+
+@api.route('/api/items/lookup', methods=['POST'])
+def lookup_cart_items():
+    # Body is a cart, {"items": {"item_id": quantity}}; returns every line and the subtotal
+    data = request.get_json(silent=True) or {}
+    cart = data.get('items')
+    error = cart_error(cart)
+    if error:
+        return jsonify({'error': error}), 400
+    try:
+        ids = parse_item_ids(cart.keys())
+    except ValueError:
+        return jsonify({'error': f'Invalid input. Expected up to {ITEM_LOOKUP_MAX} items'}), 400
+    quantities = {int(item_id): quantity for item_id, quantity in cart.items()}
+
+    found = lookup_items(ids)
+    items = []
+    subtotal = 0
+    for item_id in ids:
+        if item_id not in found:
+            continue
+        line = found[item_id].to_dict()
+        line['quantity'] = quantities[item_id]
+        if line['available']:
+            subtotal += line['price'] * line['quantity']
+        items.append(line)
+    return jsonify({
+        'items': items,
+        'not_found': [item_id for item_id in ids if item_id not in found],
+        'subtotal': subtotal
+    }), 200
+
+
+# 🔎 Menu search. Each worker keeps a MenuSearchIndex (see search.py) of every item;
+# menu events mark restaurants dirty and the next search reindexes just those, and
+# the whole index is rebuilt in the background every SEARCH_INDEX_TTL in case an
+# event was lost. While the first build runs, or when the catalog is larger than
+# SEARCH_INDEX_MAX_ITEMS, searches go to the database (pg_trgm indexes on Postgres).
+SEARCH_LIMIT_DEFAULT = 20
+SEARCH_LIMIT_MAX = 100
+SEARCH_MAX_WORDS = 8
+
+_search_index = None  # (built_at, MenuSearchIndex or None when the catalog is too big)
+_search_dirty = set()  # restaurant ids to reindex
+_search_reapply = set()  # reindexed while a build runs, reindexed again in the new index
+_search_building = False
+_search_lock = threading.Lock()
+
+
+def _on_menu_changed_for_search(event):
+    with _search_lock:
+        _search_dirty.update(event['restaurant_ids'])
+
+
+broker.add_listener('menu', _on_menu_changed_for_search)
+
+
+def build_search_index():
+    global _search_index, _search_building
+    try:
+        if Item.query.count() > current_app.config['SEARCH_INDEX_MAX_ITEMS']:
+            index = None
+        else:
+            index = MenuSearchIndex()
+            index.add(item.to_dict() for item in Item.query.yield_per(5000))
+        with _search_lock:
+            _search_index = (time.monotonic(), index)
+    finally:
+        with _search_lock:
+            # The build may have read those restaurants before they changed
+            _search_dirty.update(_search_reapply)
+            _search_reapply.clear()
+            _search_building = False
+        db.session.remove()
+
+
+def _rebuild_search_index(app):
+    with app.app_context():
+        try:
+            build_search_index()
+        except Exception:
+            app.logger.exception('Rebuilding the menu search index failed')
+
+
+def get_search_index():
+    """The worker's search index, or None if searches have to go to the database."""
+    global _search_building
+    broker.start()  # so menu events reach us
+    with _search_lock:
+        current = _search_index
+        ttl = current_app.config['SEARCH_INDEX_TTL']
+        start = not _search_building and (current is None or time.monotonic() - current[0] >= ttl)
+        if start:
+            _search_building = True
+        dirty = set(_search_dirty) if current is not None and current[1] is not None else set()
+        _search_dirty.difference_update(dirty)
+        if _search_building:
+            _search_reapply.update(dirty)
+    if start:
+        # The first search in this worker starts the build and goes to the database
+        threading.Thread(target=_rebuild_search_index, args=(current_app._get_current_object(),),
+                         name='search-index', daemon=True).start()
+    if current is None or current[1] is None:
+        return None
+    index = current[1]
+    if dirty:
+        items = {}
+        try:
+            for item in Item.query.filter(Item.restaurant_id.in_(dirty)):
+                items.setdefault(item.restaurant_id, []).append(item.to_dict())
+        except Exception:
+            with _search_lock:
+                _search_dirty.update(dirty)
+            raise
+        for restaurant_id in dirty:
+            index.replace_restaurant(restaurant_id, items.get(restaurant_id, []))
+    return index
+
+
+def escape_like(value):
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def search_items_database(words, restaurant_id, available, min_price, max_price, limit):
+    # Every word must appear in the name or description; on Postgres a near miss on the
+    # name counts too. Both go through the GIN trigram indexes of create_search_indexes()
+    query = Item.query
+    postgres = db.engine.dialect.name == 'postgresql'
+    for word in words:
+        pattern = f'%{escape_like(word)}%'
+        conditions = [Item.name.ilike(pattern, escape='\\'), Item.description.ilike(pattern, escape='\\')]
+        if postgres:
+            conditions.append(Item.name.op('%>')(word))  # word_similarity(word, name) above the threshold
+        query = query.filter(db.or_(*conditions))
+    if restaurant_id is not None:
+        query = query.filter(Item.restaurant_id == restaurant_id)
+    if available is not None:
+        query = query.filter(Item.available.is_(available))
+    if min_price is not None:
+        query = query.filter(Item.price >= min_price)
+    if max_price is not None:
+        query = query.filter(Item.price <= max_price)
+    if postgres:
+        text = ' '.join(words)
+        rank = db.func.word_similarity(text, Item.name) + \
+            db.func.word_similarity(text, db.func.coalesce(Item.description, '')) * 0.5
+        query = query.order_by(rank.desc(), Item.id.desc())
+    else:
+        query = query.order_by(Item.name, Item.id)
+    return [item.to_dict() for item in query.limit(limit)]
+
+
+def create_search_indexes():
+    # pg_trgm may need a superuser to install; without it the fallback scans the item table
+    try:
+        with db.engine.begin() as conn:
+            conn.execute(db.text('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+            for column in ('name', 'description'):
+                conn.execute(db.text(f'CREATE INDEX IF NOT EXISTS ix_item_{column}_trgm '
+                                     f'ON item USING gin ({column} gin_trgm_ops)'))
+    except DBAPIError as e:
+        logging.warning(f'Trigram indexes for menu search not created: {e}')
+
+
+@api.route('/api/items/search', methods=['GET'])
+def search_items():
+    # ?q= words to find by prefix or approximately in item names and descriptions, with
+    # optional ?restaurant_id=, ?available=1|0, ?min_price=, ?max_price=, ?limit=
+    try:
+        words = tokenize(request.args.get('q', ''))[:SEARCH_MAX_WORDS]
+        restaurant_id = request.args.get('restaurant_id', type=int)
+        available = request.args.get('available')
+        available = None if available in (None, '') else available in ('1', 'true')
+        min_price = request.args.get('min_price', type=int)
+        max_price = request.args.get('max_price', type=int)
+        limit = min(int(request.args.get('limit', SEARCH_LIMIT_DEFAULT)), SEARCH_LIMIT_MAX)
+    except ValueError:
+        return jsonify({'error': 'Invalid input'}), 400
+    if not words or limit < 1:
+        return jsonify({'error': 'Invalid input. Expected ?q= with at least one word'}), 400
+
+    index = get_search_index()
+    if index is not None:
+        items = index.search(' '.join(words), restaurant_id, available, min_price, max_price, limit)
+    else:
+        items = search_items_database(words, restaurant_id, available, min_price, max_price, limit)
+    return jsonify({'items': items, 'count': len(items)}), 200
+
+
+@api.route('/api/items/<int:item_id>', methods=['GET', 'PUT', 'DELETE'])
 def handle_item(item_id):
     item = Item.query.get(item_id)
     if not item:
@@ -491,14 +2621,11 @@ def handle_item(item_id):
         })
 
     elif request.method == 'PUT':
-        auth_header = request.headers.get('Authorization')
-        if not auth_header or not auth_header.startswith('Bearer '):
-            return jsonify({'error': 'Admin access required'}), 403
-        token = auth_header.replace('Bearer ', '')
-        user = validate_token(token)
-        if not user or not isinstance(user, AdminUser):
+        user = get_admin()
+        if not user:
             return jsonify({'error': 'Admin access required'}), 403
         data = request.get_json()
+        old_restaurant_id = item.restaurant_id
         try:
             item.name = data.get('name', item.name)
             item.src = data.get('src', item.src)
@@ -509,24 +2636,285 @@ def handle_item(item_id):
             if (not user.superuser and item.restaurant_id != user.restaurant_id):
                 return jsonify({'error': 'Admin super access required or edit only your restaurant items'}), 403
             db.session.commit()
+            invalidate_menu(old_restaurant_id, item.restaurant_id)
             return jsonify({'status': 'Updated'})
         except (ValueError, TypeError):
             return jsonify({'error': 'Invalid input'}), 400
 
     elif request.method == 'DELETE':
-        auth_header = request.headers.get('Authorization')
-        if not auth_header or not auth_header.startswith('Bearer '):
-            return jsonify({'error': 'Admin access required'}), 403
-        token = auth_header.replace('Bearer ', '')
-        user = validate_token(token)
-        if not user or not isinstance(user, AdminUser):
+        user = get_admin()
+        if not user:
             return jsonify({'error': 'Admin access required'}), 403
+        restaurant_id = item.restaurant_id
         db.session.delete(item)
         db.session.commit()
+        invalidate_menu(restaurant_id)
         return jsonify({'status': 'Deleted'})
 
 
-@app.route('/api/user', methods=['GET'])
+# 📥 Bulk menu import and export, one restaurant at a time. An import is validated as a
+# whole before anything is written, then applied in one transaction.
+MENU_IMPORT_MAX_ROWS = 5000
+MENU_FIELDS = ('id', 'name', 'price', 'available', 'description', 'src')
+TRUE_VALUES = {'1', 'true', 'yes', 'y'}
+FALSE_VALUES = {'0', 'false', 'no', 'n'}
+
+
+def read_menu_rows():
+    """Parse a JSON array, NDJSON or CSV body into a list of (row dict or None, error)."""
+    if request.mimetype == 'text/csv':
+        reader = csv.DictReader(io.StringIO(request.get_data(as_text=True)))
+        # Empty CSV cells mean "not given"
+        return [({k: v for k, v in row.items() if k is not None and v != ''}, None) for row in reader]
+    if request.mimetype == 'application/x-ndjson':
+        rows = []
+        for line in request.get_data(as_text=True).splitlines():
+            if not line.strip():
+                continue
+            try:
+                rows.append((json.loads(line), None))
+            except ValueError:
+                rows.append((None, 'invalid JSON'))
+        return rows
+    data = request.get_json(silent=True)
+    if isinstance(data, dict):
+        data = data.get('items')
+    if not isinstance(data, list):
+        raise ValueError('Expected a JSON array, NDJSON or CSV')
+    return [(row, None) for row in data]
+
+
+def validate_menu_row(raw, restaurant_id):
+    """Return (values, errors) for one imported row; values only hold the given fields."""
+    if not isinstance(raw, dict):
+        return {}, ['expected an object']
+    values, errors = {}, []
+    for key in raw:
+        if key not in MENU_FIELDS and key != 'restaurant_id':
+            errors.append(f'unknown field {key}')
+    if raw.get('restaurant_id') not in (None, restaurant_id, str(restaurant_id)):
+        errors.append('restaurant_id does not match')
+    if raw.get('id') is not None:
+        try:
+            if isinstance(raw['id'], bool):
+                raise TypeError
+            values['id'] = int(raw['id'])
+        except (TypeError, ValueError):
+            errors.append('id must be an integer')
+    if 'name' in raw:
+        if not isinstance(raw['name'], str) or not raw['name'].strip() or len(raw['name']) > 100:
+            errors.append('name must be 1-100 characters')
+        else:
+            values['name'] = raw['name'].strip()
+    if 'price' in raw:
+        try:
+            # JSON true/false would pass as 1/0
+            if isinstance(raw['price'], bool):
+                raise TypeError
+            price = float(raw['price'])
+            if price != int(price) or price < 0:
+                raise ValueError
+            values['price'] = int(price)
+        except (TypeError, ValueError, OverflowError):
+            errors.append('price must be a non-negative whole number')
+    if 'available' in raw:
+        available = raw['available']
+        if isinstance(available, str) and available.strip().lower() in TRUE_VALUES | FALSE_VALUES:
+            values['available'] = available.strip().lower() in TRUE_VALUES
+        elif isinstance(available, bool):
+            values['available'] = available
+        else:
+            errors.append('available must be true or false')
+    for field in ('description', 'src'):
+        if field in raw:
+            if raw[field] is not None and not isinstance(raw[field], str):
+                errors.append(f'{field} must be a string')
+            else:
+                values[field] = raw[field] or ''
+    return values, errors
+
+
+def plan_menu_import(restaurant_id, rows):
+    """Match rows to existing items: by id, else by a unique name, else a new item.
+
+    Returns (targets, errors) where targets is a list of (row number, item or None,
+    values) and errors a list of {'row': n, 'errors': [...]}.
+    """
+    items = Item.query.filter_by(restaurant_id=restaurant_id).all()
+    by_id = {item.id: item for item in items}
+    by_name = {}
+    for item in items:
+        by_name.setdefault(item.name, []).append(item)
+
+    targets, errors = [], []
+    seen_items, seen_names = set(), set()
+    for row_number, (raw, parse_error) in enumerate(rows, 1):
+        values, row_errors = validate_menu_row(raw, restaurant_id) if parse_error is None else ({}, [parse_error])
+        item = None
+        if not row_errors:
+            if 'id' in values:
+                item = by_id.get(values['id'])
+                if item is None:
+                    row_errors.append(f'item {values["id"]} not found in this restaurant')
+            elif 'name' not in values:
+                row_errors.append('id or name is required')
+            else:
+                matches = by_name.get(values['name'], [])
+                if len(matches) > 1:
+                    row_errors.append('several items have this name, give an id')
+                elif matches:
+                    item = matches[0]
+                elif 'price' not in values:
+                    row_errors.append('price is required for a new item')
+                elif values['name'] in seen_names:
+                    row_errors.append('duplicate new item name')
+                else:
+                    seen_names.add(values['name'])
+        if not row_errors and item is not None:
+            if item.id in seen_items:
+                row_errors.append(f'item {item.id} appears more than once')
+            seen_items.add(item.id)
+        if row_errors:
+            errors.append({'row': row_number, 'errors': row_errors})
+        else:
+            targets.append((row_number, item, values))
+    return targets, errors
+
+
+def apply_menu_import(restaurant_id, targets, dry_run=False):
+    """Write a validated import: one executemany UPDATE and one multi-row INSERT.
+
+    Returns ({row number: item id}, created, updated); with dry_run nothing is written
+    and new items have no id.
+    """
+    columns = ('name', 'price', 'available', 'description', 'src')
+    ids = {}
+    updates, inserts = [], []
+    for row_number, item, values in targets:
+        if item is None:
+            inserts.append((row_number, {
+                'name': values['name'],
+                'price': values['price'],
+                'available': values.get('available', True),
+                'description': values.get('description', ''),
+                'src': values.get('src', ''),
+                'restaurant_id': restaurant_id
+            }))
+            continue
+        ids[row_number] = item.id
+        merged = {column: values.get(column, getattr(item, column)) for column in columns}
+        if any(merged[column] != getattr(item, column) for column in columns):
+            updates.append(dict(merged, _id=item.id))
+
+    if dry_run:
+        return ids, len(inserts), len(updates)
+
+    table = Item.__table__
+    if updates:
+        db.session.execute(table.update().where(table.c.id == db.bindparam('_id')), updates)
+    if inserts and db.engine.dialect.name == 'postgresql':
+        # New names are unique within the import, so they map the returned ids back to rows
+        returned = db.session.execute(table.insert().values([row for _, row in inserts])
+                                      .returning(table.c.id, table.c.name))
+        new_ids = {name: item_id for item_id, name in returned}
+        for row_number, row in inserts:
+            ids[row_number] = new_ids[row['name']]
+    elif inserts:
+        new_items = [(row_number, Item(**row)) for row_number, row in inserts]
+        db.session.add_all(item for _, item in new_items)
+        db.session.flush()
+        for row_number, item in new_items:
+            ids[row_number] = item.id
+    return ids, len(inserts), len(updates)
+
+
+@api.route('/api/restaurants/<int:restaurant_id>/menu', methods=['GET', 'POST'])
+def restaurant_menu(restaurant_id):
+    # GET streams the menu as ?format=ndjson|csv; POST upserts a JSON array, NDJSON or
+    # CSV of items (see plan_menu_import), ?dry_run=1 only validates
+    user = get_admin()
+    if not user:
+        return jsonify({'error': 'Admin access required'}), 403
+    if not user.superuser and restaurant_id != user.restaurant_id:
+        return jsonify({'error': 'Admin super access required or edit only your restaurant'}), 403
+    if not db.session.query(Restaurant.query.filter(Restaurant.id == restaurant_id).exists()).scalar():
+        return jsonify({'error': 'Restaurant not found'}), 404
+
+    if request.method == 'GET':
+        export_format = request.args.get('format', 'ndjson')
+        if export_format not in ('ndjson', 'csv'):
+            return jsonify({'error': 'Invalid input'}), 400
+        pieces = (format_menu_csv if export_format == 'csv' else format_menu_ndjson)(
+            iter_menu_items(db.engine, restaurant_id))
+        return Response(export_chunks(pieces, False),
+                        mimetype='text/csv' if export_format == 'csv' else 'application/x-ndjson',
+                        headers={
+                            'Content-Disposition': f'attachment; filename="menu-{restaurant_id}.{export_format}"',
+                            'Cache-Control': 'no-store'
+                        })
+
+    try:
+        rows = read_menu_rows()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except UnicodeDecodeError:
+        return jsonify({'error': 'Body must be UTF-8'}), 400
+    if len(rows) > MENU_IMPORT_MAX_ROWS:
+        return jsonify({'error': f'Too many rows, at most {MENU_IMPORT_MAX_ROWS} per import'}), 400
+
+    targets, errors = plan_menu_import(restaurant_id, rows)
+    if errors:
+        first = errors[0]
+        return jsonify({
+            'error': f'Row {first["row"]}: {"; ".join(first["errors"])}. Nothing was imported',
+            'errors': errors
+        }), 400
+    dry_run = request.args.get('dry_run') in ('1', 'true')
+    ids, created, updated = apply_menu_import(restaurant_id, targets, dry_run)
+    if dry_run:
+        db.session.rollback()
+    else:
+        db.session.commit()
+        invalidate_menu(restaurant_id)
+        current_app.logger.info('Menu imported', extra={
+            'restaurant_id': restaurant_id, 'user_id': user.id, 'rows': len(rows), 'items_created': created, 'items_updated': updated
+        })
+    return jsonify({
+        'dry_run': dry_run,
+        'created': created,
+        'updated': updated,
+        'unchanged': len(targets) - created - updated,
+        'ids': [ids.get(row_number) for row_number, _, _ in targets]
+    }), 200
+
+
+def iter_menu_items(engine, restaurant_id):
+    table = Item.__table__
+    query = db.select(*(table.c[field] for field in MENU_FIELDS)) \
+        .where(table.c.restaurant_id == restaurant_id).order_by(table.c.id)
+    with engine.connect() as conn:
+        for row in conn.execution_options(stream_results=True).execute(query).yield_per(EXPORT_FETCH_SIZE):
+            yield dict(row._mapping)
+
+
+def format_menu_ndjson(items):
+    for item in items:
+        yield json.dumps(item) + '\n'
+
+
+def format_menu_csv(items):
+    # Same columns the import reads, so an export can be edited and posted back
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, MENU_FIELDS)
+    writer.writeheader()
+    for item in items:
+        writer.writerow(dict(item, available='true' if item['available'] else 'false'))
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+@api.route('/api/user', methods=['GET'])
 @admin_required
 def get_user():
     return jsonify({
@@ -537,22 +2925,27 @@ def get_user():
     }), 200
 
 
-@app.route('/api/restaurants', methods=['GET', 'POST'])
+@api.route('/api/restaurants', methods=['GET', 'POST'])
 def handle_restaurants():
     if request.method == 'GET':
-        # Retrieve all restaurants
-        restaurants = Restaurant.query.all()
-        to_return = [r.to_dict() for r in restaurants]
-        return jsonify(to_return), 200
+        # Retrieve all restaurants, with their items in one extra query at most
+        try:
+            fields, include_items = parse_restaurant_shape()
+        except ValueError:
+            return jsonify({'error': 'Invalid input'}), 400
+
+        def build():
+            query = Restaurant.query
+            if include_items:
+                query = query.options(db.selectinload(Restaurant.items))
+            return [r.to_dict(fields, include_items) for r in query.order_by(Restaurant.id)]
+
+        return cached_menu_response(('restaurants', fields, include_items), build)
 
     elif request.method == 'POST':
         # Add a new restaurant (Admin-only access)
-        auth_header = request.headers.get('Authorization')
-        if not auth_header or not auth_header.startswith('Bearer '):
-            return jsonify({'error': 'Admin access required'}), 403
-        token = auth_header.replace('Bearer ', '')
-        user = validate_token(token)
-        if not user or not isinstance(user, AdminUser):
+        user = get_admin()
+        if not user:
             return jsonify({'error': 'Admin access required'}), 403
         if not user.superuser:
             return jsonify({'error': 'Admin super access required'}), 403
@@ -568,34 +2961,35 @@ def handle_restaurants():
             )
             db.session.add(new_restaurant)
             db.session.commit()
+            invalidate_menu(new_restaurant.id)
             return jsonify({'message': 'Restaurant created', 'id': new_restaurant.id}), 201
         except (KeyError, ValueError):
             return jsonify({'error': 'Invalid input'}), 400
 
 
-@app.route('/api/restaurants/<int:restaurant_id>', methods=['GET', 'PUT'])
+@api.route('/api/restaurants/<int:restaurant_id>', methods=['GET', 'PUT'])
 def update_restaurant(restaurant_id):
     if request.method == 'GET':
-        restaurant = Restaurant.query.get(restaurant_id)
-        if not restaurant:
+        try:
+            fields, include_items = parse_restaurant_shape()
+        except ValueError:
+            return jsonify({'error': 'Invalid input'}), 400
+
+        def build():
+            query = Restaurant.query
+            if include_items:
+                query = query.options(db.joinedload(Restaurant.items))
+            restaurant = query.filter(Restaurant.id == restaurant_id).first()
+            return restaurant.to_dict(fields, include_items) if restaurant else None
+
+        response = cached_menu_response(('restaurant', restaurant_id, fields, include_items), build, restaurant_id)
+        if response is None:
             return jsonify({'error': 'Restaurant not found'}), 404
-        return jsonify({
-            'id': restaurant.id,
-            'name': restaurant.name,
-            'address': restaurant.address,
-            'working_hours': restaurant.working_hours,
-            'contact_info': restaurant.contact_info,
-            'description': restaurant.description,
-            'items': [item.to_dict() for item in restaurant.items]
-        })
+        return response
     elif request.method == 'PUT':
         # Admin-only access
-        auth_header = request.headers.get('Authorization')
-        if not auth_header or not auth_header.startswith('Bearer '):
-            return jsonify({'error': 'Admin access required'}), 403
-        token = auth_header.replace('Bearer ', '')
-        user = validate_token(token)
-        if not user or not isinstance(user, AdminUser):
+        user = get_admin()
+        if not user:
             return jsonify({'error': 'Admin access required'}), 403
         # Update an existing restaurant
         restaurant = Restaurant.query.get(restaurant_id)
@@ -611,11 +3005,91 @@ def update_restaurant(restaurant_id):
             restaurant.contact_info = data.get('contact_info', restaurant.contact_info)
             restaurant.description = data.get('description', restaurant.description)
             db.session.commit()
+            invalidate_menu(restaurant.id)
             return jsonify({'message': 'Restaurant updated'}), 200
         except (ValueError, TypeError):
             return jsonify({'error': 'Invalid input'}), 400
 
 
+STATS_TOP_ITEMS_MAX = 100
+
+
+def parse_time_param(value, default):
+    # Unix seconds or a YYYY-MM-DD date, UTC
+    if value in (None, ''):
+        return default
+    if value.isdigit():
+        return int(value)
+    return int(datetime.strptime(value, '%Y-%m-%d').replace(tzinfo=timezone.utc).timestamp())
+
+
+@api.route('/api/restaurants/<int:restaurant_id>/stats', methods=['GET'])
+def restaurant_stats(restaurant_id):
+    # ?from=&to= (default: the last 7 days), ?granularity=hour|day, ?top=10
+    user = get_admin()
+    if not user:
+        return jsonify({'error': 'Admin access required'}), 403
+    if not user.superuser and restaurant_id != user.restaurant_id:
+        return jsonify({'error': 'Admin super access required or view only your restaurant stats'}), 403
+
+    try:
+        end = parse_time_param(request.args.get('to'), int(time.time()))
+        start = parse_time_param(request.args.get('from'), end - 7 * 86400)
+        granularity = request.args.get('granularity', 'day')
+        step = {'hour': 3600, 'day': 86400}[granularity]
+        top = min(int(request.args.get('top', 10)), STATS_TOP_ITEMS_MAX)
+    except (KeyError, ValueError):
+        return jsonify({'error': 'Invalid input'}), 400
+    if start >= end or top < 0:
+        return jsonify({'error': 'Invalid input'}), 400
+
+    sales = rollup_rows(SalesRollup)
+    bucket = sales.c.bucket - sales.c.bucket % step
+    rows = db.session.query(
+        bucket,
+        db.func.sum(sales.c.orders),
+        db.func.sum(sales.c.completed),
+        db.func.sum(sales.c.canceled),
+        db.func.sum(sales.c.revenue),
+    ).filter(
+        sales.c.restaurant_id == restaurant_id,
+        sales.c.bucket >= start - start % SALES_BUCKET,
+        sales.c.bucket < end
+    ).group_by(bucket).order_by(bucket).all()
+    series = [
+        {'bucket': b, 'orders': int(o), 'completed': int(c), 'canceled': int(x), 'revenue': int(r)}
+        for b, o, c, x, r in rows
+    ]
+    totals = {key: sum(point[key] for point in series) for key in ('orders', 'completed', 'canceled', 'revenue')}
+    totals['average_ticket'] = round(totals['revenue'] / totals['completed'], 2) if totals['completed'] else None
+
+    top_items = []
+    if top:
+        # Item rollups are daily, so the range is widened to whole days
+        item_sales = rollup_rows(ItemSalesRollup)
+        quantity = db.func.sum(item_sales.c.quantity)
+        rows = db.session.query(item_sales.c.item_id, quantity, db.func.sum(item_sales.c.revenue)).filter(
+            item_sales.c.restaurant_id == restaurant_id,
+            item_sales.c.bucket >= start - start % ITEM_SALES_BUCKET,
+            item_sales.c.bucket < end
+        ).group_by(item_sales.c.item_id).order_by(quantity.desc(), item_sales.c.item_id).limit(top).all()
+        names = dict(db.session.query(Item.id, Item.name).filter(Item.id.in_([r[0] for r in rows]))) if rows else {}
+        top_items = [
+            {'item_id': item_id, 'name': names.get(item_id), 'quantity': int(q), 'revenue': int(r)}
+            for item_id, q, r in rows
+        ]
+
+    return jsonify({
+        'restaurant_id': restaurant_id,
+        'from': start,
+        'to': end,
+        'granularity': granularity,
+        'totals': totals,
+        'series': series,
+        'top_items': top_items
+    }), 200
+
+
 # Sample user creation function
 def add_sample_user():
     # Create a sample user
@@ -687,6 +3161,7 @@ def add_sample_user():
         db.session.add(new_item)
 
     db.session.commit()
+    invalidate_menu(0)
     print("Sample examples created")
     print("!!!REMOVE THIS PRODUCTION!!!") #TODO: remove in production!
 
@@ -696,9 +3171,184 @@ def getPrice(item_id):
         return item.price
     return None
 
+@api.cli.command('revoke-tokens')
+@click.argument('username')
+def revoke_tokens_command(username):
+    """Log USERNAME out everywhere, e.g. after changing their role."""
+    user = AdminUser.query.filter_by(username=username).first()
+    if not user:
+        raise click.ClickException(f'No admin user {username}')
+    revoke_tokens(user)
+    click.echo(f'Revoked tokens of {username}')
+
+@api.cli.command('seed-sample')
+def seed_sample_command():
+    """Create the sample restaurant, its menu and the admin/admin superuser."""
+    add_sample_user()
+
+
+@api.cli.command('generate-data')
+@click.option('--restaurants', default=10, show_default=True)
+@click.option('--items', default=50, show_default=True, help='Items per restaurant.')
+@click.option('--orders', default=100000, show_default=True)
+@click.option('--days', default=365, show_default=True, help='Days of order history.')
+@click.option('--end', default='2026-01-01', show_default=True,
+              help="End of the history: YYYY-MM-DD (UTC), a Unix timestamp, or 'now' (not reproducible).")
+@click.option('--seed', default=1, show_default=True, help='Use another seed to add more data to the same database.')
+@click.option('--batch-size', default=5000, show_default=True)
+@click.option('--admin-password', default=None, help='Also create admin-<restaurant id> users with this password.')
+def generate_data_command(restaurants, items, orders, days, end, seed, batch_size, admin_password):
+    """Bulk-generate restaurants, menus and order history for load testing."""
+    from datagen import generate_dataset, parse_end
+
+    try:
+        parse_end(end)
+    except ValueError:
+        raise click.BadParameter(f'{end!r} is not a date, a timestamp or now', param_hint='--end')
+    started = time.monotonic()
+
+    def progress(inserted):
+        rate = inserted / max(time.monotonic() - started, 1e-6)
+        click.echo(f'\r{inserted}/{orders} orders ({rate:.0f}/s)', nl=False)
+
+    restaurant_ids = generate_dataset(restaurants, items, orders, days=days, end=end, seed=seed,
+                                      batch_size=batch_size, admin_password=admin_password, progress=progress)
+    invalidate_menu(*restaurant_ids)
+    rebuild_rollups()
+    click.echo(f'\nGenerated {len(restaurant_ids)} restaurants (ids {restaurant_ids[0]}-{restaurant_ids[-1]}) '
+               f'in {time.monotonic() - started:.1f}s')
+
+
+@api.cli.command('rebuild-rollups')
+@click.option('--restaurant-id', type=int, default=None, help='Only this restaurant.')
+def rebuild_rollups_command(restaurant_id):
+    """Recompute the sales rollups from order history."""
+    started = time.monotonic()
+    rebuild_rollups(restaurant_id)
+    click.echo(f'Rollups rebuilt in {time.monotonic() - started:.1f}s')
+
+
+@api.cli.command('purge-idempotency-keys')
+def purge_idempotency_keys_command():
+    """Delete stored Idempotency-Key responses older than IDEMPOTENCY_TTL."""
+    click.echo(f'Deleted {purge_idempotency_keys()} expired keys')
+
+
+@api.cli.command('replay-order-journal')
+def replay_order_journal_command():
+    """Insert orders left in the journal by workers that are gone (ORDER_INTAKE=journal)."""
+    if not os.path.isdir(order_journal.directory):
+        click.echo(f'No journal in {order_journal.directory}')
+        return
+    click.echo(f'Replayed {order_journal.recover()} journaled orders')
+
+
+@api.cli.command('archive-orders')
+@click.option('--older-than-days', type=int, default=None,
+              help='archive completed and canceled orders placed before this many days ago '
+                   '[default: ORDER_ARCHIVE_AFTER_DAYS]')
+@click.option('--batch-size', type=int, default=1000, show_default=True)
+def archive_orders_command(older_than_days, batch_size):
+    """Move old closed orders out of the order table into the archive."""
+    moved = archive_orders(older_than_days, batch_size, progress=lambda n: click.echo(f'\r{n} orders', nl=False))
+    click.echo(f'\nArchived {moved} orders')
+
+
+@api.cli.command('init-db')
+def init_db_command():
+    """Create missing tables, columns and indexes."""
+    upgrade_schema()
+    click.echo('Database schema is up to date')
+
+
+@api.cli.command('backfill-order-lines')
+@click.option('--batch-size', default=1000, show_default=True)
+def backfill_order_lines_command(batch_size):
+    """Move items JSON of old orders into the order_line table."""
+    migrated = backfill_order_lines(batch_size, progress=lambda n: click.echo(f'\r{n} orders', nl=False))
+    click.echo(f'\nMigrated {migrated} orders')
+    if migrated:
+        click.echo('VACUUM the order table to reclaim the space')
+
+
+def create_app(config=None):
+    app = Flask(__name__)
+    app.config.update(load_config())
+    app.config.update(config or {})
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config)
+    app.secret_key = app.config['SECRET_KEY']
+
+    CORS(app)
+    setup_logging(app)
+
+    login_manager.init_app(app)
+    hasher.configure(app.config['PASSWORD_HASH_METHOD'], app.config['HASH_WORKERS'], app.config['HASH_QUEUE_LIMIT'],
+                     app.config['HASH_TIMEOUT'])
+    login_attempts_by_user.max_attempts = app.config['LOGIN_MAX_ATTEMPTS_PER_USER']
+    login_attempts_by_ip.max_attempts = app.config['LOGIN_MAX_ATTEMPTS_PER_IP']
+    login_attempts_by_user.window = login_attempts_by_ip.window = app.config['LOGIN_WINDOW']
+
+    # Enable CORS for the Flask app
+    CORS(app, resources={r"/*": {"origins": ["http://localhost:5173", "http://38.244.138.103:22594", "https://38.244.138.103:5173"]}}, supports_credentials=True) #TODO: change to production domain
+    db.init_app(app)
+
+    if app.config['WEB_CONCURRENCY'] > 1 and app.config['EVENTS_BACKEND'] == 'memory':
+        # Each worker would only see its own order events, menu changes and revocations
+        raise RuntimeError('EVENTS_BACKEND=memory only works with one worker, use EVENTS_BACKEND=postgres')
+    broker.backend = make_event_backend(app.config)
+    broker.queue_size = app.config['EVENTS_QUEUE_SIZE']
+    broker.max_subscribers = app.config['EVENTS_MAX_SUBSCRIBERS']
+
+    rate_limiter.backend = make_rate_limit_backend(app.config)
+    rate_limiter.limits = {
+        'order': (app.config['RATE_LIMIT_ORDER_BURST'], app.config['RATE_LIMIT_ORDER_RATE']),
+        'read': (app.config['RATE_LIMIT_READ_BURST'], app.config['RATE_LIMIT_READ_RATE']),
+    }
+    in_flight.limit = app.config['ADMISSION_MAX_IN_FLIGHT']
+    in_flight.reserved = app.config['ADMISSION_RESERVED']
+
+    order_journal.directory = app.config['ORDER_JOURNAL_DIR']
+    order_journal.batch_size = app.config['ORDER_JOURNAL_BATCH']
+    order_journal.apply = partial(apply_journaled_orders, app)
+    order_journal.on_durable = announce_pending_orders
+    if app.config['ORDER_INTAKE'] == 'journal':
+        # Replays segments of workers that died now, not when the next order comes in
+        order_journal.start()
+    order_ids.size = app.config['ORDER_ID_BLOCK']
+    app.extensions['trusted_proxies'] = parse_networks(app.config['TRUSTED_PROXIES'])
+    # Each running export holds a database connection
+    app.extensions['export_slots'] = threading.BoundedSemaphore(app.config['EXPORT_MAX_CONCURRENT'])
+
+    slow_ms = app.config['METRICS_SLOW_REQUEST_MS']
+    metrics.slow_request_seconds = slow_ms / 1000 if slow_ms > 0 else None
+    metrics.logger = app.logger
+    metrics.init_app(app)
+    metrics.add_gauge('cafe_event_streams', 'Open SSE streams in this worker',
+                      lambda: {(): broker.subscriber_count()})
+    metrics.add_gauge('cafe_admission_in_flight', 'Requests admitted and being served in this worker',
+                      lambda: {(): in_flight.stats()[0]})
+    metrics.add_gauge('cafe_admission_rejected', 'Requests turned away (429 rate limit, 503 over capacity)',
+                      lambda: {**{(('reason', 'rate_limit'), ('class', name)): value
+                                  for name, value in rate_limiter.stats().items()},
+                               **{(('reason', 'capacity'), ('priority', name)): value
+                                  for name, value in in_flight.stats()[1].items()}})
+    if app.config['ORDER_INTAKE'] == 'journal':
+        metrics.add_gauge('cafe_order_journal', 'Order journal counters (pending are not in the database yet)',
+                          lambda: {(('counter', name),): value for name, value in order_journal.stats().items()})
+    if 'log_pipeline' in app.extensions:
+        pipeline = app.extensions['log_pipeline']
+        metrics.add_gauge('cafe_log_pipeline_records', 'Log pipeline counters (dropped_* are lost records)',
+                          lambda: {(('counter', name),): value for name, value in pipeline.stats().items()})
+
+    app.register_blueprint(api)
+    return app
+
+
 if __name__ == '__main__':
+    # Development server; production runs wsgi:app under gunicorn (see gunicorn.conf.py)
+    app = create_app()
     with app.app_context():
-        db.create_all()
-    app.run(host='0.0.0.0', port=5050, debug=True)
+        upgrade_schema()
+    app.run(host='0.0.0.0', port=5050, debug=os.getenv('FLASK_DEBUG', '1') == '1')
     # with app.app_context():
     #     db.drop_all() #Only for testing purposes, usage of this will DROP ALL TABLES!!!
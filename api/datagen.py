@@ -0,0 +1,193 @@
+"""Deterministic synthetic datasets for load, pagination and analytics testing.
+
+Used by `flask generate-data`. The same seed and parameters, `end` included, always
+produce the same restaurants, menus and order history (ids aside, which depend on the
+database).
+"""
+import calendar
+import random
+import time
+
+from werkzeug.security import generate_password_hash
+
+from app import AdminUser, Item, Order, OrderLine, Restaurant, db
+
+ADJECTIVES = ['Golden', 'Rusty', 'Little', 'Blue', 'Happy', 'Hidden', 'Old', 'Green', 'Silver', 'Spicy',
+              'Quiet', 'Sunny', 'Lucky', 'Wild', 'Royal', 'Crispy']
+NOUNS = ['Spoon', 'Fork', 'Kettle', 'Oven', 'Garden', 'Harbor', 'Lantern', 'Table', 'Pepper', 'Olive',
+         'Bakery', 'Bistro', 'Grill', 'Noodle', 'Diner', 'Corner']
+STREETS = ['Main St', 'Market St', 'Park Ave', 'River Rd', 'Station Sq', 'Lenina St', 'Harbor Way', 'Hill Rd']
+
+# category -> (dishes, price range)
+MENU = {
+    'Starters': (['Bruschetta', 'Soup of the day', 'Garlic bread', 'Spring rolls', 'Hummus plate', 'Borscht'], (4, 9)),
+    'Mains': (['Pizza Margherita', 'Cheeseburger', 'Steak frites', 'Chicken curry', 'Ramen', 'Lasagna',
+               'Fish and chips', 'Pelmeni', 'Caesar salad', 'Pad thai', 'Risotto', 'Tacos'], (9, 30)),
+    'Desserts': (['Cheesecake', 'Tiramisu', 'Ice cream', 'Apple pie', 'Brownie', 'Syrniki'], (4, 10)),
+    'Drinks': (['Coffee', 'Tea', 'Lemonade', 'Orange juice', 'Long Island iced tea', 'Kompot', 'Beer',
+                'Sparkling water'], (2, 12)),
+}
+IMAGE_URL = ('https://images.unsplash.com/photo-{}?w=600&auto=format&fit=crop&q=60&ixlib=rb-4.1.0'
+             '&ixid=M3wxMjA3fDB8MHxzZWFyY2h8Mnx8fGVufDB8fDB8fHww')
+
+# Share of orders per hour of day, lunch and dinner peaks
+HOUR_WEIGHTS = [0, 0, 0, 0, 0, 0, 0, 1, 3, 4, 3, 4, 10, 12, 8, 4, 3, 4, 8, 10, 9, 6, 3, 1]
+# Closed orders: completed (2) or canceled (3); orders of the last hours may still be open
+CLOSED_STATUSES = ([2, 3], [92, 8])
+RECENT_STATUSES = ([0, 1, 2, 3], [25, 35, 35, 5])
+RECENT_SECONDS = 3 * 3600
+# History ends here unless told otherwise, so datasets do not depend on the day they are made
+DEFAULT_END = '2026-01-01'
+
+
+def parse_end(value):
+    """Unix time from 'now', a Unix timestamp or a YYYY-MM-DD date (UTC midnight)."""
+    if value == 'now':
+        return int(time.time())
+    if value.isdigit():
+        return int(value)
+    return calendar.timegm(time.strptime(value, '%Y-%m-%d'))
+
+
+def generate_restaurants(rng, count, items_per_restaurant, admin_password=None):
+    suffix = rng.randrange(16 ** 6)
+    restaurants = []
+    for i in range(count):
+        restaurants.append(Restaurant(
+            name=f'{rng.choice(ADJECTIVES)} {rng.choice(NOUNS)} #{i + 1}-{suffix:06x}',
+            address=f'{rng.randint(1, 200)} {rng.choice(STREETS)}',
+            working_hours=rng.choice(['9:00 AM - 10:00 PM', '11:00 AM - 11:00 PM', '8:00 AM - 6:00 PM']),
+            contact_info=f'+7-{rng.randint(900, 999)}-{rng.randint(100, 999)}-{rng.randint(1000, 9999)}',
+            description='Generated restaurant for load testing.'
+        ))
+    db.session.add_all(restaurants)
+    db.session.flush()
+    restaurant_ids = [r.id for r in restaurants]
+
+    items = []
+    for restaurant_id in restaurant_ids:
+        for i in range(items_per_restaurant):
+            category = rng.choice(list(MENU))
+            dishes, (low, high) = MENU[category]
+            items.append({
+                'name': f'{rng.choice(dishes)} {i + 1}',
+                'description': f'{category}: house special, generated.',
+                'src': IMAGE_URL.format(rng.randrange(10 ** 12, 10 ** 13)),
+                'price': rng.randint(low, high),
+                'available': rng.random() > 0.05,
+                'restaurant_id': restaurant_id,
+            })
+    db.session.execute(Item.__table__.insert(), items)
+
+    if admin_password:
+        # Hash once, every generated admin shares the password
+        password_hash = generate_password_hash(admin_password)
+        db.session.execute(AdminUser.__table__.insert(), [
+            {'username': f'admin-{restaurant_id}', 'password_hash': password_hash,
+             'restaurant_id': restaurant_id, 'superuser': False}
+            for restaurant_id in restaurant_ids
+        ])
+    db.session.commit()
+    return restaurant_ids
+
+
+def load_menus(restaurant_ids):
+    menus = {}
+    for item in Item.query.filter(Item.restaurant_id.in_(restaurant_ids)).order_by(Item.id):
+        if item.available:
+            menus.setdefault(item.restaurant_id, []).append(item.to_dict())
+    return menus
+
+
+def generate_order(rng, order_id, restaurant_id, menu, created_at, end):
+    # A few popular dishes get most of the orders
+    dishes = {}
+    for _ in range(rng.choices([1, 2, 3, 4, 5, 6, 8], [20, 30, 22, 12, 8, 5, 3])[0]):
+        item = menu[min(int(rng.paretovariate(1.2)) - 1, len(menu) - 1)] if rng.random() < 0.7 else rng.choice(menu)
+        dishes[item['id']] = item
+    lines = []
+    for line_no, item in enumerate(dishes.values()):
+        lines.append({
+            'order_id': order_id,
+            'line_no': line_no,
+            'item_id': item['id'],
+            'quantity': rng.choices([1, 2, 3], [80, 15, 5])[0],
+            'price': item['price'],
+            'name': item['name'],
+        })
+
+    statuses, weights = RECENT_STATUSES if end - created_at < RECENT_SECONDS else CLOSED_STATUSES
+    order = {
+        'id': order_id,
+        'status': rng.choices(statuses, weights)[0],
+        'table_id': rng.randint(1, 30),
+        'order_number': created_at,
+        'total_cost': sum(line['price'] * line['quantity'] for line in lines),
+        'restaurant_id': restaurant_id,
+    }
+    return order, lines
+
+
+def orders_per_day(count, days, start):
+    # Business grows over the period and weekends are busier
+    weights = []
+    for day in range(days):
+        weekday = time.gmtime(start + day * 86400).tm_wday
+        weights.append((0.7 + 0.6 * day / max(days - 1, 1)) * (1.3 if weekday >= 5 else 1.0))
+    total = sum(weights)
+    counts = [int(count * w / total) for w in weights]
+    counts[-1] += count - sum(counts)
+    return counts
+
+
+def generate_orders(rng, restaurant_ids, menus, count, days, end, batch_size, progress=None):
+    start = (end - days * 86400) // 86400 * 86400
+    restaurant_ids = [r for r in restaurant_ids if menus.get(r)]
+    # Some restaurants are much busier than others
+    weights = [1 / (rank + 1) ** 0.8 for rank in range(len(restaurant_ids))]
+
+    # Ids are assigned here so lines can be inserted without reading them back
+    next_id = (db.session.query(db.func.max(Order.id)).scalar() or 0) + 1
+    inserted = 0
+    orders, lines = [], []
+    # Day by day so ids grow with time, like real orders
+    for day, day_count in enumerate(orders_per_day(count, days, start)):
+        day_start = start + day * 86400
+        times = sorted(min(end, day_start + rng.choices(range(24), HOUR_WEIGHTS)[0] * 3600 + rng.randrange(3600))
+                       for _ in range(day_count))
+        for created_at in times:
+            restaurant_id = rng.choices(restaurant_ids, weights)[0]
+            order, order_lines = generate_order(rng, next_id, restaurant_id, menus[restaurant_id], created_at, end)
+            next_id += 1
+            orders.append(order)
+            lines.extend(order_lines)
+            if len(orders) >= batch_size:
+                inserted += insert_orders(orders, lines)
+                orders, lines = [], []
+                if progress:
+                    progress(inserted)
+    if orders:
+        inserted += insert_orders(orders, lines)
+        if progress:
+            progress(inserted)
+    if db.engine.dialect.name == 'postgresql':
+        sequence = db.func.pg_get_serial_sequence('"order"', 'id')
+        db.session.execute(db.select(db.func.setval(sequence, db.func.max(Order.id))))
+        db.session.commit()
+    return inserted
+
+
+def insert_orders(orders, lines):
+    db.session.execute(Order.__table__.insert(), orders)
+    db.session.execute(OrderLine.__table__.insert(), lines)
+    db.session.commit()
+    return len(orders)
+
+
+def generate_dataset(restaurants, items, orders, days=365, end=DEFAULT_END, seed=1, batch_size=5000,
+                     admin_password=None, progress=None):
+    rng = random.Random(seed)
+    restaurant_ids = generate_restaurants(rng, restaurants, items, admin_password)
+    menus = load_menus(restaurant_ids)
+    generate_orders(rng, restaurant_ids, menus, orders, days, parse_end(end), batch_size, progress)
+    return restaurant_ids
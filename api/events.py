@@ -0,0 +1,196 @@
+import json
+import logging
+import select
+import threading
+import time
+from collections import deque
+
+
+class Subscription:
+    """Bounded per-connection event queue.
+
+    When a slow client lets more than `maxlen` events pile up the oldest ones are
+    dropped and `overflowed` is set, so the stream can tell the client to resync.
+    """
+
+    def __init__(self, channels, maxlen):
+        self.channels = tuple(channels)
+        self.overflowed = False
+        self._events = deque(maxlen=maxlen)
+        self._ready = threading.Condition(threading.Lock())
+
+    def push(self, event):
+        with self._ready:
+            if len(self._events) == self._events.maxlen:
+                self.overflowed = True
+            self._events.append(event)
+            self._ready.notify()
+
+    def get(self, timeout):
+        # Returns the next event or None on timeout
+        with self._ready:
+            if not self._events:
+                self._ready.wait(timeout)
+            return self._events.popleft() if self._events else None
+
+
+class EventBroker:
+    """In-process fan-out of events to subscribers of named channels.
+
+    Events go out through a backend, which delivers them back to every worker's
+    broker (including this one) via `deliver()`.
+    """
+
+    def __init__(self, backend, queue_size=32, max_subscribers=5000):
+        self.backend = backend
+        self.queue_size = queue_size
+        self.max_subscribers = max_subscribers
+        self._subscribers = {}  # channel -> set of Subscription
+        self._listeners = {}  # channel -> list of callbacks
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def start(self):
+        # Backends that need a listener thread start it on first use in the worker
+        self.backend.start(self)
+
+    def add_listener(self, channel, callback):
+        # callback(event) runs in whatever thread delivers the event
+        with self._lock:
+            self._listeners.setdefault(channel, []).append(callback)
+
+    def subscriber_count(self):
+        return self._count
+
+    def subscribe(self, *channels):
+        # Returns None when the worker already serves max_subscribers streams
+        self.start()
+        subscription = Subscription(channels, self.queue_size)
+        with self._lock:
+            if self._count >= self.max_subscribers:
+                return None
+            self._count += 1
+            for channel in channels:
+                self._subscribers.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._count -= 1
+            for channel in subscription.channels:
+                subscribers = self._subscribers.get(channel)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self._subscribers[channel]
+
+    def publish(self, channels, event):
+        self.start()
+        self.backend.publish(list(channels), event)
+
+    def deliver(self, channels, event):
+        with self._lock:
+            targets = set()
+            callbacks = []
+            for channel in channels:
+                targets.update(self._subscribers.get(channel, ()))
+                callbacks.extend(self._listeners.get(channel, ()))
+        for callback in callbacks:
+            try:
+                callback(event)
+            except Exception:
+                logging.exception('Event listener failed')
+        for subscription in targets:
+            subscription.push(event)
+
+
+class MemoryBackend:
+    """Single-process backend: publishing delivers straight to the local broker."""
+
+    def __init__(self):
+        self._broker = None
+
+    def start(self, broker):
+        self._broker = broker
+
+    def publish(self, channels, event):
+        self._broker.deliver(channels, event)
+
+
+class PostgresBackend:
+    """Cross-worker backend on top of Postgres LISTEN/NOTIFY.
+
+    Every worker LISTENs on one Postgres channel from a background thread and hands
+    notifications to its broker. The thread is started lazily so it lives in the
+    worker process, not in a pre-fork master.
+    """
+
+    def __init__(self, dsn, pg_channel='cafe_events', reconnect_delay=1.0):
+        import psycopg2
+
+        self._psycopg2 = psycopg2
+        self.dsn = dsn
+        self.pg_channel = pg_channel
+        self.reconnect_delay = reconnect_delay
+        self._broker = None
+        self._thread = None
+        self._notify_conn = None
+        self._lock = threading.Lock()
+
+    def start(self, broker):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._broker = broker
+            self._thread = threading.Thread(target=self._listen, name='events-listener', daemon=True)
+            self._thread.start()
+
+    def publish(self, channels, event):
+        payload = json.dumps({'channels': channels, 'event': event}, separators=(',', ':'))
+        with self._lock:
+            try:
+                if self._notify_conn is None or self._notify_conn.closed:
+                    self._notify_conn = self._connect()
+                with self._notify_conn.cursor() as cursor:
+                    cursor.execute('SELECT pg_notify(%s, %s)', (self.pg_channel, payload))
+            except self._psycopg2.Error:
+                logging.exception('Failed to publish event')
+                self._notify_conn = None
+
+    def _connect(self):
+        conn = self._psycopg2.connect(self.dsn)
+        conn.autocommit = True
+        return conn
+
+    def _listen(self):
+        while True:
+            conn = None
+            try:
+                conn = self._connect()
+                with conn.cursor() as cursor:
+                    cursor.execute(f'LISTEN {self.pg_channel}')
+                while True:
+                    if select.select([conn], [], [], 60) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        notify = conn.notifies.pop(0)
+                        message = json.loads(notify.payload)
+                        self._broker.deliver(message['channels'], message['event'])
+            except self._psycopg2.Error:
+                logging.exception('Event listener connection lost, reconnecting')
+                if conn is not None:
+                    conn.close()
+                time.sleep(self.reconnect_delay)
+
+
+def format_sse(event, name=None, event_id=None):
+    lines = []
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    if name is not None:
+        lines.append(f'event: {name}')
+    lines.append('data: ' + json.dumps(event, separators=(',', ':')))
+    return '\n'.join(lines) + '\n\n'
@@ -0,0 +1,28 @@
+import multiprocessing
+import os
+
+# Every setting can be overridden from the environment, see docker-compose.yml
+bind = os.getenv('BIND', '0.0.0.0:5050')
+workers = int(os.getenv('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+# Inherited by the workers, so create_app() knows it is not alone (see load_config())
+os.environ['WEB_CONCURRENCY'] = str(workers)
+
+# gthread keeps a pool of threads per worker. SSE streams hold a thread each, so they
+# are capped per worker (EVENTS_MAX_SUBSCRIBERS) and served by a separate events service
+# with many threads, see docker-compose.yml and nginx.conf.
+worker_class = os.getenv('WORKER_CLASS', 'gthread')
+threads = int(os.getenv('WEB_THREADS', 8))
+
+timeout = int(os.getenv('WEB_TIMEOUT', 30))
+graceful_timeout = int(os.getenv('WEB_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.getenv('WEB_KEEPALIVE', 5))
+
+# Recycle workers now and then to bound memory growth
+max_requests = int(os.getenv('WEB_MAX_REQUESTS', 10000))
+max_requests_jitter = int(os.getenv('WEB_MAX_REQUESTS_JITTER', 1000))
+
+# Each worker builds its own app, database pool and background threads after the fork
+preload_app = False
+
+accesslog = None
+errorlog = '-'
@@ -0,0 +1,69 @@
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+
+class HashingBusy(Exception):
+    """Raised when the hashing queue is full or a hash took too long."""
+
+
+class PasswordHasher:
+    """Runs password hashing in a small process pool, away from the request threads.
+
+    At most `workers + queue_limit` hashes are in flight per worker process; beyond
+    that calls fail fast with HashingBusy instead of queueing. workers=0 hashes
+    inline, which is handy for tests and benchmarks. Pool processes start from a
+    forkserver, which imports the main module again: scripts that hash with
+    workers > 0 need an `if __name__ == '__main__':` guard.
+    """
+
+    def __init__(self, method, workers=2, queue_limit=16, timeout=10):
+        self._executor = None
+        self._lock = threading.Lock()
+        self.configure(method, workers, queue_limit, timeout)
+
+    def configure(self, method, workers=2, queue_limit=16, timeout=10):
+        # Takes effect for the pool only if called before the first hash
+        self.method = method
+        self.workers = workers
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(workers + queue_limit)
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method)
+
+    def verify(self, pwhash, password):
+        return self._run(check_password_hash, pwhash, password)
+
+    def needs_rehash(self, pwhash):
+        # werkzeug hashes look like "pbkdf2:sha256:260000$salt$hash"
+        return pwhash.split('$', 1)[0] != self.method
+
+    def _run(self, fn, *args):
+        if not self.workers:
+            return fn(*args)
+        if not self._slots.acquire(blocking=False):
+            raise HashingBusy('Too many hashes in flight')
+        try:
+            future = self._get_executor().submit(fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(self.timeout)
+        except TimeoutError:
+            raise HashingBusy('Hashing timed out')
+
+    def _get_executor(self):
+        # Created on first use, by then the worker runs log, event and journal threads;
+        # forking it could copy a lock some other thread holds, so processes come from
+        # a clean forkserver instead
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.workers, mp_context=multiprocessing.get_context('forkserver'))
+        return self._executor
@@ -0,0 +1,264 @@
+import atexit
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+
+class Segment:
+    """One journal file, flock()ed for as long as this worker owns it."""
+
+    def __init__(self, path):
+        self.path = path
+        # Locked before it gets its .journal name, so recover() never sees it unlocked. A
+        # .new file holds no records yet, recover() leaves it alone
+        self.file = open(path + '.new', 'ab')
+        fcntl.flock(self.file, fcntl.LOCK_EX)
+        os.rename(path + '.new', path)
+        fsync_directory(os.path.dirname(path))
+        self.records = 0  # appended
+        self.applied = 0
+        self.closed = False  # no more appends, deleted once everything is applied
+
+    def remove(self):
+        os.unlink(self.path)
+        self.file.close()
+
+
+class FlushBatch:
+    def __init__(self):
+        self.records = []
+        self.done = False
+        self.error = None
+
+
+class OrderJournal:
+    """Write-behind intake queue: orders are made durable in a local append-only
+    journal and inserted into the database later, in batches, by a writer thread.
+
+    append() returns once the record is fsynced. Records arriving while another
+    thread is flushing are written together by the next flush (group commit), so
+    a burst costs a handful of fsyncs instead of one per order. The writer hands
+    up to `batch_size` records at a time to `apply(records)`, which must insert
+    them in one transaction and tolerate records it has already inserted; an
+    exception means "try again later". `on_durable(records)`, if set, is called with
+    every fsynced group before any of its append() calls return.
+
+    Each worker writes its own segment files and holds a flock on them. A segment
+    whose lock can be taken was left behind by a worker that died; recover()
+    replays and deletes those, and runs when the journal starts.
+    """
+
+    def __init__(self, directory='order-journal', apply=None, batch_size=500, segment_records=10000,
+                 retry_delay=1.0, on_durable=None):
+        self.directory = directory
+        self.apply = apply
+        self.on_durable = on_durable
+        self.batch_size = batch_size
+        self.segment_records = segment_records
+        self.retry_delay = retry_delay
+        self._cond = threading.Condition(threading.Lock())
+        self._batch = FlushBatch()  # records waiting for the next flush
+        self._flushing = False
+        self._segment = None
+        self._segments = deque()  # own segments, oldest first
+        self._unapplied = deque()  # (segment, record) fsynced but not applied yet
+        self._pending = {}  # order id -> record, until applied
+        self._work = threading.Condition(threading.Lock())
+        self._thread = None
+        self._stopping = False
+        self._stats = {'appended': 0, 'flushes': 0, 'applied': 0, 'batches': 0, 'apply_errors': 0,
+                       'recovered': 0}
+
+    def start(self):
+        if self._thread is not None:
+            return
+        with self._work:
+            if self._thread is not None:
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name='order-journal', daemon=True)
+            self._thread.start()
+            atexit.register(self.stop)
+
+    def append(self, record):
+        self.start()
+        with self._cond:
+            batch = self._batch
+            batch.records.append(record)
+            while not batch.done:
+                if self._flushing:
+                    self._cond.wait()
+                    continue
+                # Leader: write our batch, everything arriving meanwhile goes in the next one
+                self._batch = FlushBatch()
+                self._flushing = True
+                self._cond.release()
+                try:
+                    segment = self._write(batch.records)
+                except Exception as e:
+                    batch.error = e
+                else:
+                    self._notify_durable(batch.records)
+                finally:
+                    self._cond.acquire()
+                    self._flushing = False
+                    batch.done = True
+                    self._cond.notify_all()
+                if batch.error is None:
+                    with self._work:
+                        for item in batch.records:
+                            self._unapplied.append((segment, item))
+                            self._pending[item['id']] = item
+                        self._work.notify()
+            if batch.error is not None:
+                raise batch.error
+
+    def pending(self, order_id):
+        # The journaled record of an order this worker has not inserted yet, or None
+        with self._work:
+            return self._pending.get(order_id)
+
+    def stats(self):
+        with self._work:
+            stats = dict(self._stats)
+            stats['pending'] = len(self._unapplied)
+        return stats
+
+    def stop(self, timeout=10):
+        # Drains what it can; anything left stays on disk for recover()
+        with self._work:
+            thread, self._thread = self._thread, None
+            self._stopping = True
+            self._work.notify()
+        if thread is not None:
+            thread.join(timeout)
+        with self._work:
+            if not self._unapplied:
+                while self._segments:
+                    self._segments.popleft().remove()
+                self._segment = None
+
+    def recover(self):
+        """Replay and delete segments left behind by dead workers. Returns records replayed."""
+        with self._work:
+            own = {segment.path for segment in self._segments}
+        replayed = 0
+        for name in sorted(os.listdir(self.directory)):
+            path = os.path.join(self.directory, name)
+            # Not *.journal.new: its creator may not have locked it yet
+            if not name.endswith('.journal') or path in own:
+                continue
+            with open(path, 'rb') as f:
+                try:
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue  # a live worker owns it
+                if not os.path.exists(path):
+                    continue  # another worker replayed it before we got the lock
+                records = read_segment(f)
+                for start in range(0, len(records), self.batch_size):
+                    self.apply(records[start:start + self.batch_size])
+                os.unlink(path)
+            replayed += len(records)
+            logging.warning(f'Replayed {len(records)} journaled orders from {name}')
+        with self._work:
+            self._stats['recovered'] += replayed
+        return replayed
+
+    def _notify_durable(self, records):
+        if self.on_durable is None:
+            return
+        try:
+            self.on_durable(records)
+        except Exception:
+            # The records are safe on disk, only the notification is lost
+            logging.exception('Order journal on_durable callback failed')
+
+    def _write(self, batch):
+        # Only the leader thread gets here
+        segment = self._segment
+        if segment is None or segment.records >= self.segment_records:
+            if segment is not None:
+                with self._work:
+                    segment.closed = True
+            name = f'{os.getpid()}-{time.time_ns()}.journal'
+            segment = self._segment = Segment(os.path.join(self.directory, name))
+            with self._work:
+                self._segments.append(segment)
+        data = b''.join(json.dumps(record, separators=(',', ':')).encode('utf-8') + b'\n' for record in batch)
+        try:
+            segment.file.write(data)
+            segment.file.flush()
+            os.fsync(segment.file.fileno())
+        except OSError:
+            # What made it to disk may end in a torn line, never append after it
+            with self._work:
+                segment.closed = True
+            self._segment = None
+            raise
+        segment.records += len(batch)
+        with self._work:
+            self._stats['appended'] += len(batch)
+            self._stats['flushes'] += 1
+        return segment
+
+    def _run(self):
+        while not self._stopping:
+            try:
+                self.recover()
+                break
+            except Exception:
+                logging.exception('Replaying journaled orders failed, retrying')
+                time.sleep(self.retry_delay)
+        while True:
+            with self._work:
+                while not self._unapplied and not self._stopping:
+                    self._work.wait()
+                if not self._unapplied:
+                    return
+                batch = [self._unapplied[i] for i in range(min(self.batch_size, len(self._unapplied)))]
+            try:
+                self.apply([record for _, record in batch])
+            except Exception:
+                logging.exception(f'Applying {len(batch)} journaled orders failed, retrying')
+                with self._work:
+                    self._stats['apply_errors'] += 1
+                    if self._stopping:
+                        return
+                time.sleep(self.retry_delay)
+                continue
+            with self._work:
+                for segment, record in batch:
+                    self._unapplied.popleft()
+                    self._pending.pop(record['id'], None)
+                    segment.applied += 1
+                self._stats['applied'] += len(batch)
+                self._stats['batches'] += 1
+                while self._segments and self._segments[0].closed and \
+                        self._segments[0].applied == self._segments[0].records:
+                    self._segments.popleft().remove()
+
+
+def read_segment(f):
+    records = []
+    for line in f:
+        try:
+            records.append(json.loads(line))
+        except ValueError:
+            # A torn write: it failed or the crash came before its fsync, so it was never acknowledged
+            continue
+    return records
+
+
+def fsync_directory(path):
+    # Makes a new file name durable, not just its contents
+    fd = os.open(path or '.', os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
@@ -0,0 +1,225 @@
+import argparse
+import atexit
+import logging
+import logging.handlers
+import queue
+import socketserver
+import sys
+import threading
+import time
+
+
+class LogPipeline:
+    """Bounded log queue drained by one background thread in batches.
+
+    Request threads only enqueue (see PipelineHandler). Once the queue is more than
+    `sample_watermark` full, records below WARNING are sampled (one in `sample_every`
+    is kept); once it is full every new record is dropped. Both are counted in
+    stats(), so a slow or unreachable log shipper costs log records, never latency.
+    """
+
+    def __init__(self, targets, queue_size=10000, batch_size=256, flush_interval=0.5,
+                 sample_watermark=0.8, sample_every=10):
+        self.targets = targets  # name -> logging.Handler
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.sample_above = int(queue_size * sample_watermark)
+        self.sample_every = sample_every
+        self._queue = queue.Queue(queue_size)
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stats = {
+            'enqueued': 0,
+            'dropped_full': 0,
+            'dropped_sampled': 0,
+            'written': 0,
+            'batches': 0,
+            'handler_errors': 0,
+        }
+        self._sample_counter = 0
+
+    def handler(self, *target_names, level=logging.NOTSET):
+        return PipelineHandler(self, target_names, level)
+
+    def enqueue(self, record):
+        if record.levelno < logging.WARNING and self._queue.qsize() >= self.sample_above:
+            with self._lock:
+                self._sample_counter += 1
+                keep = self._sample_counter % self.sample_every == 0
+                if not keep:
+                    self._stats['dropped_sampled'] += 1
+                    return
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            with self._lock:
+                self._stats['dropped_full'] += 1
+            return
+        with self._lock:
+            self._stats['enqueued'] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats['queued'] = self._queue.qsize()
+        return stats
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='log-pipeline', daemon=True)
+                self._thread.start()
+                atexit.register(self.stop)
+
+    def stop(self, timeout=5):
+        # Flushes what is queued; records logged after this are dropped
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is None:
+            return
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            pass
+        thread.join(timeout)
+        for target in self.targets.values():
+            target.close()
+
+    def _run(self):
+        while True:
+            record = self._queue.get()
+            if record is None:
+                return
+            batch = [record]
+            deadline = time.monotonic() + self.flush_interval
+            stopping = False
+            while len(batch) < self.batch_size:
+                try:
+                    record = self._queue.get(timeout=max(0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if record is None:
+                    stopping = True
+                    break
+                batch.append(record)
+            self._write(batch)
+            if stopping:
+                return
+
+    def _write(self, batch):
+        errors = 0
+        for name, target in self.targets.items():
+            records = [r for r in batch if name in r.log_targets and r.levelno >= target.level]
+            if not records:
+                continue
+            try:
+                if hasattr(target, 'emit_batch'):
+                    target.emit_batch(records)
+                else:
+                    for record in records:
+                        target.handle(record)
+            except Exception:
+                errors += 1
+        with self._lock:
+            self._stats['written'] += len(batch)
+            self._stats['batches'] += 1
+            self._stats['handler_errors'] += errors
+
+
+class PipelineHandler(logging.Handler):
+    """Hands records to a LogPipeline for the given targets, never blocks."""
+
+    def __init__(self, pipeline, target_names, level=logging.NOTSET):
+        super().__init__(level)
+        self.pipeline = pipeline
+        self.target_names = frozenset(target_names)
+
+    def emit(self, record):
+        try:
+            # Freeze the message now, args may change after the call returns
+            record.msg = record.getMessage()
+            record.args = None
+            record.log_targets = self.target_names
+            self.pipeline.enqueue(record)
+        except Exception:
+            self.handleError(record)
+
+
+class BatchFileHandler(logging.FileHandler):
+    """FileHandler that writes a whole batch with one write and one flush."""
+
+    def emit_batch(self, records):
+        lines = []
+        for record in records:
+            try:
+                lines.append(self.format(record) + self.terminator)
+            except Exception:
+                self.handleError(record)
+        with self.lock:
+            if self.stream is None:
+                self.stream = self._open()
+            self.stream.write(''.join(lines))
+            self.stream.flush()
+
+
+class LocalSink:
+    """Tiny UDP or TCP log collector standing in for logstash in tests and local runs.
+
+    Received lines are kept in `lines` (bounded) and optionally echoed to a stream.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, protocol='udp', keep=10000, echo=None):
+        sink = self
+        self.lines = []
+        self.keep = keep
+        self.echo = echo
+        self._lock = threading.Lock()
+
+        class UDPHandler(socketserver.BaseRequestHandler):
+            def handle(self):
+                sink._add(self.request[0].decode('utf-8', 'replace'))
+
+        class TCPHandler(socketserver.StreamRequestHandler):
+            def handle(self):
+                for line in self.rfile:
+                    sink._add(line.decode('utf-8', 'replace'))
+
+        if protocol == 'udp':
+            self.server = socketserver.ThreadingUDPServer((host, port), UDPHandler)
+        else:
+            self.server = socketserver.ThreadingTCPServer((host, port), TCPHandler)
+        self.server.daemon_threads = True
+        self.address = self.server.server_address
+        self._thread = threading.Thread(target=self.server.serve_forever, name='log-sink', daemon=True)
+
+    def _add(self, line):
+        line = line.rstrip('\n')
+        with self._lock:
+            self.lines.append(line)
+            del self.lines[:-self.keep]
+        if self.echo is not None:
+            print(line, file=self.echo, flush=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+if __name__ == '__main__':
+    # python log_pipeline.py --port 5050: print what the API would ship to logstash
+    parser = argparse.ArgumentParser(description='Local stand-in for the log shipper')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5050)
+    parser.add_argument('--protocol', choices=['udp', 'tcp'], default='udp')
+    args = parser.parse_args()
+    sink = LocalSink(args.host, args.port, args.protocol, echo=sys.stdout).start()
+    print(f'Listening on {args.protocol}://{sink.address[0]}:{sink.address[1]}', file=sys.stderr)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        sink.stop()
@@ -0,0 +1,158 @@
+import logging
+import threading
+import time
+from bisect import bisect_left
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)  # seconds
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last one is +Inf
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics:
+    """Per-process request and SQL metrics rendered in the Prometheus text format.
+
+    Every gunicorn worker keeps its own numbers; a scrape sees the worker that
+    happened to serve it.
+    """
+
+    def __init__(self, slow_request_seconds=None, logger=None):
+        self.slow_request_seconds = slow_request_seconds
+        self.logger = logger or logging.getLogger(__name__)
+        self.gauges = {}  # name -> (help, callable returning {labels tuple: value})
+        self._lock = threading.Lock()
+        self._latency = {}  # (route, method) -> Histogram
+        self._sql_count = {}  # (route, method) -> Histogram
+        self._sql_time = {}  # (route, method) -> Histogram
+        self._responses = {}  # (route, method, status) -> int
+        self._in_flight = {}  # route -> int
+
+    def init_app(self, app):
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+        app.extensions['metrics'] = self
+        if not getattr(Metrics, '_engine_hooked', False):
+            event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+            Metrics._engine_hooked = True
+
+    def add_gauge(self, name, help_text, collect):
+        self.gauges[name] = (help_text, collect)
+
+    def _before_request(self):
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        g._metrics = {
+            'route': route,
+            'start': time.perf_counter(),
+            'status': 500,
+            'sql_count': 0,
+            'sql_time': 0.0,
+            'statements': {} if self.slow_request_seconds else None,
+        }
+        with self._lock:
+            self._in_flight[route] = self._in_flight.get(route, 0) + 1
+
+    def _after_request(self, response):
+        if '_metrics' in g:
+            g._metrics['status'] = response.status_code
+        return response
+
+    def _teardown_request(self, exc):
+        stats = g.pop('_metrics', None)
+        if stats is None:
+            return
+        duration = time.perf_counter() - stats['start']
+        route = stats['route']
+        key = (route, request.method)
+        with self._lock:
+            self._in_flight[route] -= 1
+            self._latency.setdefault(key, Histogram(LATENCY_BUCKETS)).observe(duration)
+            self._sql_count.setdefault(key, Histogram(QUERY_COUNT_BUCKETS)).observe(stats['sql_count'])
+            self._sql_time.setdefault(key, Histogram(LATENCY_BUCKETS)).observe(stats['sql_time'])
+            status_key = (route, request.method, stats['status'])
+            self._responses[status_key] = self._responses.get(status_key, 0) + 1
+
+        if self.slow_request_seconds is not None and duration >= self.slow_request_seconds:
+            top = sorted(stats['statements'].items(), key=lambda s: s[1][1], reverse=True)[:10]
+            self.logger.warning('Slow request', extra={
+                'route': route,
+                'method': request.method,
+                'status': stats['status'],
+                'duration_ms': round(duration * 1000, 1),
+                'sql_count': stats['sql_count'],
+                'sql_ms': round(stats['sql_time'] * 1000, 1),
+                'queries': [
+                    {'statement': statement[:300], 'count': count, 'ms': round(total * 1000, 1)}
+                    for statement, (count, total) in top
+                ]
+            })
+
+    def render(self):
+        lines = []
+        with self._lock:
+            _render_histograms(lines, 'cafe_http_request_duration_seconds', 'Request latency by route', self._latency)
+            _render_histograms(lines, 'cafe_http_request_sql_queries', 'SQL statements per request', self._sql_count)
+            _render_histograms(lines, 'cafe_http_request_sql_seconds', 'SQL time per request', self._sql_time)
+            lines.append('# HELP cafe_http_responses_total Responses by route and status')
+            lines.append('# TYPE cafe_http_responses_total counter')
+            for (route, method, status), value in sorted(self._responses.items()):
+                lines.append(f'cafe_http_responses_total{{route="{route}",method="{method}",status="{status}"}} {value}')
+            lines.append('# HELP cafe_http_requests_in_flight Requests being served by route')
+            lines.append('# TYPE cafe_http_requests_in_flight gauge')
+            for route, value in sorted(self._in_flight.items()):
+                lines.append(f'cafe_http_requests_in_flight{{route="{route}"}} {value}')
+        for name, (help_text, collect) in self.gauges.items():
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} gauge')
+            for labels, value in sorted(collect().items()):
+                label_text = ','.join(f'{k}="{v}"' for k, v in labels)
+                lines.append(f'{name}{{{label_text}}} {value}' if label_text else f'{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+def _render_histograms(lines, name, help_text, histograms):
+    lines.append(f'# HELP {name} {help_text}')
+    lines.append(f'# TYPE {name} histogram')
+    for (route, method), histogram in sorted(histograms.items()):
+        labels = f'route="{route}",method="{method}"'
+        cumulative = 0
+        for bound, count in zip(histogram.buckets, histogram.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {histogram.count}')
+        lines.append(f'{name}_sum{{{labels}}} {histogram.sum}')
+        lines.append(f'{name}_count{{{labels}}} {histogram.count}')
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and '_metrics' in g:
+        conn.info.setdefault('_metrics_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get('_metrics_start')
+    if not starts or not has_request_context() or '_metrics' not in g:
+        return
+    elapsed = time.perf_counter() - starts.pop()
+    stats = g._metrics
+    stats['sql_count'] += 1
+    stats['sql_time'] += elapsed
+    if stats['statements'] is not None:
+        count, total = stats['statements'].get(statement, (0, 0.0))
+        stats['statements'][statement] = (count + 1, total + elapsed)
@@ -0,0 +1,161 @@
+import heapq
+import re
+import threading
+import unicodedata
+
+FUZZY_THRESHOLD = 0.3  # trigram similarity, same default as pg_trgm
+DESCRIPTION_WEIGHT = 0.5  # a match in the description counts half a match in the name
+
+
+def normalize(text):
+    # Lowercase and strip accents, so "Crème brûlée" is found as "creme brulee"
+    text = unicodedata.normalize('NFKD', text or '')
+    return ''.join(c for c in text if not unicodedata.combining(c)).lower()
+
+
+def tokenize(text):
+    return re.findall(r'\w+', normalize(text))
+
+
+def trigrams(word):
+    # Padded like pg_trgm: two spaces in front anchor prefixes, one at the end
+    padded = f'  {word} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class MenuSearchIndex:
+    """In-memory prefix and fuzzy search over item names and descriptions.
+
+    Two levels: an inverted index from word to the items using it, and a trigram
+    index over the vocabulary. A query word is matched against the vocabulary first
+    (exact, prefix, or trigram similarity), which stays small however many items
+    share the same words, then expanded to items. Every query word has to match.
+    """
+
+    def __init__(self):
+        self._items = {}  # item id -> item dict
+        self._by_restaurant = {}  # restaurant id -> set of item ids
+        self._postings = ({}, {})  # (name, description): word -> set of item ids
+        self._grams = {}  # trigram -> set of words
+        self._gram_counts = {}  # word -> number of its trigrams
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def replace_restaurant(self, restaurant_id, items):
+        # Reindex one restaurant's items, dropping the ones that are gone
+        with self._lock:
+            for item_id in list(self._by_restaurant.get(restaurant_id, ())):
+                self._remove(item_id)
+            for item in items:
+                self._add(item)
+
+    def add(self, items):
+        with self._lock:
+            for item in items:
+                self._add(item)
+
+    def search(self, query, restaurant_id=None, available=None, min_price=None, max_price=None, limit=20):
+        """Return up to `limit` item dicts, best match first."""
+        words = tokenize(query)
+        if not words:
+            return []
+        with self._lock:
+            allowed = self._by_restaurant.get(restaurant_id, set()) if restaurant_id is not None else None
+            scores = None
+            for word in words:
+                word_scores = self._score_word(word, allowed)
+                if scores is None:
+                    scores = word_scores
+                else:
+                    scores = {item_id: score + word_scores[item_id]
+                              for item_id, score in scores.items() if item_id in word_scores}
+                if not scores:
+                    return []
+            matches = []
+            for item_id, score in scores.items():
+                item = self._items[item_id]
+                if available is not None and item['available'] != available:
+                    continue
+                if min_price is not None and item['price'] < min_price:
+                    continue
+                if max_price is not None and item['price'] > max_price:
+                    continue
+                matches.append((score, -item_id, item))
+        return [item for _, _, item in heapq.nlargest(limit, matches, key=lambda m: m[:2])]
+
+    def _score_word(self, word, allowed):
+        # item id -> best score of this query word on the item
+        word_scores = {}
+        for token, score in self._match_vocabulary(word).items():
+            for postings, weight in zip(self._postings, (1.0, DESCRIPTION_WEIGHT)):
+                item_ids = postings.get(token)
+                if not item_ids:
+                    continue
+                if allowed is not None:
+                    item_ids = item_ids & allowed
+                score_here = score * weight
+                for item_id in item_ids:
+                    if word_scores.get(item_id, 0) < score_here:
+                        word_scores[item_id] = score_here
+        return word_scores
+
+    def _match_vocabulary(self, word):
+        # word in the index -> score: 1 for the word itself, less for longer words it
+        # starts, trigram similarity (scaled below prefixes) for near misses
+        grams = trigrams(word)
+        shared = {}
+        for gram in grams:
+            for token in self._grams.get(gram, ()):
+                shared[token] = shared.get(token, 0) + 1
+        matches = {}
+        for token, count in shared.items():
+            if token == word:
+                matches[token] = 1.0
+            elif token.startswith(word):
+                matches[token] = 0.6 + 0.3 * len(word) / len(token)
+            else:
+                similarity = count / (len(grams) + self._gram_counts[token] - count)
+                if similarity >= FUZZY_THRESHOLD:
+                    matches[token] = 0.6 * similarity
+        return matches
+
+    def _add(self, item):
+        if item['id'] in self._items:
+            self._remove(item['id'])
+        self._items[item['id']] = item
+        self._by_restaurant.setdefault(item['restaurant_id'], set()).add(item['id'])
+        for postings, text in zip(self._postings, (item['name'], item['description'])):
+            for token in set(tokenize(text)):
+                if token not in self._gram_counts:
+                    grams = trigrams(token)
+                    self._gram_counts[token] = len(grams)
+                    for gram in grams:
+                        self._grams.setdefault(gram, set()).add(token)
+                postings.setdefault(token, set()).add(item['id'])
+
+    def _remove(self, item_id):
+        item = self._items.pop(item_id)
+        restaurant_items = self._by_restaurant[item['restaurant_id']]
+        restaurant_items.discard(item_id)
+        if not restaurant_items:
+            del self._by_restaurant[item['restaurant_id']]
+        for postings, text in zip(self._postings, (item['name'], item['description'])):
+            for token in set(tokenize(text)):
+                item_ids = postings[token]
+                item_ids.discard(item_id)
+                if not item_ids:
+                    del postings[token]
+                    self._forget(token)
+
+    def _forget(self, token):
+        # Drop a word from the vocabulary once no item uses it anymore
+        if any(token in postings for postings in self._postings):
+            return
+        for gram in trigrams(token):
+            words = self._grams[gram]
+            words.discard(token)
+            if not words:
+                del self._grams[gram]
+        del self._gram_counts[token]
@@ -0,0 +1,62 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as api_module  # noqa: E402
+
+
+@pytest.fixture(scope='session')
+def app(tmp_path_factory):
+    workdir = tmp_path_factory.mktemp('api')
+    app = api_module.create_app({
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{workdir / "test.db"}',
+        'SECRET_KEY': 'test',
+        'LOG_FILE': str(workdir / 'api.json'),
+        'LOG_SYSLOG_ADDRESS': '',
+        'HASH_WORKERS': 0,
+        # Every request comes from one address, with more threads than a worker has
+        'RATE_LIMIT_ORDER_RATE': 0,
+        'RATE_LIMIT_READ_RATE': 0,
+        'ADMISSION_MAX_IN_FLIGHT': 0,
+    })
+    # Let concurrent writers wait for SQLite's lock instead of failing
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {'connect_args': {'timeout': 30, 'check_same_thread': False}}
+    with app.app_context():
+        api_module.upgrade_schema()
+    return app
+
+
+@pytest.fixture(scope='session')
+def restaurant(app):
+    # (restaurant id, item ids, admin Authorization headers)
+    db = api_module.db
+    with app.app_context():
+        restaurant = api_module.Restaurant(name='Test restaurant', address='1 Test St')
+        db.session.add(restaurant)
+        db.session.flush()
+        items = [api_module.Item(name=f'Dish {i}', description='', src='', price=10 + i, available=True,
+                                 restaurant_id=restaurant.id) for i in range(3)]
+        admin = api_module.AdminUser(username='test-admin', restaurant_id=restaurant.id, superuser=False)
+        admin.password_hash = 'unused'
+        db.session.add_all(items + [admin])
+        db.session.commit()
+        return restaurant.id, [item.id for item in items], {
+            'Authorization': f'Bearer {api_module.generate_token(admin)}'}
+
+
+@pytest.fixture
+def new_order(app, restaurant):
+    # Places an order and returns its id and version
+    restaurant_id, item_ids, _ = restaurant
+    client = app.test_client()
+
+    def place():
+        created = client.post('/api/order/', json={
+            'restaurant_id': restaurant_id, 'table_id': 1, 'items': {str(item_ids[0]): 2}})
+        assert created.status_code == 201, created.json
+        order_id = created.json['id']
+        return order_id, client.get(f'/api/order/{order_id}').json['version']
+    return place
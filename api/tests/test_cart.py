@@ -0,0 +1,24 @@
+"""Carts are {"item_id": quantity}: quantities must be whole numbers of at least 1."""
+import pytest
+
+
+@pytest.mark.parametrize('quantity', [True, False, 0, -2, 1.5, '2'])
+def test_invalid_quantity_is_rejected_with_the_item(app, restaurant, quantity):
+    restaurant_id, item_ids, _ = restaurant
+    cart = {str(item_ids[0]): 1, str(item_ids[1]): quantity}
+    client = app.test_client()
+
+    lookup = client.post('/api/items/lookup', json={'items': cart})
+    order = client.post('/api/order/', json={'restaurant_id': restaurant_id, 'table_id': 1, 'items': cart})
+
+    for response in (lookup, order):
+        assert response.status_code == 400
+        assert f'item {item_ids[1]}' in response.json['error']
+
+
+def test_boolean_status_is_rejected_in_batches(app, restaurant, new_order):
+    _, _, headers = restaurant
+    order_id, _ = new_order()
+    response = app.test_client().post('/api/orders/status', json={'orders': {str(order_id): True}},
+                                      headers=headers)
+    assert response.status_code == 400
@@ -0,0 +1,115 @@
+"""Status updates from many devices at once: exactly one wins, the rest get a 409."""
+import threading
+
+import pytest
+from sqlalchemy import event
+
+import app as api_module
+
+DEVICES = 16
+
+
+def hammer(app, requests):
+    # Runs request(client) for each entry from its own thread, all released together
+    barrier = threading.Barrier(len(requests))
+    responses = [None] * len(requests)
+
+    def device(i):
+        client = app.test_client()
+        barrier.wait()
+        responses[i] = requests[i](client)
+
+    threads = [threading.Thread(target=device, args=(i,)) for i in range(len(requests))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return responses
+
+
+def test_concurrent_puts_with_same_version_have_one_winner(app, restaurant, new_order):
+    _, _, headers = restaurant
+    order_id, version = new_order()
+
+    def put(status):
+        return lambda client: client.put(f'/api/order/{order_id}', json={'status': status, 'version': version},
+                                         headers=headers)
+    responses = hammer(app, [put((1, 2, 3)[i % 3]) for i in range(DEVICES)])
+
+    statuses = [response.status_code for response in responses]
+    assert statuses.count(200) == 1, statuses
+    assert statuses.count(409) == DEVICES - 1, statuses
+    final = app.test_client().get(f'/api/order/{order_id}').json
+    winner = next(response for response in responses if response.status_code == 200)
+    assert final['status'] == winner.json['status']
+    assert final['version'] == version + 1
+    for response in responses:
+        if response.status_code == 409:
+            # Losers are told what the order looks like now
+            assert response.json['status'] == final['status']
+            assert response.json['version'] == final['version']
+
+
+def test_put_with_stale_version_conflicts(app, restaurant, new_order):
+    _, _, headers = restaurant
+    order_id, version = new_order()
+    client = app.test_client()
+
+    assert client.put(f'/api/order/{order_id}', json={'status': 1, 'version': version},
+                      headers=headers).status_code == 200
+    stale = client.put(f'/api/order/{order_id}', json={'status': 3, 'version': version}, headers=headers)
+    assert stale.status_code == 409
+    assert stale.json['status'] == 1
+    assert stale.json['version'] == version + 1
+
+
+def test_concurrent_batches_have_one_winner(app, restaurant, new_order):
+    _, _, headers = restaurant
+    order_id, version = new_order()
+
+    def close(client):
+        return client.post('/api/orders/status', json={'orders': {str(order_id): 2}}, headers=headers)
+    responses = hammer(app, [close] * DEVICES)
+
+    winners = [r for r in responses if r.status_code == 200 and r.json['updated'] == 1]
+    assert len(winners) == 1, [(r.status_code, r.json) for r in responses]
+    for response in responses:
+        if response is winners[0]:
+            continue
+        # Either the order changed under the batch's update, or the batch read it completed
+        assert response.status_code == 409 or (
+            response.status_code == 200 and response.json['results'][0]['error'] == 'Order already completed'
+        ), response.json
+    final = app.test_client().get(f'/api/order/{order_id}').json
+    assert (final['status'], final['version']) == (2, version + 1)
+
+
+@pytest.fixture
+def engine(app):
+    with app.app_context():
+        return api_module.db.engine
+
+
+def test_batch_with_stale_status_conflicts(app, engine, restaurant, new_order):
+    _, _, headers = restaurant
+    order_id, version = new_order()
+    moved = []
+
+    def move_first(conn, cursor, statement, parameters, context, executemany):
+        # Another device moves the order between the batch's read and its conditional update
+        if not moved and statement.startswith('UPDATE "order" SET status='):
+            moved.append(order_id)
+            cursor.execute('UPDATE "order" SET status = 1, version = version + 1 WHERE id = ?', (order_id,))
+
+    event.listen(engine, 'before_cursor_execute', move_first)
+    try:
+        response = app.test_client().post('/api/orders/status', json={'orders': {str(order_id): 3}},
+                                          headers=headers)
+    finally:
+        event.remove(engine, 'before_cursor_execute', move_first)
+
+    assert moved
+    assert response.status_code == 409
+    # The batch rolled back, its own change included
+    final = app.test_client().get(f'/api/order/{order_id}').json
+    assert (final['status'], final['version']) == (0, version)
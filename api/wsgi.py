@@ -0,0 +1,6 @@
+from app import broker, create_app
+
+# Production entry point: gunicorn -c gunicorn.conf.py wsgi:app
+app = create_app()
+# Listen right away: other workers announce accepted orders that are not inserted yet
+broker.start()
@@ -38,20 +38,8 @@ const handleAdd = async () => {
             return;
         }
 
-        // Fetch the full item data using the ID from the POST response
-        const itemRes = await fetch(`${API_BASE_URL}/api/items/${result.id}`, {
-            method: "GET",
-        });
-
-        const item = await itemRes.json();
-
-        if (!itemRes.ok) {
-            console.error("Error fetching item details:", item.error || item.detail);
-            return;
-        }
-
-        // Pass the full item object to the parent component
-        if (onItemAdded) onItemAdded(item);  // Pass the whole item object
+        // The POST response already carries the full item
+        if (onItemAdded) onItemAdded(result.item);
 
         // Reset form
         setName("");
@@ -1,4 +1,4 @@
-import { useState, useEffect } from 'react';
+import { useState, useEffect, useRef } from 'react';
 import { useNavigate } from 'react-router-dom';
 
 const Orders = () => {
@@ -17,6 +17,12 @@ const Orders = () => {
     const [updatedOrders, setUpdatedOrders] = useState({});
     const [restaurantId, setRestaurantId] = useState(null);
     const [superuser, setSuperuser] = useState(false);
+    const [restaurants, setRestaurants] = useState([]);
+    const [openOnly, setOpenOnly] = useState(false);
+    const [nextCursor, setNextCursor] = useState(null);
+    const [loadingMore, setLoadingMore] = useState(false);
+    // Position in /api/orders/changes, for catching up when the event stream is unavailable
+    const changesCursor = useRef(null);
 
     useEffect(() => {
         const token = localStorage.getItem('access_token');
@@ -45,6 +51,12 @@ const Orders = () => {
         .then((data) => {
             setSuperuser(data.superuser);
             setRestaurantId(data.restaurant_id);
+            if (data.superuser) {
+                // Every restaurant, not only the ones that appear on the loaded pages
+                return fetch(`${API_BASE_URL}/api/restaurants?fields=id,name`)
+                    .then((response) => response.json())
+                    .then(setRestaurants);
+            }
         })
         .catch((error) => {
             console.error('Error:', error);
@@ -52,6 +64,15 @@ const Orders = () => {
         });
     }, [navigate]);
 
+    // Filters go to the server, so pages hold only the orders the board shows
+    const ordersQuery = (cursor) => {
+        const params = new URLSearchParams();
+        if (selectedRestaurant !== '') params.set('restaurant_id', selectedRestaurant);
+        if (openOnly) params.set('status', '0,1');
+        if (cursor !== undefined) params.set('cursor', cursor);
+        return params.toString();
+    };
+
     useEffect(() => {
         const token = localStorage.getItem('access_token');
 
@@ -62,7 +83,10 @@ const Orders = () => {
 
         const API_BASE_URL = import.meta.env.VITE_API_BASE_URL || 'http://127.0.0.1:8000';
 
-        fetch(`${API_BASE_URL}/api/orders`, {
+        setOrders(null);
+        setNextCursor(null);
+        changesCursor.current = null;
+        fetch(`${API_BASE_URL}/api/orders?${ordersQuery()}`, {
             method: 'GET',
             headers: {
                 'Authorization': `Bearer ${token}`,
@@ -80,12 +104,143 @@ const Orders = () => {
             })
             .then((data) => {
                 setOrders(data.orders);
+                setNextCursor(data.next_cursor);
+                changesCursor.current = data.changes_cursor;
             })
             .catch((error) => {
                 console.error('Error:', error);
                 navigate('/login', { replace: true });
             });
-    }, [navigate]);
+    }, [navigate, selectedRestaurant, openOnly]);
+
+    // Live updates for the board: status changes and new orders are pushed over SSE
+    useEffect(() => {
+        const token = localStorage.getItem('access_token');
+        if (!token) return;
+
+        const API_BASE_URL = import.meta.env.VITE_API_BASE_URL || 'http://127.0.0.1:8000';
+        const restaurantParam = selectedRestaurant !== '' ? `&restaurant_id=${selectedRestaurant}` : '';
+        // Same filter as ordersQuery(), for orders merged in from events and catch-ups
+        const shown = (order) => !openOnly || order.status === 0 || order.status === 1;
+
+        // Delta sync: fetch only the orders changed since the last cursor
+        const catchUp = async () => {
+            if (!changesCursor.current) return;
+            let more = true;
+            while (more) {
+                const response = await fetch(`${API_BASE_URL}/api/orders/changes?since=${changesCursor.current}${restaurantParam}`, {
+                    headers: { 'Authorization': `Bearer ${token}` },
+                });
+                if (!response.ok) return;
+                const data = await response.json();
+                changesCursor.current = data.next_cursor;
+                more = data.has_more;
+                if (data.orders.length === 0 && data.archived.length === 0) continue;
+                const changed = new Map(data.orders.map(order => [order.id, order]));
+                // Archived orders left the order table, the board drops them too
+                const archived = new Set(data.archived);
+                setOrders(prevOrders => {
+                    if (!prevOrders) return prevOrders;
+                    const known = new Set(prevOrders.map(order => order.id));
+                    const created = data.orders.filter(order => !known.has(order.id) && shown(order)).reverse();
+                    return [...created, ...prevOrders
+                        .filter(order => !archived.has(order.id))
+                        .map(order => changed.get(order.id) || order)
+                        .filter(shown)];
+                });
+            }
+        };
+        let source = null;
+        let retry = null;
+        let opened = false;
+        let closed = false;
+        const reconnect = () => {
+            retry = setTimeout(connect, 5000);
+            catchUp().catch((error) => console.error('Error:', error));
+        };
+        // EventSource cannot send headers: a short-lived stream ticket goes in the URL, never the token
+        const connect = async () => {
+            retry = null;
+            let ticket;
+            try {
+                const response = await fetch(`${API_BASE_URL}/api/orders/events/ticket`, {
+                    method: 'POST',
+                    headers: { 'Authorization': `Bearer ${token}` },
+                });
+                if (!response.ok) throw new Error(`Stream ticket refused: ${response.status}`);
+                ({ ticket } = await response.json());
+            } catch (error) {
+                console.error('Error:', error);
+                if (!closed) reconnect();
+                return;
+            }
+            if (closed) return;
+            source = new EventSource(
+                `${API_BASE_URL}/api/orders/events?ticket=${encodeURIComponent(ticket)}${restaurantParam}`);
+            source.addEventListener('status', (e) => {
+                const { order: update } = JSON.parse(e.data);
+                setOrders(prevOrders => prevOrders && prevOrders.map(order =>
+                    order.id === update.id ? { ...order, status: update.status, version: update.version } : order
+                ).filter(shown));
+            });
+            source.addEventListener('created', (e) => {
+                const { order: created } = JSON.parse(e.data);
+                // Events carry no items, fetch the full order once
+                fetch(`${API_BASE_URL}/api/order/${created.id}`)
+                    .then((response) => response.json())
+                    .then((data) => {
+                        setOrders(prevOrders => prevOrders && shown(created)
+                            && !prevOrders.some(order => order.id === created.id)
+                            ? [{ ...created, ...data }, ...prevOrders]
+                            : prevOrders);
+                    })
+                    .catch((error) => console.error('Error:', error));
+            });
+
+            // Events sent while the browser was reconnecting are lost, fetch what changed meanwhile
+            source.onopen = () => {
+                if (opened) catchUp().catch((error) => console.error('Error:', error));
+                opened = true;
+            };
+            // The server may ask for a resync after dropping events
+            source.addEventListener('resync', () => catchUp().catch((error) => console.error('Error:', error)));
+            // Closed when the server refuses the stream (busy, or the ticket expired on a browser
+            // reconnect): catch up and open a new stream with a fresh ticket
+            source.onerror = () => {
+                if (source.readyState === EventSource.CLOSED && retry === null && !closed) reconnect();
+            };
+        };
+        connect();
+        return () => {
+            closed = true;
+            if (source) source.close();
+            if (retry !== null) clearTimeout(retry);
+        };
+    }, [selectedRestaurant, openOnly]);
+
+    const loadMore = async () => {
+        const token = localStorage.getItem('access_token');
+        const API_BASE_URL = import.meta.env.VITE_API_BASE_URL || 'http://127.0.0.1:8000';
+
+        setLoadingMore(true);
+        try {
+            const response = await fetch(`${API_BASE_URL}/api/orders?${ordersQuery(nextCursor)}`, {
+                method: 'GET',
+                headers: {
+                    'Authorization': `Bearer ${token}`,
+                },
+            });
+            if (!response.ok) throw new Error('Failed to fetch orders');
+
+            const data = await response.json();
+            setOrders(prevOrders => [...prevOrders, ...data.orders]);
+            setNextCursor(data.next_cursor);
+        } catch (error) {
+            console.error('Error:', error);
+        } finally {
+            setLoadingMore(false);
+        }
+    };
 
     const handleStatusChange = (orderId, newStatus) => {
         setStatusUpdates(prev => ({ ...prev, [orderId]: newStatus }));
@@ -95,6 +250,7 @@ const Orders = () => {
         const token = localStorage.getItem('access_token');
         const API_BASE_URL = import.meta.env.VITE_API_BASE_URL || 'http://127.0.0.1:8000';
         const newStatus = statusUpdates[orderId];
+        const current = orders.find(order => order.id === orderId);
 
         // Set loading
         setLoadingOrders(prev => ({ ...prev, [orderId]: true }));
@@ -107,17 +263,27 @@ const Orders = () => {
                     'Content-Type': 'application/json',
                     'Authorization': `Bearer ${token}`,
                 },
-                body: JSON.stringify({ status: newStatus }),
+                // The version this board shows; the server refuses the change if it is stale
+                body: JSON.stringify({ status: newStatus, version: current?.version }),
             });
 
-            if (!response.ok) throw new Error('Update failed');
-
             const data = await response.json();
-            console.log('Status updated:', data);
+            if (response.status === 409) {
+                // Someone else changed the order first, show what it is now
+                setOrders(prevOrders =>
+                    prevOrders.map(order =>
+                        order.id === orderId ? { ...order, status: data.status, version: data.version } : order
+                    )
+                );
+                setStatusUpdates(prev => ({ ...prev, [orderId]: data.status }));
+                alert('This order was changed on another device. Check its status and try again.');
+                return;
+            }
+            if (!response.ok) throw new Error('Update failed');
 
             setOrders(prevOrders =>
                 prevOrders.map(order =>
-                    order.id === orderId ? { ...order, status: newStatus } : order
+                    order.id === orderId ? { ...order, status: data.status, version: data.version } : order
                 )
             );
 
@@ -135,6 +301,40 @@ const Orders = () => {
     };
 
 
+    // End of service: complete every shown in-progress order in one request
+    const completeInProgress = async () => {
+        const token = localStorage.getItem('access_token');
+        const API_BASE_URL = import.meta.env.VITE_API_BASE_URL || 'http://127.0.0.1:8000';
+        const ids = orders
+            .filter(order => order.status === 1)
+            .map(order => order.id);
+        if (ids.length === 0) return;
+
+        try {
+            const response = await fetch(`${API_BASE_URL}/api/orders/status`, {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json',
+                    'Authorization': `Bearer ${token}`,
+                },
+                body: JSON.stringify({ ids, status: 2 }),
+            });
+            const data = await response.json();
+            if (!response.ok) throw new Error(data.error || 'Failed to update orders');
+
+            const updated = new Map(data.results.filter(r => !r.error).map(r => [r.id, r]));
+            setOrders(prev => prev.map(order =>
+                updated.has(order.id)
+                    ? { ...order, status: updated.get(order.id).status, version: updated.get(order.id).version }
+                    : order
+            ));
+        } catch (error) {
+            console.error('Error updating orders:', error);
+            alert('Failed to update orders');
+        }
+    };
+
+
     if (!orders) {
         return <p>Loading orders...</p>;
     }
@@ -147,20 +347,25 @@ const Orders = () => {
                     Filter by Restaurant:
                     <select className='filter' value={selectedRestaurant} onChange={(e) => setSelectedRestaurant(e.target.value)}>
                         {superuser && <option value="">All Restaurants</option>}
-                        {orders && superuser && [...new Set(orders.map(order => order.restaurant_id))].map(id => (
-                            <option key={id} value={id}>Restaurant #{id}</option>
+                        {superuser && restaurants.map(({ id, name }) => (
+                            <option key={id} value={id}>Restaurant #{id} {name}</option>
                         ))}
-                        {orders && !superuser && (
+                        {!superuser && (
                             <option value={restaurantId}>Restaurant #{restaurantId}</option>
                         )}
                     </select>
                 </label>
+                <label style={{ marginLeft: '10px' }}>
+                    <input type='checkbox' checked={openOnly} onChange={(e) => setOpenOnly(e.target.checked)} />
+                    Open orders only
+                </label>
+                <button className='butt-order' onClick={completeInProgress} style={{ marginLeft: '10px' }}>
+                    Complete all in progress
+                </button>
             </div>
 
             <ul className='menu-div'>
-                {orders
-                    .filter(order => selectedRestaurant === (superuser?'':restaurantId) || order.restaurant_id === Number(selectedRestaurant))
-                    .map((order) => (
+                {orders.map((order) => (
 
                     <li key={order.id} className='cart-items' id='admin'>
                         <strong>
@@ -217,6 +422,11 @@ const Orders = () => {
                     </li>
                 ))}
             </ul>
+            {nextCursor !== null && (
+                <button className='butt-order' onClick={loadMore} disabled={loadingMore}>
+                    {loadingMore ? 'Loading...' : 'Load more'}
+                </button>
+            )}
         </>
     );
 };
@@ -15,27 +15,42 @@ function Cart() {
     });
 
     const [itemsInfo, setItemsInfo] = useState({});
+    const [subtotal, setSubtotal] = useState(0);
 
     useEffect(() => {
         const API_BASE_URL = import.meta.env.VITE_API_BASE_URL || 'http://127.0.0.1:8000';
         
         async function fetchItemsInfo() {
-            const newItemsInfo = {};
-            for (const [itemId] of Object.entries(cart)) {
-                try {
-                    const response = await fetch(`${API_BASE_URL}/api/items/${itemId}`);
-                    // const response = fetch(`${API_BASE_URL}/api/items/${itemId}`);
-                    if (!response.ok) {
-                        throw new Error('Failed to fetch item details');
-                    }
-                    const data = await response.json();
-                    // const data =  response.json();
-                    newItemsInfo[itemId] = data;
-                } catch (error) {
-                    console.error(`Error fetching item ${itemId}:`, error);
+            if (Object.keys(cart).length === 0) {
+                setItemsInfo({});
+                setSubtotal(0);
+                return;
+            }
+            // One request for the whole cart, the server also computes the subtotal
+            try {
+                const response = await fetch(`${API_BASE_URL}/api/items/lookup`, {
+                    method: 'POST',
+                    headers: {
+                        'Content-Type': 'application/json',
+                    },
+                    body: JSON.stringify({ items: cart }),
+                });
+                if (!response.ok) {
+                    throw new Error('Failed to fetch item details');
+                }
+                const data = await response.json();
+                const newItemsInfo = {};
+                for (const item of data.items) {
+                    newItemsInfo[item.id] = item;
                 }
+                if (data.not_found.length > 0) {
+                    console.error('Items not found:', data.not_found);
+                }
+                setItemsInfo(newItemsInfo);
+                setSubtotal(data.subtotal);
+            } catch (error) {
+                console.error('Error fetching cart items:', error);
             }
-            setItemsInfo(newItemsInfo);
         }
 
         fetchItemsInfo();
@@ -61,13 +76,23 @@ function Cart() {
         const API_BASE_URL = import.meta.env.VITE_API_BASE_URL || 'http://127.0.0.1:8000';
         const aboba = localStorage.getItem('cart');
         console.log(aboba);
-        
+        const body = JSON.stringify({ table_id, restaurant_id, items: cart });
+
+        // Retries of the same cart reuse the key, so a lost response never doubles the order
+        let pending = JSON.parse(localStorage.getItem('pending_order') || 'null');
+        if (!pending || pending.body !== body) {
+            const key = window.crypto?.randomUUID?.() || `${Date.now()}-${Math.random().toString(36).slice(2)}`;
+            pending = { key, body };
+            localStorage.setItem('pending_order', JSON.stringify(pending));
+        }
+
         fetch(`${API_BASE_URL}/api/order/`, {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json',
+                'Idempotency-Key': pending.key,
             },
-            body: JSON.stringify({ table_id, restaurant_id, items: cart }),
+            body,
         })
             .then((response) => {
                 if (!response.ok) {
@@ -80,6 +105,7 @@ function Cart() {
                 localStorage.setItem('order_id', data.id);
                 setCart({}); // Clear cart
                 localStorage.removeItem('cart'); // Remove cart from localStorage
+                localStorage.removeItem('pending_order');
                 navigate(`/order/${data.id}`); // Redirect to order details page using order ID
             })
             .catch((error) => {
@@ -87,18 +113,7 @@ function Cart() {
                 alert('Failed to place order. Please try again.');
             });
     }
-    var total = 0;
-    Object.entries(cart).map(([itemId, item]) => {
-        const inf = itemsInfo[itemId];
-        console.log("Item ID:", itemId);
-        console.log("Item:", item);
-        console.log("Info:", inf);
-        if (inf) {
-            // total += inf.price * cart[itemId];
-            total += inf.price * item;
-        }
-        
-    });
+    const total = subtotal;
 
     return (
         <div className='cart-main'>
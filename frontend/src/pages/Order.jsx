@@ -17,12 +17,21 @@ function Order() {
         let order_id = id || localStorage.getItem('order_id');
         if (order_id !== null){
             localStorage.setItem('order_id', order_id);
-            // Fetch order details from the backend
-            fetch(`${API_BASE_URL}/api/order/${order_id}`, {
+            // Fetch order details from the backend. A just accepted order may still sit in
+            // an intake journal: the API answers 202 until it is inserted, and a 404 right
+            // after submitting is retried a few times too.
+            const fetchOrder = (attempt) => fetch(`${API_BASE_URL}/api/order/${order_id}`, {
                 method: 'GET',
-            })
+            }).then((response) => {
+                if ((response.status === 202 && attempt < 60) || (response.status === 404 && attempt < 5)) {
+                    return new Promise((resolve) => setTimeout(resolve, Math.min(300 * (attempt + 1), 2000)))
+                        .then(() => fetchOrder(attempt + 1));
+                }
+                return response;
+            });
+            fetchOrder(0)
                 .then((response) => {
-                    if (!response.ok) {
+                    if (response.status !== 200) {
                         throw new Error('Failed to fetch order details');
                     }
                     return response.json();
@@ -40,11 +49,43 @@ function Order() {
             }
         
     }, [id]);
+    // Live status updates pushed by the backend instead of re-fetching the order
+    useEffect(() => {
+        if (!order?.id) return;
+        let source = null;
+        let reconnect = null;
+        let closed = false;
+        const connect = () => {
+            if (closed) return;
+            source = new EventSource(`${API_BASE_URL}/api/order/${order.id}/events`);
+            source.addEventListener('status', (e) => {
+                const { order: update } = JSON.parse(e.data);
+                setOrder(prev => prev ? { ...prev, status: update.status } : prev);
+            });
+            // EventSource gives up after an error response (a 404 or 503), open a new one
+            source.onerror = () => {
+                if (source.readyState !== EventSource.CLOSED) return;
+                reconnect = setTimeout(() => {
+                    fetch(`${API_BASE_URL}/api/order/${order.id}`)
+                        .then((response) => response.status === 200 ? response.json() : null)
+                        .then((data) => data && setOrder(prev => prev ? { ...prev, status: data.status } : prev))
+                        .catch((error) => console.error('Error:', error))
+                        .finally(connect);
+                }, 3000);
+            };
+        };
+        connect();
+        return () => {
+            closed = true;
+            clearTimeout(reconnect);
+            source.close();
+        };
+    }, [order?.id]);
     const [restaurant, setRestaurant] = useState(null);
     // Fetch restaurant details based on the order's restaurant_id
     useEffect(() => {
         if (order?.restaurant_id === undefined || order?.restaurant_id === null) return;
-        fetch(`${API_BASE_URL}/api/restaurants/${order.restaurant_id}`)
+        fetch(`${API_BASE_URL}/api/restaurants/${order.restaurant_id}?fields=name,address,working_hours,contact_info,description`)
             .then(res => res.json())
             .then(setRestaurant)
             .catch(() => setRestaurant(null));
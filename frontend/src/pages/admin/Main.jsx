@@ -51,8 +51,8 @@ function Main() {
                 navigate('/login', { replace: true });
             });
 
-        // Fetch restaurants
-        fetch(`${API_BASE_URL}/api/restaurants`, {
+        // Fetch restaurants (only names are needed for the admin form)
+        fetch(`${API_BASE_URL}/api/restaurants?fields=id,name`, {
             headers: {
                 'Authorization': `Bearer ${token}`,
             },